@@ -0,0 +1,180 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List, Sequence, Tuple
+
+import numpy as np
+
+from detectors import CONF_THRESHOLD, IOU_THRESHOLD, VEHICLE_CLASSES, ONNXBackend
+from metrics import Metrics
+from tracker import ByteTracker
+
+# A function that detects the objects in a list of frames and returns (boxes xyxy, scores, class IDs) per frame
+DetectBatch = Callable[[List[np.ndarray]], List[Tuple[np.ndarray, np.ndarray, np.ndarray]]]
+
+_CLOSE = object()
+
+
+class BatchScheduler:
+    """
+    Collect the frames of several streams into one detection batch.
+
+    Every stream calls detect_objects from its own thread and blocks until its detections are back.
+    The scheduler thread runs a batch as soon as max_batch_size frames are waiting or max_wait seconds
+    after the first frame of the batch arrived, whichever comes first, so batching adds at most
+    max_wait to the latency of a frame. It has the detect_objects method of DetectorONNX, so it can
+    take the detector's place in an ONNXBackend; every stream then keeps its own tracker and counts.
+    """
+
+    def __init__(self, detect_batch: DetectBatch, max_batch_size: int = 8, max_wait: float = 0.01, metrics: Metrics = None):
+        """
+        Parameters:
+            detect_batch (DetectBatch): Detects the objects in a list of frames, e.g. DetectorONNX.detect_batch.
+            max_batch_size (int, optional): The most frames per batch. Defaults to 8.
+            max_wait (float, optional): The most seconds the first frame of a batch waits for more frames. Defaults to 0.01.
+            metrics (Metrics, optional): Where to record the batch sizes, wait and detection times. Defaults to None.
+        """
+        self.detect_batch = detect_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.metrics = metrics if metrics is not None else Metrics(enabled=False)
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='batch-scheduler', daemon=True)
+        self._thread.start()
+
+    def submit(self, frame: np.ndarray) -> Future:
+        """
+        Queue a frame for the next batch.
+
+        Returns:
+            Future: Resolves to the (boxes, scores, class_ids) of the frame.
+        """
+        future = Future()
+        self._queue.put((frame, future))
+        return future
+
+    def detect_objects(self, frame: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        return self.submit(frame).result()
+
+    def close(self) -> None:
+        """
+        Stop the scheduler thread after the frames already queued are detected.
+        """
+        self._queue.put(_CLOSE)
+        self._thread.join()
+
+    def _collect(self) -> Tuple[list, bool]:
+        # Block for the first frame, then take more until the batch is full or the deadline passes
+        first = self._queue.get()
+        if first is _CLOSE:
+            return [], True
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _CLOSE:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self) -> None:
+        closed = False
+        while not closed:
+            batch, closed = self._collect()
+            if not batch:
+                continue
+            frames = [frame for frame, _ in batch]
+            try:
+                with self.metrics.timer('detect_batch'):
+                    detections = self.detect_batch(frames)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.metrics.increment('batched_frames', len(batch))
+            self.metrics.increment('batches')
+            for (_, future), result in zip(batch, detections):
+                future.set_result(result)
+
+
+def ultralytics_detect_batch(
+        model,
+        device: str = 'cpu',
+        imgsz=(640, 640),
+        classes: Sequence[int] = VEHICLE_CLASSES,
+        conf: float = CONF_THRESHOLD,
+        iou: float = IOU_THRESHOLD) -> DetectBatch:
+    """
+    Wrap a YOLO model into a DetectBatch that runs one predict call per batch.
+    """
+    def detect_batch(frames: List[np.ndarray]) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        results = model.predict(frames, classes=list(classes), device=device, imgsz=imgsz, conf=conf, iou=iou, verbose=False)
+        return [(result.boxes.xyxy.cpu().numpy(), result.boxes.conf.cpu().numpy(), result.boxes.cls.cpu().numpy())
+                for result in results]
+
+    return detect_batch
+
+
+def create_batch_scheduler(
+        backend: str,
+        model_path: str,
+        device: str = 'cpu',
+        imgsz=(640, 640),
+        max_batch_size: int = 8,
+        max_wait: float = 0.01,
+        threads: int = None,
+        metrics: Metrics = None,
+        inter_threads: int = None,
+        thread_affinities: str = None,
+        spinning: bool = None) -> BatchScheduler:
+    """
+    Load a model by backend name and start a scheduler that batches its detections.
+
+    Parameters:
+        backend (str): 'ultralytics' or 'onnx', see detectors.create_backend.
+        model_path (str): The path to the .pt weights or the .onnx model. An ONNX model needs a dynamic or large enough batch axis.
+        device (str, optional): The device to run the inference on. Defaults to 'cpu'.
+        imgsz (tuple, optional): The size of the input image (height, width). Defaults to (640, 640).
+        max_batch_size (int, optional): The most frames per batch. Defaults to 8.
+        max_wait (float, optional): The most seconds a frame waits for the batch to fill. Defaults to 0.01.
+        threads (int, optional): The number of CPU threads the runtime may use. Defaults to the runtime's default.
+        metrics (Metrics, optional): Where to record the batch sizes, wait and detection times. Defaults to None.
+        inter_threads (int, optional): The ONNX session's inter-op threads, see detectors.create_backend. Defaults to None.
+        thread_affinities (str, optional): The ONNX session's thread affinities, see detectors.create_backend. Defaults to None.
+        spinning (bool, optional): Whether idle ONNX Runtime threads spin. Defaults to the runtime's default.
+
+    Returns:
+        BatchScheduler: The running scheduler.
+    """
+    if backend == 'ultralytics':
+        from ultralytics import YOLO
+
+        if threads:
+            import torch
+
+            torch.set_num_threads(threads)
+        detect_batch = ultralytics_detect_batch(YOLO(model_path), device=device, imgsz=imgsz)
+    elif backend == 'onnx':
+        from legacy_onnx_detector import DetectorONNX
+
+        detector = DetectorONNX(model_path, device=device, conf_threshold=CONF_THRESHOLD, iou_threshold=IOU_THRESHOLD,
+                                imgsz=imgsz, batch_size=max_batch_size, metrics=metrics, threads=threads,
+                                inter_threads=inter_threads, parallel=bool(inter_threads and inter_threads > 1),
+                                thread_affinities=thread_affinities, spinning=spinning)
+        detect_batch = detector.detect_batch
+    else:
+        raise ValueError(f"Unknown detector backend: {backend!r}, expected 'ultralytics' or 'onnx'")
+    return BatchScheduler(detect_batch, max_batch_size=max_batch_size, max_wait=max_wait, metrics=metrics)
+
+
+def stream_backend(scheduler: BatchScheduler, classes: Sequence[int] = VEHICLE_CLASSES) -> ONNXBackend:
+    """
+    Create the backend of one stream: detection through the shared scheduler, tracking with its own ByteTracker.
+    The scheduler keeps the metrics it was created with.
+    """
+    return ONNXBackend(scheduler, tracker=ByteTracker(), classes=classes, detector_metrics=False)
@@ -0,0 +1,366 @@
+"""
+End-to-end benchmark on synthetic traffic video.
+
+Every scenario renders a reproducible video of coloured rectangles moving across the counting
+lines at a controlled density, and derives the ground-truth crossings from the true trajectories
+with the same counting rules inference() uses. Each backend then runs inference.inference() over
+the scenario in a fresh process, so peak RSS is measured per run. The per-stage latencies come from
+metrics.Metrics and include the DetectorONNX preprocess / inference / postprocess steps for the ONNX backend.
+
+Backends:
+    synthetic    Finds the rectangles by background subtraction and tracks them with ByteTracker.
+                 Needs no model, so it measures the pipeline itself and gives meaningful count accuracy.
+    ultralytics  The YOLO weights given by --weights.
+    onnx         DetectorONNX with the model given by --onnx-model.
+
+Usage:
+    python benchmark.py --scenarios light dense --backends synthetic onnx --onnx-model yolov8m.onnx --output benchmark.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import resource
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+import cv2
+import numpy as np
+
+import config
+from crossing import LineCrossingCounter
+from detectors import DetectorBackend, create_backend
+from inference import default_counting_lines, inference
+from metrics import Metrics
+from tracker import ByteTracker
+
+# Background gray level of the synthetic scenes
+BACKGROUND = 60
+
+
+@dataclass(frozen=True)
+class Scenario:
+    """
+    A synthetic traffic scene.
+
+    Attributes:
+        name (str): The name of the scenario.
+        vehicles (int): The number of vehicles on screen at any time.
+        frames (int): The number of frames.
+        speed (Tuple[float, float]): The range of vehicle speeds in pixels per frame at the inference size.
+        scale (float): The video resolution relative to the inference size, so resizing is part of the run.
+        seed (int): The random seed.
+    """
+    name: str
+    vehicles: int
+    frames: int = 300
+    speed: Tuple[float, float] = (2.0, 6.0)
+    scale: float = 1.5
+    seed: int = 0
+
+
+SCENARIOS: Dict[str, Scenario] = {
+    'light': Scenario('light', vehicles=4),
+    'medium': Scenario('medium', vehicles=12),
+    'dense': Scenario('dense', vehicles=30, speed=(1.0, 4.0)),
+}
+
+
+def generate_scenario(scenario: Scenario, video_path: str, imgsz: Tuple[int, int]) -> Dict[str, int]:
+    """
+    Render a scenario to a video file and return its ground-truth counts.
+
+    Vehicles enter from a random edge, drive straight across the frame and are replaced by a new vehicle
+    when they leave it. The ground truth counts the true integer centers with the configured counting lines.
+
+    Parameters:
+        scenario (Scenario): The scenario to render.
+        video_path (str): The path to write the video to.
+        imgsz (Tuple[int, int]): The inference size (height, width) the trajectories are defined in.
+
+    Returns:
+        Dict[str, int]: The true number of crossings per direction.
+    """
+    rng = np.random.default_rng(scenario.seed)
+    height, width = imgsz
+    video_size = (int(width * scenario.scale), int(height * scenario.scale))
+    writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'mp4v'), 30, video_size)
+    counter = LineCrossingCounter(default_counting_lines(imgsz))
+
+    def spawn() -> np.ndarray:
+        # Start just outside a random edge, heading into the frame
+        size = rng.uniform(24, 48, 2)
+        speed = rng.uniform(*scenario.speed)
+        edge = rng.integers(4)
+        position = rng.uniform([0, 0], [width, height])
+        angle = rng.uniform(-0.4, 0.4)
+        direction = [(1, 0), (-1, 0), (0, 1), (0, -1)][edge]
+        if edge < 2:
+            position[0] = -size[0] if edge == 0 else width + size[0]
+        else:
+            position[1] = -size[1] if edge == 2 else height + size[1]
+        velocity = speed * np.array([direction[0] * np.cos(angle) - direction[1] * np.sin(angle),
+                                     direction[0] * np.sin(angle) + direction[1] * np.cos(angle)])
+        color = rng.integers(120, 256, 3)
+        return np.concatenate([position, velocity, size, color])
+
+    vehicles = np.stack([spawn() for _ in range(scenario.vehicles)])
+    ids = np.arange(1, scenario.vehicles + 1)
+    next_id = scenario.vehicles + 1
+    for _ in range(scenario.frames):
+        frame = np.full((video_size[1], video_size[0], 3), BACKGROUND, dtype=np.uint8)
+        for x, y, _, _, w, h, b, g, r in vehicles:
+            top_left = (int((x - w / 2) * scenario.scale), int((y - h / 2) * scenario.scale))
+            bottom_right = (int((x + w / 2) * scenario.scale), int((y + h / 2) * scenario.scale))
+            cv2.rectangle(frame, top_left, bottom_right, (int(b), int(g), int(r)), -1)
+        writer.write(frame)
+
+        visible = (vehicles[:, 0] >= 0) & (vehicles[:, 0] < width) & (vehicles[:, 1] >= 0) & (vehicles[:, 1] < height)
+        counter.update(ids[visible].tolist(), vehicles[visible, :2].astype(np.int64))
+
+        vehicles[:, :2] += vehicles[:, 2:4]
+        gone = (vehicles[:, 0] < -60) | (vehicles[:, 0] > width + 60) | (vehicles[:, 1] < -60) | (vehicles[:, 1] > height + 60)
+        for i in np.flatnonzero(gone):
+            vehicles[i] = spawn()
+            ids[i] = next_id
+            next_id += 1
+
+    writer.release()
+    return counter.car_counts
+
+
+class SyntheticBackend(DetectorBackend):
+    """
+    Detect the rectangles of a synthetic scene by background subtraction and track them with ByteTracker.
+    """
+
+    def __init__(self, min_area: int = 150):
+        self.min_area = min_area
+        self.tracker = ByteTracker()
+        self.kernel = np.ones((5, 5), dtype=np.uint8)
+        self.skipped = 0
+
+    def track(self, frame: np.ndarray):
+        # Everything that differs from the background is foreground; opening removes small specks of noise
+        difference = cv2.absdiff(frame, np.full_like(frame, BACKGROUND))
+        foreground = (difference.max(axis=2) > 30).astype(np.uint8)
+        foreground = cv2.morphologyEx(foreground, cv2.MORPH_OPEN, self.kernel)
+        count, _, stats, _ = cv2.connectedComponentsWithStats(foreground)
+        stats = stats[1:][stats[1:, cv2.CC_STAT_AREA] >= self.min_area]
+
+        xyxy = np.concatenate([stats[:, :2], stats[:, :2] + stats[:, 2:4]], axis=1).astype(np.float64)
+        frames, self.skipped = 1 + self.skipped, 0
+        boxes, track_ids, _, _ = self.tracker.update(xyxy, np.full(len(xyxy), 0.9), np.full(len(xyxy), 2), frames)
+        xywh = np.concatenate([(boxes[:, :2] + boxes[:, 2:]) / 2, boxes[:, 2:] - boxes[:, :2]], axis=1)
+        return xywh, (track_ids.tolist() if len(track_ids) else None)
+
+    def skip_frame(self) -> None:
+        self.skipped += 1
+
+    def set_frame_rate(self, frame_rate: float) -> None:
+        self.tracker.set_frame_rate(frame_rate)
+
+    def has_tentative_tracks(self) -> bool:
+        return self.tracker.has_tentative_tracks
+
+    def reset(self) -> None:
+        self.tracker.reset()
+        self.skipped = 0
+
+
+class TimedBackend(DetectorBackend):
+    """
+    Wrap a backend and record the latency of every track call and the interval between calls.
+    """
+
+    def __init__(self, backend: DetectorBackend):
+        self.backend = backend
+        self.track_times: List[float] = []
+        self.frame_times: List[float] = []
+        self._last_call = None
+
+    def attach_metrics(self, metrics: Metrics) -> None:
+        self.metrics = metrics
+        self.backend.attach_metrics(metrics)
+
+    def track(self, frame: np.ndarray):
+        start = time.perf_counter()
+        if self._last_call is not None:
+            # Everything between two track calls belongs to one frame: decode, counting, drawing and encoding
+            self.frame_times.append(start - self._last_call)
+        result = self.backend.track(frame)
+        self.track_times.append(time.perf_counter() - start)
+        self._last_call = start
+        return result
+
+    def skip_frame(self) -> None:
+        self.backend.skip_frame()
+
+    def set_frame_rate(self, frame_rate: float) -> None:
+        self.backend.set_frame_rate(frame_rate)
+
+    def has_tentative_tracks(self) -> bool:
+        return self.backend.has_tentative_tracks()
+
+    def reset(self) -> None:
+        self.backend.reset()
+
+
+def latency_summary(seconds: List[float]) -> Dict[str, float]:
+    """
+    Summarise latencies as mean and percentiles in milliseconds.
+    """
+    if not seconds:
+        return {}
+    milliseconds = 1000 * np.asarray(seconds)
+    return {
+        'mean': round(float(milliseconds.mean()), 3),
+        'p50': round(float(np.percentile(milliseconds, 50)), 3),
+        'p90': round(float(np.percentile(milliseconds, 90)), 3),
+        'p99': round(float(np.percentile(milliseconds, 99)), 3),
+        'max': round(float(milliseconds.max()), 3),
+    }
+
+
+def count_accuracy(counts: Dict[str, int], truth: Dict[str, int]) -> float:
+    """
+    Return 1 minus the total absolute count error relative to the total true count.
+    """
+    total = sum(truth.values())
+    error = sum(abs(counts.get(direction, 0) - truth[direction]) for direction in truth)
+    return round(1 - error / total, 4) if total else float(error == 0)
+
+
+def run_benchmark(backend_name: str, model_path: str, video_path: str, export_path: str, imgsz: Tuple[int, int],
+                  truth: Dict[str, int], save: bool, pipelined: bool, max_stride: int = 1) -> Dict:
+    """
+    Run one backend over one scenario video and collect its measurements. Meant to run in a fresh process.
+    """
+    if backend_name == 'synthetic':
+        backend = SyntheticBackend()
+    else:
+        backend = create_backend(backend_name, model_path, device='cpu', imgsz=imgsz)
+    timed = TimedBackend(backend)
+    metrics = Metrics()
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        state_changes = inference(timed, video_path, export_path, device='cpu', imgsz=imgsz, save=save, pipelined=pipelined,
+                                  metrics=metrics, max_stride=max_stride)
+    wall_time = time.perf_counter() - start
+
+    # With max_stride above 1 the backend only sees the detected frames
+    frames = int(metrics.counters.get(('frames', ()), 0))
+    counts = {direction: 0 for direction in truth}
+    for change in state_changes:
+        counts[change['state']] = counts.get(change['state'], 0) + 1
+
+    result = {
+        'frames': frames,
+        'detections': len(timed.track_times),
+        'wall_time_s': round(wall_time, 3),
+        'fps': round(frames / wall_time, 2) if wall_time > 0 else 0.0,
+        'latency_ms': {'track': latency_summary(timed.track_times), 'frame': latency_summary(timed.frame_times)},
+        'stage_latency_ms': metrics.snapshot()['stages'],
+        'counts': counts,
+        'ground_truth': truth,
+        'count_accuracy': count_accuracy(counts, truth),
+    }
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result['peak_rss_mb'] = round(peak_rss / (1024 * 1024 if platform.system() == 'Darwin' else 1024), 1)
+    return result
+
+
+def _run_in_child(queue: multiprocessing.Queue, *args) -> None:
+    try:
+        queue.put(run_benchmark(*args))
+    except Exception as e:
+        queue.put({'error': f'{type(e).__name__}: {e}'})
+
+
+def wait_for_result(results: multiprocessing.Queue, process: multiprocessing.Process, poll_interval: float = 1.0) -> Dict:
+    """
+    Wait for the result of a benchmark child, or an error if it dies without one, e.g. killed by a crash in native code.
+    """
+    while True:
+        try:
+            return results.get(timeout=poll_interval)
+        except queue.Empty:
+            if process.is_alive():
+                continue
+        # The child may have put its result just before exiting
+        try:
+            return results.get(timeout=poll_interval)
+        except queue.Empty:
+            return {'error': f'The benchmark process exited with code {process.exitcode} without a result'}
+
+
+def main() -> None:
+    """
+    Run every requested backend over every requested scenario and write the results as JSON.
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument('--backends', nargs='+', default=['synthetic'], choices=['synthetic', 'ultralytics', 'onnx'])
+    parser.add_argument('--frames', type=int, default=None, help='Override the number of frames of every scenario')
+    parser.add_argument('--weights', default=config.model_path, help='Weights for the ultralytics backend')
+    parser.add_argument('--onnx-model', default='yolov8m.onnx', help='Model for the onnx backend')
+    parser.add_argument('--no-save', action='store_true', help='Count headless, without drawing or encoding the annotated video')
+    parser.add_argument('--pipelined', action='store_true', help='Run inference() in pipelined mode')
+    parser.add_argument('--max-stride', type=int, default=1, help='Detect on every Nth frame at most while no vehicle is near a line')
+    parser.add_argument('--output', default='benchmark.json')
+    args = parser.parse_args()
+
+    imgsz = config.imgsz
+    context = multiprocessing.get_context('spawn')
+    report = {
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+        },
+        'settings': {'imgsz': list(imgsz), 'save': not args.no_save, 'pipelined': args.pipelined, 'max_stride': args.max_stride},
+        'results': [],
+    }
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name in args.scenarios:
+            scenario = SCENARIOS[name]
+            if args.frames is not None:
+                scenario = Scenario(**{**scenario.__dict__, 'frames': args.frames})
+            video_path = os.path.join(directory, f'{name}.mp4')
+            truth = generate_scenario(scenario, video_path, imgsz)
+
+            for backend_name in args.backends:
+                model_path = args.onnx_model if backend_name == 'onnx' else args.weights
+                results = context.Queue()
+                process = context.Process(target=_run_in_child, args=(
+                    results, backend_name, model_path, video_path, os.path.join(directory, f'{name}_{backend_name}_out.mp4'),
+                    imgsz, truth, not args.no_save, args.pipelined, args.max_stride))
+                process.start()
+                result = wait_for_result(results, process)
+                process.join()
+
+                result = {'scenario': name, 'vehicles': scenario.vehicles, 'backend': backend_name, **result}
+                report['results'].append(result)
+                print(json.dumps({key: result.get(key) for key in ('scenario', 'backend', 'fps', 'count_accuracy', 'peak_rss_mb', 'error')
+                                  if key in result}))
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Micro-benchmark of the NMS implementations in legacy_onnx_detector.
+
+Generates random candidate boxes like those left after the confidence filter and
+times multiclass_nms against fast_multiclass_nms, checking both keep the same boxes.
+
+Usage:
+    python benchmark_nms.py --candidates 500 2000 8000 --classes 2 80
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from legacy_onnx_detector import multiclass_nms, fast_multiclass_nms
+
+
+def random_candidates(count: int, num_classes: int, rng: np.random.Generator) -> tuple:
+    """
+    Generate random float32 xyxy boxes, scores and class IDs clustered like real detections.
+
+    Parameters:
+        count (int): The number of candidate boxes.
+        num_classes (int): The number of distinct class IDs.
+        rng (np.random.Generator): The random number generator.
+
+    Returns:
+        tuple: The boxes, scores and class IDs.
+    """
+    # Candidates cluster around a few objects, which is what makes NMS suppress anything
+    objects = rng.uniform(0, 640, size=(max(1, count // 20), 2))
+    centers = objects[rng.integers(0, len(objects), count)] + rng.normal(0, 6, size=(count, 2))
+    sizes = rng.uniform(20, 120, size=(count, 2))
+    boxes = np.concatenate([centers - sizes / 2, centers + sizes / 2], axis=1).astype(np.float32)
+    scores = rng.uniform(0.1, 1.0, count).astype(np.float32)
+    class_ids = rng.integers(0, num_classes, count)
+    return boxes, scores, class_ids
+
+
+def time_call(function, repeats: int) -> float:
+    """
+    Return the median run time of a function in milliseconds.
+    """
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return 1000 * float(np.median(timings))
+
+
+def main() -> None:
+    """
+    Run the benchmark for every combination of candidate and class counts.
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--candidates', type=int, nargs='+', default=[100, 1000, 4000])
+    parser.add_argument('--classes', type=int, nargs='+', default=[2, 80])
+    parser.add_argument('--iou', type=float, default=0.5)
+    parser.add_argument('--top-k', type=int, default=None)
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'candidates':>10}{'classes':>9}{'kept':>7}{'loop ms':>10}{'fast ms':>10}{'speedup':>9}{'same':>6}")
+    for count in args.candidates:
+        for num_classes in args.classes:
+            boxes, scores, class_ids = random_candidates(count, num_classes, rng)
+            reference = np.asarray(multiclass_nms(boxes, scores, class_ids, args.iou), dtype=np.intp)
+            fast = fast_multiclass_nms(boxes, scores, class_ids, args.iou, top_k=args.top_k)
+
+            loop_ms = time_call(lambda: multiclass_nms(boxes, scores, class_ids, args.iou), args.repeats)
+            fast_ms = time_call(lambda: fast_multiclass_nms(boxes, scores, class_ids, args.iou, top_k=args.top_k), args.repeats)
+            print(f"{count:>10}{num_classes:>9}{len(fast):>7}{loop_ms:>10.2f}{fast_ms:>10.2f}{loop_ms / fast_ms:>9.1f}"
+                  f"{str(np.array_equal(reference, fast)):>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import os
+import threading
+import time
+from collections import deque
+from typing import Deque, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from metrics import Metrics
+
+
+class LiveCapture:
+    """
+    Read a live camera on its own thread into a small ring buffer, so a slow detector never makes
+    the counts lag behind the camera.
+
+    When the buffer is full the oldest frame is dropped to make room for the newest one, so the
+    delay between the camera and the count stays below buffer_size frames however slow the
+    consumer is; a buffer_size of 1 always hands out the latest frame. A stream that fails or ends
+    is reopened with exponential backoff. Live frames are dated by their arrival, so time keeps
+    running across drops and reconnects. It has the read, get, isOpened and release methods of
+    cv2.VideoCapture that inference() uses.
+
+    A local video file works as a fake camera: it is read at its own frame rate, dated by its
+    own timestamps and ends at its last frame.
+    """
+
+    def __init__(self, source: str, buffer_size: int = 4, reconnect: bool = None, reconnect_delay: float = 1.0,
+                 max_reconnect_delay: float = 30.0, pace: bool = None, metrics: Metrics = None,
+                 release_timeout: float = 5.0):
+        """
+        Parameters:
+            source (str): A stream URL, e.g. rtsp://, http:// or tcp://, or a local video file.
+            buffer_size (int, optional): The most frames waiting for the consumer. Defaults to 4.
+            reconnect (bool, optional): Whether to reopen the source when it fails or ends. Defaults to True for
+                streams and False for files.
+            reconnect_delay (float, optional): The seconds before the first reconnect attempt, doubled after each
+                failed attempt. Defaults to 1.
+            max_reconnect_delay (float, optional): The most seconds between two reconnect attempts. Defaults to 30.
+            pace (bool, optional): Whether to deliver frames no faster than the source frame rate, like a camera.
+                Defaults to True for files and False for streams.
+            metrics (Metrics, optional): Where to count the dropped frames and reconnects and record how long
+                frames wait in the buffer. Defaults to None.
+            release_timeout (float, optional): The most seconds release() waits for the reader thread. Defaults to 5.
+        """
+        self.source = source
+        self.buffer_size = max(1, buffer_size)
+        self.is_file = os.path.isfile(source)
+        self.reconnect = not self.is_file if reconnect is None else reconnect
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.pace = self.is_file if pace is None else pace
+        self.metrics = metrics if metrics is not None else Metrics(enabled=False)
+        self.release_timeout = release_timeout
+        self.dropped = 0
+        self.reconnects = 0
+
+        self._frames: Deque[Tuple[np.ndarray, float, float]] = deque()  # (frame, msec, arrival)
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+        self._finished = False
+        self._msec = 0.0
+
+        # The properties are read once, cv2.VideoCapture isn't safe to query while the reader thread uses it
+        self._cap = cv2.VideoCapture(source)
+        self._properties = {prop: self._cap.get(prop) for prop in (cv2.CAP_PROP_FPS, cv2.CAP_PROP_FRAME_WIDTH,
+                                                                   cv2.CAP_PROP_FRAME_HEIGHT)}
+        self._start = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name='live-capture', daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        fps = self._properties[cv2.CAP_PROP_FPS]
+        period = 1 / fps if 0 < fps < 1000 else 0.0
+        delay = self.reconnect_delay
+        due = time.monotonic()
+        while not self._stop.is_set():
+            success, frame = self._cap.read() if self._cap.isOpened() else (False, None)
+            if not success:
+                if not self.reconnect:
+                    break
+                self._cap.release()
+                if self._stop.wait(delay):
+                    break
+                delay = min(delay * 2, self.max_reconnect_delay)
+                self.reconnects += 1
+                self.metrics.increment('reconnects')
+                self._cap = cv2.VideoCapture(self.source)
+                continue
+            delay = self.reconnect_delay
+
+            if self.pace and period:
+                due += period
+                if self._stop.wait(max(due - time.monotonic(), 0.0)):
+                    break
+            arrival = time.monotonic()
+            msec = self._cap.get(cv2.CAP_PROP_POS_MSEC) if self.is_file else (arrival - self._start) * 1000
+
+            with self._condition:
+                if len(self._frames) >= self.buffer_size:
+                    self._frames.popleft()
+                    self.dropped += 1
+                    self.metrics.increment('dropped_frames')
+                self._frames.append((frame, msec, arrival))
+                self._condition.notify()
+
+        self._cap.release()
+        with self._condition:
+            self._finished = True
+            self._condition.notify_all()
+
+    def read(self) -> Tuple[bool, Optional[np.ndarray]]:
+        """
+        Return the oldest buffered frame, waiting for one if the buffer is empty.
+
+        Returns:
+            Tuple[bool, Optional[np.ndarray]]: (True, frame), or (False, None) once the source has ended for good.
+        """
+        with self._condition:
+            while not self._frames and not self._finished:
+                self._condition.wait()
+            if not self._frames:
+                return False, None
+            frame, self._msec, arrival = self._frames.popleft()
+        self.metrics.observe('capture_wait', time.monotonic() - arrival)
+        return True, frame
+
+    def get(self, prop: int) -> float:
+        """
+        Return CAP_PROP_POS_MSEC of the frame last read, or the FPS, width or height of the source.
+        """
+        if prop == cv2.CAP_PROP_POS_MSEC:
+            return self._msec
+        return self._properties.get(prop, 0.0)
+
+    def set(self, prop: int, value: float) -> bool:
+        # Live sources can't seek
+        return False
+
+    def isOpened(self) -> bool:
+        with self._condition:
+            return bool(self._frames) or not self._finished
+
+    def release(self) -> None:
+        """
+        Stop the reader thread and close the source.
+
+        A read blocked on a dead stream can't be interrupted, and cv2.VideoCapture can't be released while another
+        thread reads it, so after release_timeout seconds the daemon reader thread is left to close the source
+        once its read returns, and shutdown goes on without it.
+        """
+        self._stop.set()
+        self._thread.join(self.release_timeout)
+        with self._condition:
+            self._finished = True
+            self._frames.clear()
+            self._condition.notify_all()
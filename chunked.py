@@ -0,0 +1,361 @@
+"""
+Parallel runner for long recorded videos.
+
+Splits one video into consecutive chunks and counts them on a pool of worker processes. Every
+chunk starts overlap frames early so its tracker and crossing state are warmed up by the time
+its own frames begin; crossings in the warm-up belong to the chunk before and are dropped. The
+tracks of neighbouring chunks are stitched by matching their boxes on the overlapping frames,
+so a vehicle keeps one car ID across a boundary and is not counted twice in the same direction.
+The wall time falls roughly with the number of cores, at the cost of decoding the overlaps twice.
+
+Usage:
+    python chunked.py archive.mp4 --workers 8 --overlap-seconds 2 --output events.csv
+"""
+
+import argparse
+import multiprocessing
+import os
+import time
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import cv2
+import numpy as np
+
+import config
+from detectors import DetectorBackend, create_backend
+from inference import inference
+from metrics import Metrics
+from sinks import EventSink
+from timebase import parse_start_time, source_fps
+
+# The backend of the current worker process, created once by _init_worker
+_BACKEND: Optional[DetectorBackend] = None
+_SETTINGS: Dict = {}
+
+# The boxes (xywh) and track IDs of every recorded frame, by absolute frame index
+FrameTracks = Dict[int, Tuple[np.ndarray, List[int]]]
+
+
+class Chunk(NamedTuple):
+    """
+    A range of frames [start, end) and the frame its warm-up starts at.
+    """
+    index: int
+    video_path: str
+    warmup_start: int
+    start: int
+    end: int
+    overlap: int
+
+
+class ChunkResult(NamedTuple):
+    index: int
+    events: List[Tuple[int, Dict]]  # The state changes of the chunk's own frames, with their frame index
+    head: FrameTracks  # The tracks of the warm-up frames
+    tail: FrameTracks  # The tracks of the last overlap frames, which the next chunk warms up on
+    processing_time: float
+    error: Optional[str] = None
+
+
+class _FrameSink(EventSink):
+    # inference() ticks once per frame after writing its events, which dates every event to its frame
+    def __init__(self, first_frame: int):
+        self.frame = first_frame
+        self.events: List[Tuple[int, Dict]] = []
+
+    def write(self, event: Dict) -> None:
+        self.events.append((self.frame, event))
+
+    def tick(self) -> None:
+        self.frame += 1
+
+
+class _RecordingBackend(DetectorBackend):
+    # Pass every call through and keep the tracks of the frames at both ends of the chunk
+    def __init__(self, backend: DetectorBackend, first_frame: int, head_end: int, tail_start: int):
+        self.backend = backend
+        self.frame = first_frame
+        self.head_end = head_end
+        self.tail_start = tail_start
+        self.head: FrameTracks = {}
+        self.tail: FrameTracks = {}
+
+    def attach_metrics(self, metrics: Metrics) -> None:
+        self.backend.attach_metrics(metrics)
+
+    def track(self, frame: np.ndarray) -> Tuple[np.ndarray, Optional[List[int]]]:
+        boxes, track_ids = self.backend.track(frame)
+        if track_ids:
+            if self.frame < self.head_end:
+                self.head[self.frame] = (np.asarray(boxes, dtype=np.float64).copy(), list(track_ids))
+            if self.frame >= self.tail_start:
+                self.tail[self.frame] = (np.asarray(boxes, dtype=np.float64).copy(), list(track_ids))
+        self.frame += 1
+        return boxes, track_ids
+
+    def skip_frame(self) -> None:
+        self.backend.skip_frame()
+        self.frame += 1
+
+    def set_frame_rate(self, frame_rate: float) -> None:
+        self.backend.set_frame_rate(frame_rate)
+
+    def has_tentative_tracks(self) -> bool:
+        return self.backend.has_tentative_tracks()
+
+    def reset(self) -> None:
+        self.backend.reset()
+
+
+def plan_chunks(video_path: str, chunks: int, overlap: int) -> List[Chunk]:
+    """
+    Split a video into equal chunks of frames.
+
+    Parameters:
+        video_path (str): The recorded video. Its frame count must be known, so streams can't be chunked.
+        chunks (int): The number of chunks.
+        overlap (int): The frames every chunk but the first starts early to warm up its tracker.
+
+    Returns:
+        List[Chunk]: The chunks in order.
+    """
+    cap = cv2.VideoCapture(video_path)
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    if frame_count <= 0:
+        raise ValueError(f'Cannot chunk {video_path!r}: the frame count is unknown')
+
+    chunks = max(1, min(chunks, frame_count // max(2 * overlap, 1)))
+    bounds = np.linspace(0, frame_count, chunks + 1).round().astype(int).tolist()
+    return [Chunk(i, video_path, max(0, start - overlap), start, end, overlap)
+            for i, (start, end) in enumerate(zip(bounds[:-1], bounds[1:]))]
+
+
+def stitch_tracks(tail: FrameTracks, head: FrameTracks, min_iou: float = 0.5, min_frames: int = 3) -> Dict[int, int]:
+    """
+    Match the tracks a chunk saw at its start with the tracks the previous chunk saw on the same frames.
+
+    Every frame both recorded votes for the pairs of tracks whose boxes overlap by more than min_iou.
+    The pairs are then matched one to one, most votes first.
+
+    Parameters:
+        tail (FrameTracks): The tracks of the previous chunk on its last frames.
+        head (FrameTracks): The tracks of the next chunk on its warm-up frames.
+        min_iou (float, optional): The IoU above which two boxes are the same vehicle. Defaults to 0.5.
+        min_frames (int, optional): The fewest frames two tracks must match on. Defaults to 3.
+
+    Returns:
+        Dict[int, int]: The track ID of the previous chunk for every matched track ID of the next one.
+    """
+    votes: Dict[Tuple[int, int], int] = {}
+    for frame in tail.keys() & head.keys():
+        (tail_boxes, tail_ids), (head_boxes, head_ids) = tail[frame], head[frame]
+        iou = _iou_xywh(head_boxes, tail_boxes)
+        for row, column in zip(*np.nonzero(iou > min_iou)):
+            pair = (head_ids[row], tail_ids[column])
+            votes[pair] = votes.get(pair, 0) + 1
+
+    links, used = {}, set()
+    for (head_id, tail_id), count in sorted(votes.items(), key=lambda item: -item[1]):
+        if count >= min_frames and head_id not in links and tail_id not in used:
+            links[head_id] = tail_id
+            used.add(tail_id)
+    return links
+
+
+def merge_chunks(results: List[ChunkResult], min_iou: float = 0.5, min_frames: int = 3) -> List[Dict]:
+    """
+    Join the state changes of consecutive chunks into the log a sequential run would have written.
+
+    Car IDs are renumbered by first appearance, and a stitched track keeps the ID it had in the chunk
+    before. As in LineCrossingCounter, a track counted in one direction isn't counted in the same
+    direction again until it has been counted in another, also across a chunk boundary.
+
+    Parameters:
+        results (List[ChunkResult]): The results of all chunks, in any order.
+        min_iou (float, optional): See stitch_tracks. Defaults to 0.5.
+        min_frames (int, optional): See stitch_tracks. Defaults to 3.
+
+    Returns:
+        List[Dict]: The state changes in order.
+
+    Raises:
+        RuntimeError: If a chunk failed, since its events are missing and the tracks can't be stitched across it.
+    """
+    results = sorted(results, key=lambda result: result.index)
+    failed = [f'chunk {result.index}: {result.error}' for result in results if result.error]
+    if failed:
+        raise RuntimeError(f'{len(failed)} of {len(results)} chunks failed, ' + '; '.join(failed))
+    links = [{}] + [stitch_tracks(previous.tail, result.head, min_iou, min_frames)
+                    for previous, result in zip(results[:-1], results[1:])]
+    global_ids: Dict[Tuple[int, int], int] = {}
+    next_id = iter(range(1, 1 << 62))
+
+    def global_id(chunk: int, track_id: int) -> int:
+        key = (chunk, track_id)
+        if key not in global_ids:
+            if track_id in links[chunk]:
+                global_ids[key] = global_id(chunk - 1, links[chunk][track_id])
+            else:
+                global_ids[key] = next(next_id)
+        return global_ids[key]
+
+    merged, last_direction = [], {}
+    for chunk, result in enumerate(results):
+        for _, event in result.events:
+            car_id = global_id(chunk, event['car_id'])
+            if last_direction.get(car_id) == event['state']:
+                continue
+            last_direction[car_id] = event['state']
+            merged.append(dict(event, car_id=car_id))
+    return merged
+
+
+def _iou_xywh(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # The IoU of every box of a with every box of b, both in center xywh format
+    a = np.concatenate([a[:, :2] - a[:, 2:4] / 2, a[:, :2] + a[:, 2:4] / 2], axis=1)
+    b = np.concatenate([b[:, :2] - b[:, 2:4] / 2, b[:, :2] + b[:, 2:4] / 2], axis=1)
+    width = np.minimum(a[:, None, 2], b[None, :, 2]) - np.maximum(a[:, None, 0], b[None, :, 0])
+    height = np.minimum(a[:, None, 3], b[None, :, 3]) - np.maximum(a[:, None, 1], b[None, :, 1])
+    intersection = np.maximum(width, 0) * np.maximum(height, 0)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return intersection / np.maximum(area_a[:, None] + area_b[None, :] - intersection, 1e-9)
+
+
+def _init_worker(backend: str, model_path: str, device: str, imgsz: Tuple[int, int], threads: int, start_time: datetime,
+                 inter_threads: Optional[int], thread_affinities: Optional[str], spinning: Optional[bool]) -> None:
+    global _BACKEND
+    cv2.setNumThreads(threads)
+    _BACKEND = create_backend(backend, model_path, device=device, imgsz=imgsz, threads=threads,
+                              tuning_path=config.onnx_tuning_path, inter_threads=inter_threads,
+                              thread_affinities=thread_affinities, spinning=spinning)
+    _SETTINGS.update(device=device, imgsz=imgsz, start_time=start_time)
+
+
+def _process_chunk(chunk: Chunk) -> ChunkResult:
+    start = time.perf_counter()
+    # Every chunk starts with fresh tracks, which the stitching joins to those of the chunk before
+    _BACKEND.reset()
+    backend = _RecordingBackend(_BACKEND, chunk.warmup_start, chunk.start, chunk.end - chunk.overlap)
+    sink = _FrameSink(chunk.warmup_start)
+    try:
+        inference(backend, chunk.video_path, '', device=_SETTINGS['device'], imgsz=_SETTINGS['imgsz'], save=False,
+                  sink=sink, start_time=_SETTINGS['start_time'], start_frame=chunk.warmup_start, end_frame=chunk.end)
+        error = None
+    except Exception as e:
+        error = f'{type(e).__name__}: {e}'
+    # The crossings of the warm-up were counted by the chunk before
+    events = [(frame, event) for frame, event in sink.events if frame >= chunk.start]
+    return ChunkResult(chunk.index, events, backend.head, backend.tail, time.perf_counter() - start, error)
+
+
+def run_chunked(
+        video_path: str,
+        backend: str = config.backend,
+        model_path: str = config.model_path,
+        device: str = 'cpu',
+        imgsz: Tuple[int, int] = config.imgsz,
+        workers: int = None,
+        chunks: int = None,
+        overlap_seconds: float = 2.0,
+        threads_per_worker: int = None,
+        start_time: datetime = None,
+        inter_threads: int = config.onnx_inter_threads,
+        thread_affinities: str = config.onnx_thread_affinities,
+        spinning: bool = config.onnx_spinning) -> Tuple[List[Dict], List[ChunkResult]]:
+    """
+    Count the vehicles of a long recorded video in chunks on a pool of worker processes.
+
+    Parameters:
+        video_path (str): The recorded video.
+        backend (str, optional): The detector backend, see detectors.create_backend. Defaults to config.backend.
+        model_path (str, optional): The model every worker loads. Defaults to config.model_path.
+        device (str, optional): The device to run the inference on. Defaults to 'cpu'.
+        imgsz (tuple, optional): The size of the input image (height, width). Defaults to config.imgsz.
+        workers (int, optional): The number of worker processes. Defaults to the number of cores.
+        chunks (int, optional): The number of chunks. Defaults to one per worker.
+        overlap_seconds (float, optional): How long every chunk warms up on the end of the chunk before. Must exceed
+            the time a tracker needs to confirm a vehicle, and is decoded and detected twice. Defaults to 2.
+        threads_per_worker (int, optional): The CPU threads each worker's runtime may use. Defaults to an even share of the cores.
+        start_time (datetime, optional): The wall-clock time of the start of the video, shared by every chunk.
+            Defaults to config.video_start_time, or now if that is None.
+        inter_threads (int, optional): The ONNX session's inter-op threads, see detectors.create_backend.
+            Defaults to config.onnx_inter_threads.
+        thread_affinities (str, optional): The cores of every worker's ONNX intra-op threads, see detectors.create_backend.
+            Defaults to config.onnx_thread_affinities.
+        spinning (bool, optional): Whether idle ONNX Runtime threads spin. Defaults to config.onnx_spinning.
+
+    Returns:
+        Tuple[List[Dict], List[ChunkResult]]: The merged state changes, see merge_chunks, and the result of every chunk.
+
+    Raises:
+        RuntimeError: If a chunk failed, see merge_chunks.
+    """
+    cores = os.cpu_count() or 1
+    workers = max(1, workers or cores)
+    threads_per_worker = threads_per_worker or max(1, cores // workers)
+
+    cap = cv2.VideoCapture(video_path)
+    overlap = int(round(overlap_seconds * source_fps(cap)))
+    cap.release()
+    plan = plan_chunks(video_path, chunks or workers, overlap)
+    # Resolved once here, so all chunks are dated from the same origin even when it is the current time
+    start_time = start_time or parse_start_time(config.video_start_time)
+
+    # Spawned workers start clean instead of inheriting a forked copy of the parent's runtime threads
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(min(workers, len(plan)), initializer=_init_worker,
+                      initargs=(backend, model_path, device, imgsz, threads_per_worker, start_time, inter_threads,
+                                thread_affinities, spinning)) as pool:
+        results = list(pool.imap_unordered(_process_chunk, plan))
+
+    return merge_chunks(results), sorted(results, key=lambda result: result.index)
+
+
+def main() -> None:
+    """
+    Count a recorded video in parallel chunks and write the merged events to a CSV file.
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('video', help='The recorded video file')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: one per core)')
+    parser.add_argument('--chunks', type=int, default=None, help='Chunks to split the video into (default: one per worker)')
+    parser.add_argument('--overlap-seconds', type=float, default=2.0, help='Warm-up every chunk shares with the one before')
+    parser.add_argument('--threads-per-worker', type=int, default=None, help='CPU threads per worker (default: an even share)')
+    parser.add_argument('--inter-threads', type=int, default=config.onnx_inter_threads,
+                        help='ONNX inter-op threads; above 1 runs graph branches in parallel')
+    parser.add_argument('--thread-affinities', default=config.onnx_thread_affinities,
+                        help="Cores of the ONNX intra-op threads after the first, e.g. '1;2;3'")
+    parser.add_argument('--spinning', action=argparse.BooleanOptionalAction, default=config.onnx_spinning,
+                        help='Whether idle ONNX Runtime threads spin')
+    parser.add_argument('--backend', default=config.backend, choices=['ultralytics', 'onnx'])
+    parser.add_argument('--model', default=config.model_path, help='The .pt weights or the .onnx model')
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--output', default='car_data.csv', help='The merged CSV')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    try:
+        merged, results = run_chunked(args.video, args.backend, args.model, device=args.device, workers=args.workers,
+                                      chunks=args.chunks, overlap_seconds=args.overlap_seconds,
+                                      threads_per_worker=args.threads_per_worker, inter_threads=args.inter_threads,
+                                      thread_affinities=args.thread_affinities, spinning=args.spinning)
+    except RuntimeError as e:
+        # Nothing is written, a log with a hole in it would look complete
+        raise SystemExit(f'{e}')
+    wall_time = time.perf_counter() - start
+
+    for result in results:
+        print(f'chunk {result.index}: {len(result.events)} events in {result.processing_time:.1f} s')
+    print(f'{len(results)} chunks, {len(merged)} events in {wall_time:.1f} s')
+
+    # Imported here so the workers never load pandas and matplotlib
+    from visualization import save_to_csv
+
+    save_to_csv(merged, export_path=args.output)
+
+
+if __name__ == '__main__':
+    main()
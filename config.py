@@ -1,17 +1,55 @@
 
-# Configuration for line positions
+# Configuration for line positions; the default lines are counted across the whole frame (see inference.default_counting_lines)
 line_position_horizontal: int = 240
 line_position_perpendicular: int = 400
 START_POINT_HORIZONTAL: tuple[int, int] = (0, line_position_horizontal)
 END_POINT_HORIZONTAL: tuple[int, int] = (640, line_position_horizontal)
 START_POINT_PERPENDICULAR: tuple[int, int] = (line_position_perpendicular, 0)
 END_POINT_PERPENDICULAR: tuple[int, int] = (line_position_perpendicular, 384)
+zones_path: str | None = None  # JSON file with angled lines and polygon zones, replaces the two lines above (see zones.load_zones)
+track_max_age: int | None = 300  # Forget a track after this many frames without it, None keeps every track forever
+track_max_states: int | None = None  # The most tracks kept in memory, the least recently seen are forgotten first
 
 # Configuration for the model and inference
 device: str = 'cuda:0'  # Use 'cpu' for CPU
 imgsz: tuple[int, int] = (384, 640)
 model_path: str = 'yolov8m.pt'
+backend: str = 'ultralytics'  # 'ultralytics' for YOLO + built-in ByteTrack, 'onnx' for DetectorONNX + tracker.ByteTracker (model_path must be the .onnx export)
+onnx_tuning_path: str | None = 'ort_tuning.json'  # Written by ort_tuning.py: the fastest accurate model variant (FP16/INT8) and thread settings of an .onnx model on this CPU, used when present
+onnx_threads: int | None = None  # Intra-op threads of the ONNX session; these four settings override the tuned ones, None keeps them (or ONNX Runtime's default)
+onnx_inter_threads: int | None = None  # Above 1, run independent branches of the graph in parallel on this many threads
+onnx_thread_affinities: str | None = None  # Cores of the intra-op threads after the first, in ONNX Runtime's format, e.g. '1;2;3'
+onnx_spinning: bool | None = None  # Whether idle ONNX Runtime threads spin: lower latency, more CPU
+pipelined: bool = False  # Run decode, tracking, counting and annotate+encode in separate threads
+roi_enabled: bool = False  # Detect only in tiles around the counting lines (see roi.py), with tracker.ByteTracker
+roi_margin: int = 64  # Pixels kept on each side of a line, more than half a vehicle
+roi_tile_size: tuple[int, int] = (128, 128)  # Detector input (height, width) per tile; ONNX models need dynamic axes
+max_stride: int = 1  # Above 1, skip up to max_stride - 1 frames between detections while no vehicle is near a line
+save_video: bool = True  # False counts headless: no video writer is opened and nothing is drawn
+live_capture: bool = False  # video_path is a live camera (rtsp://, http://): read it on a thread, drop the oldest frames when behind, reconnect on failure
+live_buffer_size: int = 4  # The most frames waiting to be counted in live mode, 1 always counts the latest frame
+video_encoder: str = 'opencv'  # 'opencv' for OpenCV's mp4v writer, 'ffmpeg' to pipe the annotated frames to an ffmpeg process; both run on their own thread
+ffmpeg_codec: str = 'libx264'  # Any ffmpeg encoder, e.g. 'libx265' or the hardware 'h264_nvenc' / 'h264_qsv'
+ffmpeg_preset: str | None = 'veryfast'
+ffmpeg_crf: int | None = 23
+event_clips: bool = False  # Save only short clips around counted crossings instead of the whole annotated video
+clip_seconds_before: float = 2.0
+clip_seconds_after: float = 2.0
+video_start_time: str | None = '2024-02-19 13:50:00'  # Wall-clock time of the first frame, None for the time the video is opened (live feeds)
+timestamps_from_pts: bool = True  # Date frames by the container's timestamps, so dropped frames don't shift later events; False uses frame index / FPS
+detection_cache_dir: str | None = None  # Cache the tracks per video and model here, so changing only the lines replays them without detection
+detection_cache_max_bytes: int = 2 << 30  # The least recently used cache entries are deleted above this size
+
+# Configuration for the per-stage metrics (see metrics.py)
+metrics_enabled: bool = False  # Record decode, resize, detect, track, crossing, draw and encode times
+metrics_prometheus_path: str | None = None  # Prometheus text file, e.g. for node_exporter's textfile collector
+metrics_jsonl_path: str | None = None  # JSONL log with one snapshot of the stage latencies per export
+metrics_port: int | None = None  # Serve the metrics at http://localhost:<port>/metrics
+metrics_interval: float = 10.0  # Seconds between exports
 
 # Configuration for the input video and export path
 video_path: str = 'input.mp4'
 export_path: str = 'output.mp4'
+events_path: str = 'car_data.csv'  # The crossing events are streamed here as they happen: .csv, .jsonl or .db (SQLite)
+events_append: bool = False  # Append to an existing events file, e.g. when a long-running feed restarts
+plot_bucket: str = '1min'  # The time bucket the plots count cars in, e.g. '1s', '1min' or '15min'
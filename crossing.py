@@ -0,0 +1,206 @@
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from metrics import Metrics
+from zones import CountingLine, SpatialGrid
+
+
+class CrossingEvent(NamedTuple):
+    """
+    A counted line crossing.
+
+    Attributes:
+        track_id (int): The ID of the track that crossed the line.
+        direction (str): The direction in which the track crossed the line.
+        fraction (float): Where along the motion since the previous center the line was reached, in (0, 1].
+    """
+    track_id: int
+    direction: str
+    fraction: float = 1.0
+
+
+class LineCrossingCounter:
+    """
+    Count segment crossings of all tracks of a frame in one batched NumPy operation.
+
+    The previous center and the last counted direction of every track are kept in arrays
+    indexed by a track slot. A spatial grid limits the tests to the segments near each
+    track's motion, so the cost per frame depends on the number of tracks rather than on
+    the number of lines. A track is counted again only when it crosses in a direction
+    other than the one it was last counted in, as inference() has always done.
+
+    The state of a track is evicted once it hasn't been seen for more than max_age frames, and
+    its slot is reused, so memory stays bounded on a continuous stream. Trackers retire a lost ID
+    after a much shorter buffer (30 frames for ByteTrack) and never hand it out again, so an
+    evicted track cannot come back and the counts are the same as without eviction.
+    """
+
+    def __init__(self, lines: Sequence[CountingLine], capacity: int = 256, cell_size: float = 64,
+                 max_age: Optional[int] = 300, max_tracks: Optional[int] = None, metrics: Metrics = None):
+        """
+        Parameters:
+            lines (Sequence[CountingLine]): The segments to count crossings of, in evaluation order.
+            capacity (int, optional): The initial number of track slots. Grows as needed. Defaults to 256.
+            cell_size (float, optional): The cell size of the spatial grid in pixels. Defaults to 64.
+            max_age (int, optional): Evict a track after this many frames without it. None keeps every track. Defaults to 300.
+            max_tracks (int, optional): The most tracks to keep. When a new track would exceed it, the least recently
+                seen tracks are evicted early. None sets no limit. Defaults to None.
+            metrics (Metrics, optional): Where to report the number of kept tracks and the evictions. Defaults to None.
+        """
+        self.lines = list(lines)
+        self.directions: List[str] = []
+        for line in self.lines:
+            for direction in line.directions:
+                if direction not in self.directions:
+                    self.directions.append(direction)
+
+        self._starts = np.array([line.start for line in self.lines], dtype=np.float64).reshape(-1, 2)
+        self._ends = np.array([line.end for line in self.lines], dtype=np.float64).reshape(-1, 2)
+        self._grid = SpatialGrid(self._starts, self._ends, cell_size)
+        self._negative_codes = np.array([self.directions.index(line.directions[0]) for line in self.lines], dtype=np.int64)
+        self._positive_codes = np.array([self.directions.index(line.directions[1]) for line in self.lines], dtype=np.int64)
+        self._counts = np.zeros(len(self.directions), dtype=np.int64)
+
+        self.max_age = max_age
+        self.max_tracks = max_tracks
+        self.metrics = metrics if metrics is not None else Metrics(enabled=False)
+        self.evictions = 0
+        self._frame = 0
+
+        # A slot is in use exactly when _has_center is set; evicted slots go on the free list
+        self._slots: Dict[int, int] = {}
+        self._free: List[int] = list(range(capacity - 1, -1, -1))
+        self._centers = np.zeros((capacity, 2), dtype=np.int64)
+        self._has_center = np.zeros(capacity, dtype=bool)
+        self._last_direction = np.full(capacity, -1, dtype=np.int64)
+        self._last_seen = np.zeros(capacity, dtype=np.int64)
+        self._track_ids = np.zeros(capacity, dtype=np.int64)
+
+    @property
+    def car_counts(self) -> Dict[str, int]:
+        """The number of counted crossings per direction."""
+        return dict(zip(self.directions, self._counts.tolist()))
+
+    @property
+    def active_tracks(self) -> int:
+        """The number of tracks whose state is kept."""
+        return len(self._slots)
+
+    def _grow(self, capacity: int) -> None:
+        extra = capacity - len(self._has_center)
+        self._free.extend(range(capacity - 1, len(self._has_center) - 1, -1))
+        self._centers = np.concatenate([self._centers, np.zeros((extra, 2), dtype=np.int64)])
+        self._has_center = np.concatenate([self._has_center, np.zeros(extra, dtype=bool)])
+        self._last_direction = np.concatenate([self._last_direction, np.full(extra, -1, dtype=np.int64)])
+        self._last_seen = np.concatenate([self._last_seen, np.zeros(extra, dtype=np.int64)])
+        self._track_ids = np.concatenate([self._track_ids, np.zeros(extra, dtype=np.int64)])
+
+    def _evict(self, evicted: np.ndarray) -> None:
+        for track_id in self._track_ids[evicted].tolist():
+            del self._slots[track_id]
+        self._has_center[evicted] = False
+        self._last_direction[evicted] = -1
+        self._free.extend(evicted.tolist())
+        self.evictions += len(evicted)
+        self.metrics.increment('track_evictions', len(evicted))
+
+    def _evict_stale(self) -> None:
+        stale = np.nonzero(self._has_center & (self._frame - self._last_seen > self.max_age))[0]
+        if len(stale):
+            self._evict(stale)
+
+    def _evict_oldest(self, count: int, keep: Sequence[int]) -> None:
+        # Never evict a track of the current frame, even if that leaves more than max_tracks
+        candidates = np.nonzero(self._has_center)[0]
+        kept = [self._slots[track_id] for track_id in keep if track_id in self._slots]
+        candidates = candidates[~np.isin(candidates, kept)]
+        oldest = candidates[np.argsort(self._last_seen[candidates], kind='stable')[:count]]
+        if len(oldest):
+            self._evict(oldest)
+
+    def _lookup(self, track_ids: Sequence[int]) -> np.ndarray:
+        slots = self._slots
+        new_ids = [track_id for track_id in dict.fromkeys(track_ids) if track_id not in slots]
+        if new_ids:
+            if self.max_tracks is not None and len(slots) + len(new_ids) > self.max_tracks:
+                self._evict_oldest(len(slots) + len(new_ids) - self.max_tracks, track_ids)
+            if len(new_ids) > len(self._free):
+                self._grow(max(len(self._has_center) + len(new_ids) - len(self._free), 2 * len(self._has_center)))
+            for track_id in new_ids:
+                slot = self._free.pop()
+                slots[track_id] = slot
+                self._track_ids[slot] = track_id
+        return np.fromiter((slots[track_id] for track_id in track_ids), dtype=np.intp, count=len(track_ids))
+
+    def update(self, track_ids: Sequence[int], centers: np.ndarray) -> Tuple[List[CrossingEvent], np.ndarray]:
+        """
+        Test every track of a frame against the segments near its motion and update the counts.
+
+        A track crosses a segment when its previous center lies strictly on one side of the segment's
+        supporting line, its current center lies on the other side or on the line, and the motion
+        between them meets the segment.
+
+        Parameters:
+            track_ids (Sequence[int]): The track IDs of the boxes in the frame.
+            centers (np.ndarray): The integer (x, y) centers of the boxes, shape (N, 2).
+
+        Returns:
+            Tuple[List[CrossingEvent], np.ndarray]: The counted crossings in box and line order, and for every box
+                the index of the last line it crossed this frame, or -1 if it crossed none.
+        """
+        self._frame += 1
+        if self.max_age is not None:
+            self._evict_stale()
+
+        track_ids = list(track_ids)
+        last_line = np.full(len(track_ids), -1, dtype=np.intp)
+        if not track_ids:
+            self.metrics.set_gauge('track_states', len(self._slots))
+            return [], last_line
+        centers = np.asarray(centers, dtype=np.int64).reshape(-1, 2)
+        slots = self._lookup(track_ids)
+        previous = self._centers[slots]
+
+        # Only tracks seen before can cross, and only segments near their motion need testing
+        moving = np.nonzero(self._has_center[slots] & np.any(previous != centers, axis=1))[0]
+        boxes, lines = self._grid.candidates(np.minimum(previous[moving], centers[moving]),
+                                             np.maximum(previous[moving], centers[moving]))
+        boxes = moving[boxes]
+
+        events = []
+        if len(boxes):
+            p = previous[boxes].astype(np.float64)
+            c = centers[boxes].astype(np.float64)
+            a = self._starts[lines]
+            b = self._ends[lines]
+            side_previous = _cross(b - a, p - a)
+            side_current = _cross(b - a, c - a)
+            # The segment's end points must not lie strictly on the same side of the motion
+            touches = _cross(c - p, a - p) * _cross(c - p, b - p) <= 0
+            positive = (side_previous < 0) & (side_current >= 0) & touches
+            negative = (side_previous > 0) & (side_current <= 0) & touches
+            crossed = np.nonzero(positive | negative)[0]
+
+            codes = np.where(positive, self._positive_codes[lines], self._negative_codes[lines])[crossed]
+            fractions = side_previous[crossed] / (side_previous[crossed] - side_current[crossed])
+            # Candidate pairs are sorted by box and then by line, so events come out in evaluation order.
+            # Deduplication depends on the previous event of the same track, so only this short loop is sequential
+            for row, line, code, fraction in zip(boxes[crossed].tolist(), lines[crossed].tolist(), codes.tolist(), fractions.tolist()):
+                last_line[row] = line
+                slot = slots[row]
+                if self._last_direction[slot] != code:
+                    self._last_direction[slot] = code
+                    self._counts[code] += 1
+                    events.append(CrossingEvent(track_ids[row], self.directions[code], fraction))
+
+        self._centers[slots] = centers
+        self._has_center[slots] = True
+        self._last_seen[slots] = self._frame
+        self.metrics.set_gauge('track_states', len(self._slots))
+        return events, last_line
+
+
+def _cross(u: np.ndarray, v: np.ndarray) -> np.ndarray:
+    """Row-wise 2D cross product u x v."""
+    return u[:, 0] * v[:, 1] - u[:, 1] * v[:, 0]
@@ -0,0 +1,233 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+# The columns of a cache entry: one row per box, and one row per frame
+BOX_COLUMNS = {'boxes': (np.float64, (4,)), 'track_ids': (np.int64, ()), 'scores': (np.float32, ()),
+               'class_ids': (np.int16, ())}
+FRAME_COLUMNS = {'offsets': np.int64, 'timestamps': np.int64, 'gaps': np.int16, 'tracked': np.bool_}
+
+_SAMPLE_SIZE = 1 << 20
+
+
+def file_fingerprint(path: str) -> str:
+    """
+    Hash the size and three 1 MiB samples (start, middle, end) of a file.
+
+    Reading whole multi-gigabyte videos would cost more than a short re-run, and any re-encode or
+    edit of a video changes its size or its sampled bytes.
+    """
+    size = os.path.getsize(path)
+    digest = hashlib.sha256(str(size).encode())
+    with open(path, 'rb') as file:
+        for offset in sorted({0, max(size // 2 - _SAMPLE_SIZE // 2, 0), max(size - _SAMPLE_SIZE, 0)}):
+            file.seek(offset)
+            digest.update(file.read(_SAMPLE_SIZE))
+    return digest.hexdigest()
+
+
+class CachedDetections:
+    """
+    The tracks of every frame of a video, read from a cache entry as memory-mapped columns.
+    """
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, 'meta.json')) as file:
+            self.meta = json.load(file)
+        frames, rows = self.meta['frames'], self.meta['rows']
+        self.time_per_frame = timedelta(seconds=1 / self.meta['fps'])
+        self.columns: Dict[str, np.ndarray] = {}
+        for name, dtype in FRAME_COLUMNS.items():
+            self.columns[name] = _load(path, name, dtype, (frames + 1 if name == 'offsets' else frames,))
+        for name, (dtype, shape) in BOX_COLUMNS.items():
+            self.columns[name] = _load(path, name, dtype, (rows,) + shape)
+
+    def __len__(self) -> int:
+        return self.meta['frames']
+
+    def frames(self, origin: datetime) -> Iterator[Tuple[datetime, int, np.ndarray, Optional[List[int]]]]:
+        """
+        Yield the timestamp, gap, boxes (xywh) and track IDs of every frame, in the form inference() counts them.
+        A gap of 0 marks a frame on which detection was skipped.
+        """
+        offsets, timestamps = self.columns['offsets'], self.columns['timestamps']
+        gaps, tracked = self.columns['gaps'], self.columns['tracked']
+        boxes, track_ids = self.columns['boxes'], self.columns['track_ids']
+        for i in range(len(self)):
+            start, end = offsets[i], offsets[i + 1]
+            yield (origin + timedelta(microseconds=int(timestamps[i])), int(gaps[i]), boxes[start:end],
+                   track_ids[start:end].tolist() if tracked[i] else None)
+
+
+class CacheWriter:
+    """
+    Append the tracks of every frame to the columns of a new cache entry.
+
+    The columns are streamed to raw files as frames arrive, so memory stays flat however long the
+    video is. inference() calls start once it knows the time base of the video. The entry only
+    becomes visible to DetectionCache.get when commit is called.
+    """
+
+    def __init__(self, cache: 'DetectionCache', key: str):
+        self.cache = cache
+        self.key = key
+        self.origin: Optional[datetime] = None
+        self.fps: Optional[float] = None
+        self.path = os.path.join(cache.root, f'.{key}.{uuid.uuid4().hex}.tmp')
+        os.makedirs(self.path)
+        self._files = {name: open(os.path.join(self.path, f'{name}.bin'), 'wb')
+                       for name in list(FRAME_COLUMNS) + list(BOX_COLUMNS)}
+        self.frames = 0
+        self.rows = 0
+        self._files['offsets'].write(np.zeros(1, dtype=np.int64).tobytes())
+
+    def start(self, origin: datetime, fps: float) -> None:
+        """
+        Set the start time the frames are dated from and the frame rate of the video.
+        """
+        self.origin = origin
+        self.fps = fps
+
+    def append(self, timestamp: datetime, gap: int, boxes, track_ids: Optional[List[int]],
+               scores: Optional[np.ndarray] = None, class_ids: Optional[np.ndarray] = None) -> None:
+        """
+        Record one frame. Skipped frames have a gap of 0 and no boxes.
+        """
+        boxes = np.zeros((0, 4)) if boxes is None or gap == 0 else np.asarray(boxes).reshape(-1, 4)
+        rows = len(boxes)
+        columns = {
+            'boxes': boxes,
+            'track_ids': track_ids if track_ids is not None and rows else np.full(rows, -1),
+            'scores': scores if scores is not None and len(scores) == rows else np.full(rows, np.nan),
+            'class_ids': class_ids if class_ids is not None and len(class_ids) == rows else np.full(rows, -1),
+        }
+        for name, (dtype, _) in BOX_COLUMNS.items():
+            self._files[name].write(np.asarray(columns[name], dtype=dtype).tobytes())
+        self.rows += rows
+        self.frames += 1
+        self._files['offsets'].write(np.int64(self.rows).tobytes())
+        self._files['timestamps'].write(np.int64((timestamp - self.origin) // timedelta(microseconds=1)).tobytes())
+        self._files['gaps'].write(np.int16(gap).tobytes())
+        self._files['tracked'].write(np.bool_(track_ids is not None and gap > 0).tobytes())
+
+    def commit(self) -> None:
+        """
+        Publish the entry under its key and evict the least recently used entries above the size limit.
+        """
+        self._close()
+        with open(os.path.join(self.path, 'meta.json'), 'w') as file:
+            json.dump({'frames': self.frames, 'rows': self.rows, 'fps': self.fps}, file)
+        target = os.path.join(self.cache.root, self.key)
+        shutil.rmtree(target, ignore_errors=True)
+        os.replace(self.path, target)
+        self.cache.prune(keep=self.key)
+
+    def discard(self) -> None:
+        """
+        Delete the unfinished entry, e.g. after inference failed.
+        """
+        self._close()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def _close(self) -> None:
+        for file in self._files.values():
+            file.close()
+
+
+class DetectionCache:
+    """
+    A directory of per-video tracking results, so counting can be replayed without the detector.
+
+    An entry is keyed by the video's fingerprint, the model file and every setting that changes
+    the boxes or tracks. The counting lines are drawn only on the annotated video, after detection,
+    so they are part of the key only through the ROI tiles that follow them. Changing the lines of
+    a whole-frame run replays the cached tracks at the speed of the crossing test instead of
+    re-running detection. The total size, unfinished entries included, is capped by evicting the
+    least recently used entries.
+    """
+
+    def __init__(self, root: str = '.detection_cache', max_bytes: int = 2 << 30, stale_after: float = 3600.0):
+        """
+        Parameters:
+            root (str, optional): The cache directory, created if needed. Defaults to '.detection_cache'.
+            max_bytes (int, optional): The most bytes all entries may take on disk. Defaults to 2 GiB.
+            stale_after (float, optional): The seconds after its last write an unfinished entry is taken as left
+                behind by a killed run and deleted. A running writer appends to its files on every frame. Defaults to 1 hour.
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        self.stale_after = stale_after
+        os.makedirs(root, exist_ok=True)
+
+    def key(self, video_path: str, model_path: str, **settings) -> str:
+        """
+        Return the key of a video processed with a model and settings, e.g. backend, imgsz, thresholds and max_stride.
+        """
+        model = file_fingerprint(model_path) if os.path.isfile(model_path) else model_path
+        identity = json.dumps({'video': file_fingerprint(video_path), 'model': model, 'settings': settings},
+                              sort_keys=True, default=str)
+        return hashlib.sha256(identity.encode()).hexdigest()[:32]
+
+    def get(self, key: str) -> Optional[CachedDetections]:
+        """
+        Return the entry of a key, or None if it isn't cached. A hit marks the entry as recently used.
+        """
+        path = os.path.join(self.root, key)
+        if not os.path.isfile(os.path.join(path, 'meta.json')):
+            return None
+        os.utime(os.path.join(path, 'meta.json'))
+        return CachedDetections(path)
+
+    def writer(self, key: str) -> CacheWriter:
+        """
+        Start a new entry for a key, to be passed to inference() as its recorder.
+        """
+        # Clear the space left by runs that were killed before they could commit or discard their entry
+        self.prune()
+        return CacheWriter(self, key)
+
+    def prune(self, keep: str = None) -> None:
+        """
+        Delete the unfinished entries of killed runs, then the least recently used entries until the cache fits in
+        max_bytes. The entry keep and the unfinished entries of running writers are never deleted, but count
+        towards max_bytes.
+        """
+        entries, unfinished = [], 0
+        now = time.time()
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.startswith('.') and name.endswith('.tmp') and os.path.isdir(path):
+                files = [entry.stat() for entry in os.scandir(path)]
+                modified = max([stat.st_mtime for stat in files], default=os.path.getmtime(path))
+                if now - modified > self.stale_after:
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    unfinished += sum(stat.st_size for stat in files)
+                continue
+            meta = os.path.join(path, 'meta.json')
+            if name.startswith('.') or not os.path.isfile(meta):
+                continue
+            size = sum(entry.stat().st_size for entry in os.scandir(path))
+            entries.append((os.path.getmtime(meta), name, size))
+
+        total = unfinished + sum(size for _, _, size in entries)
+        for _, name, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if name != keep:
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+                total -= size
+
+
+def _load(path: str, name: str, dtype, shape: Tuple[int, ...]) -> np.ndarray:
+    # Memory-map a column; np.memmap refuses empty files, which an entry without boxes has
+    if 0 in shape:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(os.path.join(path, f'{name}.bin'), dtype=dtype, mode='r', shape=shape)
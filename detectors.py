@@ -0,0 +1,271 @@
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from metrics import Metrics
+from tracker import ByteTracker
+
+# COCO classes counted by the pipeline: cars (class 2) and trucks (class 7)
+VEHICLE_CLASSES: Tuple[int, ...] = (2, 7)
+# The detection confidence and NMS IoU thresholds of every backend
+CONF_THRESHOLD: float = 0.1
+IOU_THRESHOLD: float = 0.5
+
+
+class DetectorBackend:
+    """
+    The interface inference() uses to detect and track vehicles in a frame.
+    """
+
+    # Where the detect and track stage times go, disabled until attach_metrics is called
+    metrics: Metrics = Metrics(enabled=False)
+    # The scores and class IDs of the boxes the last track call returned, None if the backend doesn't report them
+    scores: Optional[np.ndarray] = None
+    class_ids: Optional[np.ndarray] = None
+
+    def attach_metrics(self, metrics: Metrics) -> None:
+        """
+        Record the detect and track stage times of every following call in metrics.
+        """
+        self.metrics = metrics
+
+    def track(self, frame: np.ndarray) -> Tuple[np.ndarray, Optional[List[int]]]:
+        """
+        Detect and track the vehicles in the next frame of a stream.
+
+        Parameters:
+            frame (np.ndarray): The BGR frame.
+
+        Returns:
+            Tuple[np.ndarray, Optional[List[int]]]: The boxes in (center x, center y, width, height) format, shape (N, 4),
+                and their track IDs, or None if no tracks were assigned.
+        """
+        raise NotImplementedError
+
+    def skip_frame(self) -> None:
+        """
+        Tell the tracker that a frame of the stream passed without detection, so it can predict the
+        tracks over the gap on the next call. Backends that can't do this ignore it.
+        """
+
+    def set_frame_rate(self, frame_rate: float) -> None:
+        """
+        Tell the tracker the frame rate of the stream, which sets how many frames a lost track is kept.
+        Backends whose tracker doesn't take it ignore it.
+        """
+
+    def has_tentative_tracks(self) -> bool:
+        """
+        Whether the tracker holds new tracks that are not reported yet because they must first be
+        matched again on the next frame. Frames shouldn't be skipped while this is true.
+        """
+        return False
+
+    def reset(self) -> None:
+        """
+        Forget all tracks, e.g. before starting a new video.
+        """
+        raise NotImplementedError
+
+
+class UltralyticsBackend(DetectorBackend):
+    """
+    Detection and tracking with an ultralytics YOLO model and its built-in ByteTrack.
+    """
+
+    def __init__(
+            self,
+            model,
+            device: str = 'cpu',
+            imgsz=(640, 640),
+            classes: Sequence[int] = VEHICLE_CLASSES,
+            conf: float = CONF_THRESHOLD,
+            iou: float = IOU_THRESHOLD,
+            tracker: str = "bytetrack.yaml"):
+        """
+        Parameters:
+            model (YOLO): The YOLO model used for tracking.
+            device (str, optional): The device to run the inference on. Defaults to 'cpu'.
+            imgsz (tuple, optional): The size of the input image. Defaults to (640, 640).
+            classes (Sequence[int], optional): The class IDs to keep. Defaults to cars and trucks.
+            conf (float, optional): The detection confidence threshold. Defaults to 0.1.
+            iou (float, optional): The NMS IoU threshold. Defaults to 0.5.
+            tracker (str, optional): The ultralytics tracker configuration. Defaults to "bytetrack.yaml".
+        """
+        self.model = model
+        self.device = device
+        self.imgsz = imgsz
+        self.classes = list(classes)
+        self.conf = conf
+        self.iou = iou
+        self.tracker = tracker
+
+    def track(self, frame: np.ndarray) -> Tuple[np.ndarray, Optional[List[int]]]:
+        start = time.perf_counter()
+        results = self.model.track(frame, classes=self.classes, persist=True, device=self.device, imgsz=self.imgsz,
+                                   conf=self.conf, iou=self.iou, tracker=self.tracker)
+        if self.metrics.enabled:
+            # ultralytics reports its own preprocess, inference and postprocess times in ms, the rest is the tracker
+            speed = results[0].speed
+            detect_time = sum(speed.get(step) or 0.0 for step in ('preprocess', 'inference', 'postprocess')) / 1000
+            self.metrics.observe('detect', detect_time)
+            self.metrics.observe('track', max(time.perf_counter() - start - detect_time, 0.0))
+
+        # Get the boxes and track IDs
+        boxes = np.asarray(results[0].boxes.xywh.cpu())
+        self.scores = np.asarray(results[0].boxes.conf.cpu())
+        self.class_ids = np.asarray(results[0].boxes.cls.cpu())
+        track_ids = None
+        if results[0].boxes.id is not None:
+            track_ids = results[0].boxes.id.int().cpu().tolist()
+        return boxes, track_ids
+
+    def has_tentative_tracks(self) -> bool:
+        trackers = getattr(getattr(self.model, 'predictor', None), 'trackers', None) or []
+        return any(not track.is_activated for tracker in trackers for track in getattr(tracker, 'tracked_stracks', []))
+
+    def reset(self) -> None:
+        # ultralytics keeps its trackers on the predictor and rebuilds them when it is cleared
+        if getattr(self.model, 'predictor', None) is not None:
+            self.model.predictor = None
+
+
+class ONNXBackend(DetectorBackend):
+    """
+    Detection with DetectorONNX on ONNX Runtime and tracking with the standalone ByteTracker.
+    """
+
+    def __init__(self, detector, tracker: ByteTracker = None, classes: Sequence[int] = VEHICLE_CLASSES,
+                 detector_metrics: bool = True):
+        """
+        Parameters:
+            detector (DetectorONNX): The ONNX detector.
+            tracker (ByteTracker, optional): The tracker. Defaults to a ByteTracker with ultralytics' bytetrack.yaml settings.
+            classes (Sequence[int], optional): The class IDs to keep. Defaults to cars and trucks.
+            detector_metrics (bool, optional): Whether attach_metrics hands the metrics to the detector as well. False for
+                a detector shared by several backends, e.g. a BatchScheduler, which is given its metrics once. Defaults to True.
+        """
+        self.detector = detector
+        self.detector_metrics = detector_metrics
+        self.tracker = tracker if tracker is not None else ByteTracker()
+        self.classes = np.asarray(classes)
+        self._skipped = 0
+
+    def attach_metrics(self, metrics: Metrics) -> None:
+        # The detector records its preprocess, inference and postprocess steps as well
+        self.metrics = metrics
+        if self.detector_metrics:
+            self.detector.metrics = metrics
+
+    def track(self, frame: np.ndarray) -> Tuple[np.ndarray, Optional[List[int]]]:
+        with self.metrics.timer('detect'):
+            boxes, scores, class_ids = self.detector.detect_objects(frame)
+        with self.metrics.timer('track'):
+            frames, self._skipped = 1 + self._skipped, 0
+            return self.update(boxes, scores, class_ids, frames)
+
+    def skip_frame(self) -> None:
+        self._skipped += 1
+
+    def set_frame_rate(self, frame_rate: float) -> None:
+        self.tracker.set_frame_rate(frame_rate)
+
+    def has_tentative_tracks(self) -> bool:
+        return self.tracker.has_tentative_tracks
+
+    def update(self, boxes: np.ndarray, scores: np.ndarray, class_ids: np.ndarray,
+               frames: int = 1) -> Tuple[np.ndarray, Optional[List[int]]]:
+        """
+        Feed the raw detections of a frame to the tracker.
+
+        Parameters:
+            boxes (np.ndarray): The detected boxes in (x1, y1, x2, y2) format.
+            scores (np.ndarray): The detection scores.
+            class_ids (np.ndarray): The detected class IDs.
+            frames (int, optional): The number of frames since the previous update. Defaults to 1.
+
+        Returns:
+            Tuple[np.ndarray, Optional[List[int]]]: The tracked boxes in xywh format and their track IDs, or None if there are none.
+        """
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        scores = np.asarray(scores, dtype=np.float64).reshape(-1)
+        class_ids = np.asarray(class_ids, dtype=np.int64).reshape(-1)
+        keep = np.isin(class_ids, self.classes)
+
+        tracked_boxes, track_ids, self.scores, self.class_ids = self.tracker.update(boxes[keep], scores[keep], class_ids[keep], frames)
+        xywh = np.concatenate([(tracked_boxes[:, :2] + tracked_boxes[:, 2:]) / 2, tracked_boxes[:, 2:] - tracked_boxes[:, :2]], axis=1)
+        return xywh, (track_ids.tolist() if len(track_ids) else None)
+
+    def reset(self) -> None:
+        self.tracker.reset()
+        self._skipped = 0
+
+
+def as_backend(model, device: str = 'cpu', imgsz=(640, 640)) -> DetectorBackend:
+    """
+    Return the model itself if it already is a detector backend, otherwise wrap a YOLO model in an UltralyticsBackend.
+    """
+    if isinstance(model, DetectorBackend):
+        return model
+    return UltralyticsBackend(model, device=device, imgsz=imgsz)
+
+
+def onnx_session_settings(model_path: str, tuning_path: str = None, threads: int = None, inter_threads: int = None,
+                          thread_affinities: str = None, spinning: bool = None) -> Tuple[str, Dict]:
+    """
+    Return the model variant to load and the DetectorONNX thread settings: the tuning of ort_tuning.py for this
+    model on this kind of CPU, overridden by the settings given here, see create_backend.
+    """
+    from ort_tuning import load_tuning
+
+    settings = load_tuning(tuning_path, model_path)
+    model_path = settings.pop('model_path', model_path)
+    explicit = {'threads': threads, 'thread_affinities': thread_affinities, 'spinning': spinning}
+    if inter_threads:
+        explicit.update(inter_threads=inter_threads, parallel=inter_threads > 1)
+    settings.update({key: value for key, value in explicit.items() if value is not None})
+    return model_path, settings
+
+
+def create_backend(backend: str, model_path: str, device: str = 'cpu', imgsz=(640, 640), threads: int = None,
+                   tuning_path: str = None, inter_threads: int = None, thread_affinities: str = None,
+                   spinning: bool = None) -> DetectorBackend:
+    """
+    Build a detector backend by name, importing only the runtime it needs.
+
+    Parameters:
+        backend (str): 'ultralytics' for YOLO with its built-in tracker, or 'onnx' for DetectorONNX with ByteTracker.
+        model_path (str): The path to the .pt weights or the .onnx model.
+        device (str, optional): The device to run the inference on. Defaults to 'cpu'.
+        imgsz (tuple, optional): The size of the input image (height, width). Defaults to (640, 640).
+        threads (int, optional): The number of CPU threads the runtime may use, e.g. one share of the cores per
+            worker process. Defaults to None, which leaves the runtime's default.
+        tuning_path (str, optional): The file written by ort_tuning.py. If it holds a tuning of this .onnx model
+            on this kind of CPU, its model variant and thread settings are used; the thread settings given here
+            override the tuned ones. Defaults to None.
+        inter_threads (int, optional): Above 1, the ONNX session runs independent branches of the graph in parallel
+            on this many threads. Defaults to None.
+        thread_affinities (str, optional): The cores of the ONNX session's intra-op threads after the first, e.g.
+            '1;2;3', see DetectorONNX. Defaults to None.
+        spinning (bool, optional): Whether idle ONNX Runtime threads spin instead of sleeping. Defaults to None,
+            which keeps ONNX Runtime's default.
+
+    Returns:
+        DetectorBackend: The backend.
+    """
+    if backend == 'ultralytics':
+        from ultralytics import YOLO
+
+        if threads:
+            import torch
+
+            torch.set_num_threads(threads)
+        return UltralyticsBackend(YOLO(model_path), device=device, imgsz=imgsz)
+    if backend == 'onnx':
+        from legacy_onnx_detector import DetectorONNX
+
+        model_path, settings = onnx_session_settings(model_path, tuning_path, threads, inter_threads, thread_affinities, spinning)
+        return ONNXBackend(DetectorONNX(model_path, device=device, conf_threshold=CONF_THRESHOLD, iou_threshold=IOU_THRESHOLD,
+                                        imgsz=imgsz, **settings))
+    raise ValueError(f"Unknown detector backend: {backend!r}, expected 'ultralytics' or 'onnx'")
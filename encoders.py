@@ -0,0 +1,246 @@
+import os
+import queue
+import subprocess
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Callable, Deque, Optional
+
+import numpy as np
+
+from metrics import Metrics
+from utils import initialize_video_writer
+
+_CLOSE = object()
+
+
+class VideoEncoder:
+    """
+    Where the annotated frames go.
+    """
+
+    def write(self, frame: np.ndarray, event: bool = False, timestamp: datetime = None) -> None:
+        """
+        Encode one frame.
+
+        Parameters:
+            frame (np.ndarray): The annotated BGR frame. The encoder may keep it, so it must not be changed afterwards.
+            event (bool, optional): Whether a crossing was counted on this frame. Defaults to False.
+            timestamp (datetime, optional): The time of the frame. Defaults to None.
+        """
+        raise NotImplementedError
+
+    def release(self) -> None:
+        """
+        Finish the video after the frames written so far.
+        """
+
+
+class OpenCVEncoder(VideoEncoder):
+    """
+    Encode with OpenCV's mp4v writer on the calling thread.
+    """
+
+    def __init__(self, path: str, frame_width: int, frame_height: int, frame_rate: float = 30.0):
+        self.out = initialize_video_writer(path, frame_width, frame_height, frame_rate)
+
+    def write(self, frame: np.ndarray, event: bool = False, timestamp: datetime = None) -> None:
+        self.out.write(frame)
+
+    def release(self) -> None:
+        self.out.release()
+
+
+class FFmpegEncoder(VideoEncoder):
+    """
+    Pipe raw frames to an ffmpeg process, which encodes them with any codec it supports.
+
+    The encoding runs in the ffmpeg process, on other cores than the detector, and can use a fast
+    preset or a hardware encoder such as h264_nvenc or h264_qsv.
+    """
+
+    def __init__(self, path: str, frame_width: int, frame_height: int, frame_rate: float = 30.0,
+                 codec: str = 'libx264', preset: Optional[str] = 'veryfast', crf: Optional[int] = 23,
+                 ffmpeg: str = 'ffmpeg'):
+        """
+        Parameters:
+            path (str): The video file to write.
+            frame_width (int): The width of the frames.
+            frame_height (int): The height of the frames.
+            frame_rate (float, optional): The frame rate of the source video. Defaults to 30.
+            codec (str, optional): The ffmpeg video encoder. Defaults to 'libx264'.
+            preset (str, optional): The encoder preset, None for the encoder's default. Defaults to 'veryfast'.
+            crf (int, optional): The constant rate factor, None for the encoder's default. Defaults to 23.
+            ffmpeg (str, optional): The ffmpeg executable. Defaults to 'ffmpeg' on the PATH.
+        """
+        command = [ffmpeg, '-y', '-loglevel', 'error',
+                   '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{frame_width}x{frame_height}', '-r', f'{frame_rate:g}',
+                   '-i', '-', '-an', '-c:v', codec]
+        if preset is not None:
+            command += ['-preset', preset]
+        if crf is not None:
+            command += ['-crf', str(crf)]
+        command += ['-pix_fmt', 'yuv420p', path]
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def write(self, frame: np.ndarray, event: bool = False, timestamp: datetime = None) -> None:
+        self.process.stdin.write(np.ascontiguousarray(frame).data)
+
+    def release(self) -> None:
+        self.process.stdin.close()
+        if self.process.wait() != 0:
+            raise RuntimeError(f'ffmpeg exited with code {self.process.returncode}')
+
+
+class ThreadedEncoder(VideoEncoder):
+    """
+    Hand the frames to another encoder on its own thread, through a bounded queue.
+
+    The thread that detects only pays for queueing a frame. It waits only when the encoder
+    falls behind by more than queue_size frames.
+    """
+
+    def __init__(self, encoder: VideoEncoder, queue_size: int = 16, metrics: Metrics = None):
+        """
+        Parameters:
+            encoder (VideoEncoder): The encoder to run on the thread.
+            queue_size (int, optional): The most frames waiting to be encoded. Defaults to 16.
+            metrics (Metrics, optional): Where to record the time the thread spends encoding. Defaults to None.
+        """
+        self.encoder = encoder
+        self.metrics = metrics if metrics is not None else Metrics(enabled=False)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._run, name='encoder', daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is _CLOSE:
+                break
+            if self._error is not None:
+                continue
+            try:
+                with self.metrics.timer('encode_worker'):
+                    self.encoder.write(*item)
+            except BaseException as e:
+                # Keep draining the queue so the writer never blocks, and raise on release
+                self._error = e
+
+    def write(self, frame: np.ndarray, event: bool = False, timestamp: datetime = None) -> None:
+        if self._error is not None:
+            raise self._error
+        self._queue.put((frame, event, timestamp))
+
+    def release(self) -> None:
+        self._queue.put(_CLOSE)
+        self._thread.join()
+        self.encoder.release()
+        if self._error is not None:
+            raise self._error
+
+
+class ClipEncoder(VideoEncoder):
+    """
+    Save only short clips around the frames with a counted crossing instead of the whole video.
+
+    The last seconds_before of frames are kept in memory. A crossing opens a clip with them and the
+    clip runs until seconds_after past the last crossing in it, so crossings close together share
+    one clip. Clips are named after the export path with the time of their first crossing, e.g.
+    output_20240219-135012.345.mp4.
+    """
+
+    def __init__(self, path: str, open_encoder: Callable[[str], VideoEncoder], frame_rate: float = 30.0,
+                 seconds_before: float = 2.0, seconds_after: float = 2.0):
+        """
+        Parameters:
+            path (str): The export path the clip names are derived from.
+            open_encoder (Callable[[str], VideoEncoder]): Opens an encoder for a clip's path.
+            frame_rate (float, optional): The frame rate of the source video. Defaults to 30.
+            seconds_before (float, optional): The seconds kept before a crossing. Defaults to 2.
+            seconds_after (float, optional): The seconds kept after the last crossing of a clip. Defaults to 2.
+        """
+        self.stem, self.extension = os.path.splitext(path)
+        self.open_encoder = open_encoder
+        self.frames_after = max(1, round(seconds_after * frame_rate))
+        self._before: Deque[np.ndarray] = deque(maxlen=max(1, round(seconds_before * frame_rate)))
+        self._clip: Optional[VideoEncoder] = None
+        self._remaining = 0
+        self.clips = 0
+
+    def write(self, frame: np.ndarray, event: bool = False, timestamp: datetime = None) -> None:
+        if event:
+            if self._clip is None:
+                name = f'_{timestamp:%Y%m%d-%H%M%S.%f}'[:-3] if timestamp is not None else f'_{self.clips:04d}'
+                self._clip = self.open_encoder(f'{self.stem}{name}{self.extension or ".mp4"}')
+                self.clips += 1
+                for buffered in self._before:
+                    self._clip.write(buffered)
+                self._before.clear()
+            self._remaining = self.frames_after
+
+        if self._clip is None:
+            self._before.append(frame)
+            return
+        self._clip.write(frame)
+        self._remaining -= 1
+        if self._remaining <= 0:
+            self._clip.release()
+            self._clip = None
+
+    def release(self) -> None:
+        if self._clip is not None:
+            self._clip.release()
+            self._clip = None
+
+
+def create_encoder(
+        path: str,
+        frame_width: int,
+        frame_height: int,
+        frame_rate: float = 30.0,
+        encoder: str = 'opencv',
+        codec: str = 'libx264',
+        preset: Optional[str] = 'veryfast',
+        crf: Optional[int] = 23,
+        threaded: bool = True,
+        clips: bool = False,
+        seconds_before: float = 2.0,
+        seconds_after: float = 2.0,
+        metrics: Metrics = None) -> VideoEncoder:
+    """
+    Build the encoder of the annotated video from its settings.
+
+    Parameters:
+        path (str): The video file to write, or the name the clips are derived from.
+        frame_width (int): The width of the frames.
+        frame_height (int): The height of the frames.
+        frame_rate (float, optional): The frame rate of the source video. Defaults to 30.
+        encoder (str, optional): 'opencv' for OpenCV's mp4v writer or 'ffmpeg' for an ffmpeg process. Defaults to 'opencv'.
+        codec (str, optional): The ffmpeg encoder, e.g. 'libx264', 'libx265' or 'h264_nvenc'. Defaults to 'libx264'.
+        preset (str, optional): The ffmpeg encoder preset. Defaults to 'veryfast'.
+        crf (int, optional): The ffmpeg constant rate factor. Defaults to 23.
+        threaded (bool, optional): Whether to encode on a separate thread. Defaults to True.
+        clips (bool, optional): Whether to save only clips around the crossings, see ClipEncoder. Defaults to False.
+        seconds_before (float, optional): The seconds a clip starts before a crossing. Defaults to 2.
+        seconds_after (float, optional): The seconds a clip ends after its last crossing. Defaults to 2.
+        metrics (Metrics, optional): Where the encoder thread records its times. Defaults to None.
+
+    Returns:
+        VideoEncoder: The encoder.
+    """
+    if encoder == 'opencv':
+        def open_encoder(clip_path: str) -> VideoEncoder:
+            return OpenCVEncoder(clip_path, frame_width, frame_height, frame_rate)
+    elif encoder == 'ffmpeg':
+        def open_encoder(clip_path: str) -> VideoEncoder:
+            return FFmpegEncoder(clip_path, frame_width, frame_height, frame_rate, codec=codec, preset=preset, crf=crf)
+    else:
+        raise ValueError(f"Unknown video encoder: {encoder!r}, expected 'opencv' or 'ffmpeg'")
+
+    if clips:
+        result = ClipEncoder(path, open_encoder, frame_rate, seconds_before=seconds_before, seconds_after=seconds_after)
+    else:
+        result = open_encoder(path)
+    return ThreadedEncoder(result, metrics=metrics) if threaded else result
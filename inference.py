@@ -1,149 +1,440 @@
 from datetime import datetime, timedelta
-from typing import List, Dict
+from typing import Dict, List, NamedTuple, Optional, Tuple
 
 from config import (
     line_position_horizontal,
     line_position_perpendicular,
-    START_POINT_HORIZONTAL,
-    END_POINT_HORIZONTAL,
-    START_POINT_PERPENDICULAR,
-    END_POINT_PERPENDICULAR)
-from utils import initialize_video_writer
+    imgsz as default_imgsz,
+    zones_path,
+    track_max_age,
+    track_max_states,
+    video_start_time,
+    timestamps_from_pts,
+    video_encoder,
+    ffmpeg_codec,
+    ffmpeg_preset,
+    ffmpeg_crf,
+    event_clips,
+    clip_seconds_before,
+    clip_seconds_after)
+from capture import LiveCapture
+from crossing import LineCrossingCounter
+from detection_cache import CacheWriter, CachedDetections
+from detectors import DetectorBackend, as_backend
+from encoders import OpenCVEncoder, VideoEncoder, create_encoder
+from metrics import Metrics
+from pipeline import run_pipeline, format_stage_report
+from sinks import EventSink, ListSink
+from stride import AdaptiveStride, crossing_offset
+from timebase import FrameClock, parse_start_time, source_fps
+from zones import CountingLine, load_zones, zone_segments
 
 import cv2
-from ultralytics import YOLO
+import numpy as np
 
 
-def inference(model: YOLO, video_path: str, export_path: str, device: str = 'cpu', imgsz=(640,640), save: bool = True) -> List[Dict]:
+def default_counting_lines(imgsz: Tuple[int, int] = default_imgsz) -> List[CountingLine]:
+    """
+    Return the default horizontal and perpendicular counting lines, evaluated in this order for every box.
+
+    The lines span the whole frame of size imgsz (height, width), so like the unbounded lines they replace
+    they count every crossing of their position, wherever it happens. The perpendicular line is walked
+    bottom to top so that moving right is a crossing to its right-hand side.
+    """
+    height, width = imgsz
+    return [
+        CountingLine((0, line_position_horizontal), (width, line_position_horizontal), ('UP', 'DOWN'), (0, 255, 0), 'horizontal'),
+        CountingLine((line_position_perpendicular, height), (line_position_perpendicular, 0), ('LEFT', 'RIGHT'), (255, 0, 0),
+                     'perpendicular'),
+    ]
+
+
+class CountedFrame(NamedTuple):
+    """
+    The result of counting one frame, handed to the optional annotation stage.
+    """
+    frame: np.ndarray
+    boxes: np.ndarray
+    track_ids: Optional[List[int]]
+    last_line: Optional[np.ndarray]  # The index of the line each box crossed last, -1 for none
+    timestamp: datetime
+    car_counts: Dict[str, int]  # The counts after this frame
+
+
+class VideoAnnotator:
+    """
+    The annotation stage: draw the tracks, counts and time on every counted frame and encode it.
+    """
+
+    def __init__(self, export_path: str, frame_width: int, frame_height: int, lines: List[CountingLine],
+                 metrics: Metrics = None, frame_rate: float = 30.0, encoder: VideoEncoder = None):
+        """
+        Parameters:
+            export_path (str): The path to save the annotated video.
+            frame_width (int): The width of the frames.
+            frame_height (int): The height of the frames.
+            lines (List[CountingLine]): The counting segments, used to colour each box by the line it crossed last.
+            metrics (Metrics, optional): Where to record the draw and encode times. Defaults to None.
+            frame_rate (float, optional): The frame rate of the source video. Defaults to 30.
+            encoder (VideoEncoder, optional): Where the annotated frames go, see encoders.create_encoder.
+                Defaults to OpenCV's mp4v writer at export_path.
+        """
+        self.frame_height = frame_height
+        self.lines = lines
+        self.metrics = metrics if metrics is not None else Metrics(enabled=False)
+        self.out = encoder if encoder is not None else OpenCVEncoder(export_path, frame_width, frame_height, frame_rate)
+        self._car_counts = None
+
+    def __call__(self, counted: CountedFrame) -> None:
+        with self.metrics.timer('draw'):
+            # The lines are drawn only after detection, so the detector and the tracks never depend on them
+            draw_lines(counted.frame, self.lines)
+            draw_tracks(counted.frame, counted.boxes, counted.track_ids, counted.last_line, self.lines)
+            # Draw the car counts and current time
+            draw_car_counts_and_time(counted.frame, counted.car_counts, counted.timestamp, self.frame_height)
+
+        # Write the frame with annotations to the output video, marking the frames on which a crossing was counted
+        event = self._car_counts is not None and counted.car_counts != self._car_counts
+        self._car_counts = counted.car_counts
+        with self.metrics.timer('encode'):
+            self.out.write(counted.frame, event, counted.timestamp)
+
+    def release(self) -> None:
+        self.out.release()
+
+
+def counting_lines(imgsz: Tuple[int, int] = default_imgsz) -> List[CountingLine]:
+    """
+    Return the configured counting segments: the edges and lines of config.zones_path if set, otherwise the
+    default lines across frames of size imgsz (height, width).
+    """
+    return zone_segments(load_zones(zones_path)) if zones_path else default_counting_lines(imgsz)
+
+
+def inference(
+        model: DetectorBackend,
+        video_path: str,
+        export_path: str,
+        device: str = 'cpu',
+        imgsz=(640,640),
+        save: bool = True,
+        pipelined: bool = False,
+        queue_size: int = 8,
+        metrics: Metrics = None,
+        sink: EventSink = None,
+        max_stride: int = 1,
+        start_time: datetime = None,
+        start_frame: int = 0,
+        end_frame: int = None,
+        recorder: CacheWriter = None,
+        live: bool = False,
+        live_buffer_size: int = 4) -> List[Dict]:
     """
     Run inference on the input video and save the annotated video if specified.
 
     Parameters:
-        model (YOLO): The YOLO model used for tracking.
+        model (DetectorBackend): The detector backend used for tracking, or a YOLO model which is wrapped in an UltralyticsBackend.
         video_path (str): The path to the input video.
         export_path (str): The path to save the annotated video.
         device (str, optional): The device to run the inference on. Defaults to 'cpu'.
         imgsz (tuple, optional): The size of the input image (width, height).  Defaults to (640, 640).
-        save (bool, optional): Whether to save the annotated video. Defaults to True.
+        save (bool, optional): Whether to annotate and save the video. Without it no video writer is opened and
+            nothing is drawn, only the crossing events are produced. Defaults to True.
+        pipelined (bool, optional): Whether to run decode, tracking, counting and annotation in separate threads
+            connected by bounded queues and print a per-stage throughput report. Defaults to False.
+        queue_size (int, optional): The capacity of each queue between pipeline stages. Defaults to 8.
+        metrics (Metrics, optional): Where to record the decode, resize, detect, track, crossing, draw and encode
+            stage times and the crossing counters. Defaults to None, which records nothing.
+        sink (EventSink, optional): Where to stream the state changes as they happen, e.g. a CSVSink. It is flushed
+            at the end but left open. Defaults to None, which collects them in memory and returns them.
+        max_stride (int, optional): The most frames between two detections. Above 1, detection skips frames while no
+            track is close to a line (see stride.AdaptiveStride) and crossings in between are dated by
+            interpolation. Defaults to 1, which detects on every frame.
+        start_time (datetime, optional): The wall-clock time of the start of the video, to which the timestamp of
+            every frame in the container is added. Defaults to config.video_start_time.
+        start_frame (int, optional): The first frame to process, e.g. of a chunk of a long video. Defaults to 0.
+        end_frame (int, optional): The frame to stop before. Defaults to None, which processes the rest of the video.
+        recorder (CacheWriter, optional): Where to record the tracks of every frame, so counting can later be
+            replayed from a DetectionCache, see replay. The caller commits it. Defaults to None.
+        live (bool, optional): Whether video_path is a live camera. Frames are then read on their own thread into a
+            ring buffer that drops the oldest frames when counting falls behind, and the stream is reopened when
+            it fails, see capture.LiveCapture. Defaults to False.
+        live_buffer_size (int, optional): The most frames buffered in live mode. Defaults to 4.
 
     Returns:
-        List[Dict]: A list of state changes with timestamps.
+        List[Dict]: A list of state changes with timestamps, or an empty list if they were streamed to a sink.
     """
-    cap = cv2.VideoCapture(video_path)
+    backend = as_backend(model, device=device, imgsz=imgsz)
+    if metrics is None:
+        metrics = Metrics(enabled=False)
+    backend.attach_metrics(metrics)
+    cap = LiveCapture(video_path, buffer_size=live_buffer_size, metrics=metrics) if live else cv2.VideoCapture(video_path)
     # Ensure the frame dimensions are integers
     target_height, target_width = imgsz
-    out = initialize_video_writer(export_path, target_width, target_height)
 
-    # Initialize simulation variables
-    start_time = datetime.strptime("19.02.2024 13:50:00", "%d.%m.%Y %H:%M:%S")  # Simulated start time
-    frame_rate = 30  # Assuming 30 FPS for the video
-    time_per_frame = timedelta(seconds=1/frame_rate)
-    current_time = start_time
+    # Date every frame by the source's own timestamps and frame rate
+    frame_rate = source_fps(cap)
+    clock = FrameClock(start_time or parse_start_time(video_start_time), frame_rate, use_pts=timestamps_from_pts,
+                       first_frame=start_frame)
+    # Lost tracks are kept for a fixed time, not a fixed number of frames
+    backend.set_frame_rate(frame_rate)
+    if start_frame:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+    if recorder is not None:
+        recorder.start(clock.origin, frame_rate)
 
     # Initialize tracking variables
-    car_positions = {}
-    car_counts = {'UP': 0, 'DOWN': 0, 'LEFT': 0, 'RIGHT': 0}
-    already_counted = {}    # Tracks whether a car has been counted to prevent double counting
-    state_changes = []  # To record state changes with timestamps
+    lines = counting_lines(imgsz)
+    counter = LineCrossingCounter(lines, max_age=track_max_age, max_tracks=track_max_states, metrics=metrics)
+    events = ListSink() if sink is None else sink  # To record state changes with timestamps
+    stride = AdaptiveStride(lines, max_stride=max_stride) if max_stride > 1 else None
+    previous = None  # The last frame that was detected, whose boxes are drawn on the skipped frames after it
+
+    # Headless runs never open a writer and draw nothing
+    annotator = None
+    if save:
+        encoder = create_encoder(export_path, target_width, target_height, frame_rate, encoder=video_encoder,
+                                 codec=ffmpeg_codec, preset=ffmpeg_preset, crf=ffmpeg_crf, clips=event_clips,
+                                 seconds_before=clip_seconds_before, seconds_after=clip_seconds_after, metrics=metrics)
+        annotator = VideoAnnotator(export_path, target_width, target_height, lines, metrics, frame_rate, encoder)
+
+    def decode():
+        index = start_frame
+        while cap.isOpened() and (end_frame is None or index < end_frame):
+            frame = read_frame(cap, target_width, target_height, metrics)
+            if frame is None:
+                break
+            index += 1
+            yield frame, clock.timestamp(cap)
+
+    def track(item):
+        # A gap of 0 marks a skipped frame, otherwise it is the number of frames since the previous detection
+        frame, timestamp = item
+        if stride is not None and not stride.should_detect():
+            backend.skip_frame()
+            if recorder is not None:
+                recorder.append(timestamp, 0, None, None)
+            return frame, timestamp, None, None, 0
+        boxes, track_ids = backend.track(frame)
+        gap = stride.observe(track_ids, boxes, backend.has_tentative_tracks()) if stride is not None else 1
+        if recorder is not None:
+            recorder.append(timestamp, gap, boxes, track_ids, backend.scores, backend.class_ids)
+        return frame, timestamp, boxes, track_ids, gap
+
+    def count(item) -> CountedFrame:
+        nonlocal previous
+        frame, timestamp, boxes, track_ids, gap = item
+        if gap == 0:
+            metrics.increment('skipped_frames')
+            if previous is not None:
+                boxes, track_ids, last_line = previous.boxes, previous.track_ids, previous.last_line
+            else:
+                boxes, track_ids, last_line = None, None, None
+        else:
+            with metrics.timer('crossing'):
+                last_line = count_crossings(boxes, track_ids, counter, timestamp, events, metrics,
+                                            gap=gap, time_per_frame=clock.time_per_frame)
+        counted = CountedFrame(frame, boxes, track_ids, last_line, timestamp, counter.car_counts if annotator else {})
+        if gap:
+            previous = counted
+
+        metrics.increment('frames')
+        metrics.set_gauge('active_tracks', 0 if track_ids is None else len(track_ids))
+        events.tick()
+        metrics.tick()
+        return counted
+
+    completed = False
+    try:
+        if pipelined:
+            # Every stage runs on its own thread, so frames stay in order and the tracker sees them sequentially
+            stages = [('track', track), ('count', count)]
+            if annotator:
+                stages.append(('annotate+encode', annotator))
+            stats, wall_time = run_pipeline(decode(), stages, queue_size=queue_size)
+            print(format_stage_report(stats, wall_time))
+        else:
+            for item in decode():
+                counted = count(track(item))
+                if annotator:
+                    annotator(counted)
+        completed = True
+    finally:
+        # Release the video capture, and save the counts before the writer, whose release raises if encoding failed
+        cap.release()
+        try:
+            events.flush()
+            metrics.flush()
+        finally:
+            if annotator:
+                try:
+                    annotator.release()
+                except Exception:
+                    # A failed encoder is reported, unless that would hide the error that stopped the counting
+                    if completed:
+                        raise
+
+    return events.events if sink is None else []
+
+
+def replay(
+        detections: CachedDetections,
+        metrics: Metrics = None,
+        sink: EventSink = None,
+        start_time: datetime = None,
+        imgsz: Tuple[int, int] = default_imgsz) -> List[Dict]:
+    """
+    Count the crossings of cached tracks against the configured lines without decoding or detecting, see
+    detection_cache.DetectionCache. The events are the ones inference() produces with the same settings.
+
+    Parameters:
+        detections (CachedDetections): The tracks of every frame of a video.
+        metrics (Metrics, optional): Where to record the crossing times and counters. Defaults to None.
+        sink (EventSink, optional): Where to stream the state changes. Defaults to None, which returns them.
+        start_time (datetime, optional): The wall-clock time of the start of the video. Defaults to config.video_start_time.
+        imgsz (tuple, optional): The size (height, width) the tracks were detected at. Defaults to config.imgsz.
+
+    Returns:
+        List[Dict]: A list of state changes with timestamps, or an empty list if they were streamed to a sink.
+    """
+    if metrics is None:
+        metrics = Metrics(enabled=False)
+    counter = LineCrossingCounter(counting_lines(imgsz), max_age=track_max_age, max_tracks=track_max_states, metrics=metrics)
+    events = ListSink() if sink is None else sink
+
+    try:
+        for timestamp, gap, boxes, track_ids in detections.frames(start_time or parse_start_time(video_start_time)):
+            if gap:
+                with metrics.timer('crossing'):
+                    count_crossings(boxes, track_ids, counter, timestamp, events, metrics,
+                                    gap=gap, time_per_frame=detections.time_per_frame)
+            else:
+                metrics.increment('skipped_frames')
+            metrics.increment('frames')
+            events.tick()
+            metrics.tick()
+    finally:
+        events.flush()
+        metrics.flush()
+
+    return events.events if sink is None else []
 
-    while cap.isOpened():
+
+def read_frame(cap: cv2.VideoCapture, target_width: int, target_height: int, metrics: Metrics = None):
+    """
+    Read the next frame and resize it.
+
+    Parameters:
+        cap (cv2.VideoCapture): The opened video capture.
+        target_width (int): The width to resize the frame to.
+        target_height (int): The height to resize the frame to.
+        metrics (Metrics, optional): Where to record the decode and resize times. Defaults to None.
+
+    Returns:
+        MatLike: The resized frame, or None if the video has ended.
+    """
+    if metrics is None:
+        metrics = Metrics(enabled=False)
+    with metrics.timer('decode'):
         success, frame = cap.read()
-        if not success:
-            break
-        # resize frame to the specified size
+    if not success:
+        return None
+    # resize frame to the specified size
+    with metrics.timer('resize'):
         frame = cv2.resize(frame, (target_width, target_height))
+    return frame
+
 
-        # Draw the horizontal and perpendicular lines
-        cv2.line(frame, START_POINT_HORIZONTAL, END_POINT_HORIZONTAL, (0, 255, 0), 2)
-        cv2.line(frame, START_POINT_PERPENDICULAR, END_POINT_PERPENDICULAR, (255, 0, 0), 2)
-
-        # Run YOLOv8 tracking on the frame
-        results = model.track(frame, classes=[2, 7], persist=True, device=device, imgsz=imgsz, conf=0.1, iou=0.5, tracker="bytetrack.yaml")   # Focusing on cars (class 2) and trucks (class 7)
-
-        # Get the boxes and track IDs
-        boxes = results[0].boxes.xywh.cpu()
-        if results[0].boxes.id is not None:
-            track_ids = results[0].boxes.id.int().cpu().tolist()
-
-            for box, track_id in zip(boxes, track_ids):
-                x, y, w, h = box
-                center = (int(x), int(y))
-                bbox_color = (255, 0, 0)  # Default color
-
-                # Determine if the car has crossed the lines and update counts
-                if track_id in car_positions:
-                    prev_center = car_positions[track_id]
-                    # Horizontal line crossing logic
-                    if prev_center[1] < line_position_horizontal <= center[1]:
-                        update_car_count_and_record_state(track_id, 'DOWN', car_counts, already_counted, current_time, state_changes)
-                        bbox_color = (0, 255, 0)
-                    elif prev_center[1] > line_position_horizontal >= center[1]:
-                        update_car_count_and_record_state(track_id, 'UP', car_counts, already_counted, current_time, state_changes)
-                        bbox_color = (0, 255, 0)
-                    # Perpendicular line crossing logic
-                    if prev_center[0] < line_position_perpendicular <= center[0]:
-                        update_car_count_and_record_state(track_id, 'RIGHT', car_counts, already_counted, current_time, state_changes)
-                        bbox_color = (255, 0, 0)
-                    elif prev_center[0] > line_position_perpendicular >= center[0]:
-                        update_car_count_and_record_state(track_id, 'LEFT', car_counts, already_counted, current_time, state_changes)
-                        bbox_color = (255, 0, 0)
-
-                # Update the car's current position
-                car_positions[track_id] = center
-
-                # Draw bounding box and track ID
-                cv2.rectangle(frame, (int(x - w / 2), int(y - h / 2)), (int(x + w / 2), int(y + h / 2)), bbox_color, 2)
-                cv2.putText(frame, f"ID: {track_id}", (int(x - w / 2), int(y - h / 2) - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, bbox_color, 2)
-
-        # Draw the car counts and current time
-        draw_car_counts_and_time(frame, car_counts, current_time, frame_height)
-
-        # Increment the simulated time
-        current_time += time_per_frame
-
-        # Write the frame with annotations to the output video
-        if save:
-            out.write(frame)
-
-    # Release the video capture and writer
-    cap.release()
-    out.release()
-
-    return state_changes
-
-
-def update_car_count_and_record_state(
-        track_id: int,
-        direction: str,
-        car_counts: dict,
-        already_counted: dict,
+def count_crossings(
+        boxes,
+        track_ids,
+        counter: LineCrossingCounter,
         current_time: datetime,
-        state_changes: list):
+        sink: EventSink,
+        metrics: Metrics = None,
+        gap: int = 1,
+        time_per_frame: timedelta = None) -> np.ndarray:
     """
-    Update the car count for the specified direction if the car hasn't been counted in that direction yet and record the state change.
+    Update the counts for every tracked box that crossed a line and write the state changes to a sink.
 
     Parameters:
-        track_id (int): The ID of the car being tracked.
-        direction (str): The direction in which the car is moving.
-        car_counts (dict): A dictionary containing the car counts for each direction.
-        already_counted (dict): A dictionary containing the directions in which each car has already been counted.
+        boxes: The boxes in xywh format.
+        track_ids (list): The track IDs of the boxes, or None if no tracks were assigned.
+        counter (LineCrossingCounter): The crossing engine holding the per-track state and counts.
         current_time (datetime): The current timestamp.
-        state_changes (list): A list of state changes.
+        sink (EventSink): Where to write the state changes.
+        metrics (Metrics, optional): Where to count the crossings per direction. Defaults to None.
+        gap (int, optional): The number of frames since the previous detection. Defaults to 1.
+        time_per_frame (timedelta, optional): The time between two frames, needed to date the crossings
+            on skipped frames when gap is above 1. Defaults to None.
 
     Returns:
-        None
+        np.ndarray: The index of the line each box crossed last, -1 for none, or None if there are no tracks.
     """
-    if track_id not in already_counted or already_counted[track_id] != direction:
-        car_counts[direction] += 1
-        already_counted[track_id] = direction
+    if track_ids is None:
+        # A frame without tracks still ages the counter's state, so max_age holds across empty stretches
+        counter.update([], np.empty((0, 2), dtype=np.int64))
+        return None
+
+    boxes = np.asarray(boxes)
+    # Determine which cars have crossed the lines and update counts
+    events, last_line = counter.update(track_ids, boxes[:, :2].astype(np.int64))
+    for event in events:
+        # A crossing between two detections is dated to the skipped frame on which the line was reached
+        timestamp = current_time
+        if gap > 1:
+            timestamp -= crossing_offset(event.fraction, gap) * time_per_frame
         # Record the state change with a precise timestamp
-        state_changes.append(
+        sink.write(
             {
-                'car_id': track_id,
-                'timestamp': current_time.strftime("%Y-%m-%d %H:%M:%S.%f"),
-                'state': direction
+                'car_id': event.track_id,
+                'timestamp': timestamp.strftime("%Y-%m-%d %H:%M:%S.%f"),
+                'state': event.direction
             }
         )
+        if metrics is not None:
+            metrics.increment('crossings', direction=event.direction)
+    return last_line
+
+
+def draw_lines(frame, lines: List[CountingLine]) -> None:
+    """
+    Draw the counting lines and zone edges.
+
+    Parameters:
+        frame (MatLike): The frame to draw on.
+        lines (List[CountingLine]): The counting segments to draw.
+
+    Returns:
+        None
+    """
+    for line in lines:
+        cv2.line(frame, tuple(map(int, line.start)), tuple(map(int, line.end)), line.color, 2)
+
+
+def draw_tracks(frame, boxes, track_ids, last_line: np.ndarray, lines: List[CountingLine]) -> None:
+    """
+    Draw the tracked boxes and their IDs, coloured by the line each one crossed last.
+
+    Parameters:
+        frame (MatLike): The frame to draw on.
+        boxes: The boxes in xywh format.
+        track_ids (list): The track IDs of the boxes, or None if no tracks were assigned.
+        last_line (np.ndarray): The index of the line each box crossed last, as returned by count_crossings.
+        lines (List[CountingLine]): The counting segments last_line refers to.
+
+    Returns:
+        None
+    """
+    if track_ids is None:
+        return
+
+    for (x, y, w, h), track_id, line_index in zip(np.asarray(boxes).tolist(), track_ids, last_line.tolist()):
+        bbox_color = lines[line_index].color if line_index >= 0 else (255, 0, 0)  # Default color
+
+        # Draw bounding box and track ID
+        cv2.rectangle(frame, (int(x - w / 2), int(y - h / 2)), (int(x + w / 2), int(y + h / 2)), bbox_color, 2)
+        cv2.putText(frame, f"ID: {track_id}", (int(x - w / 2), int(y - h / 2) - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, bbox_color, 2)
 
 
 def draw_car_counts_and_time(frame, car_counts: Dict, current_time: datetime, frame_height: int) -> None:
@@ -159,6 +450,9 @@ def draw_car_counts_and_time(frame, car_counts: Dict, current_time: datetime, fr
     Returns:
         None
     """
-    cv2.putText(frame, f"Up: {car_counts['UP']} Down: {car_counts['DOWN']}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
-    cv2.putText(frame, f"Left: {car_counts['LEFT']} Right: {car_counts['RIGHT']}", (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+    # One row per pair of directions, e.g. "Up: 3 Down: 5"
+    directions = list(car_counts)
+    for row, i in enumerate(range(0, len(directions), 2)):
+        text = " ".join(f"{direction.title()}: {car_counts[direction]}" for direction in directions[i:i + 2])
+        cv2.putText(frame, text, (10, 30 + 30 * row), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
     cv2.putText(frame, current_time.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3], (10, frame_height - 10), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
@@ -24,17 +24,40 @@ Date: 20-02-2024
 
 
 import numpy as np
-import time
 
 import cv2
 import onnxruntime
 
+from metrics import Metrics
+
 
 class DetectorONNX:
-    def __init__(self, model_path: str, device: str = 'cpu', conf_threshold: float = 0.1, iou_threshold: float = 0.1):
+    def __init__(self, model_path: str, device: str = 'cpu', conf_threshold: float = 0.1, iou_threshold: float = 0.1,
+                 batch_size: int = 1, imgsz: tuple[int, int] = (640, 640), letterbox: bool = False,
+                 nms_top_k: int = None, metrics: Metrics = None, threads: int = None, inter_threads: int = None,
+                 parallel: bool = False, thread_affinities: str = None, spinning: bool = None):
         self.device = device
         self.conf_threshold = conf_threshold
         self.iou_threshold = iou_threshold
+        # Frames per session.run in detect_batch, capped by the batch dimension of a static model
+        self.batch_size = batch_size
+        # Input (height, width) used when the model was exported with dynamic spatial axes
+        self.imgsz = imgsz
+        # Keep the aspect ratio and pad the input instead of stretching the frame
+        self.letterbox = letterbox
+        # Only the nms_top_k highest scoring candidates enter NMS, None keeps all of them
+        self.nms_top_k = nms_top_k
+        # Preprocess, session.run and postprocess times are recorded here, disabled by default
+        self.metrics = metrics if metrics is not None else Metrics(enabled=False)
+        # Intra-op threads of the session, None lets ONNX Runtime use every core
+        self.threads = threads
+        # Inter-op threads, only used when independent branches of the graph run in parallel
+        self.inter_threads = inter_threads
+        self.parallel = parallel
+        # Cores of the intra-op threads after the first, in ONNX Runtime's format, e.g. '1;2;3' pins three threads
+        self.thread_affinities = thread_affinities
+        # Whether idle threads spin instead of sleeping, lower latency for more CPU. None keeps ONNX Runtime's default
+        self.spinning = spinning
 
         # Initialize model
         self.initialize_model(model_path)
@@ -46,7 +69,17 @@ class DetectorONNX:
         # Session options for potential performance improvements
         sess_options = onnxruntime.SessionOptions()
         sess_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
-        sess_options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+        sess_options.execution_mode = (onnxruntime.ExecutionMode.ORT_PARALLEL if self.parallel
+                                       else onnxruntime.ExecutionMode.ORT_SEQUENTIAL)
+        if self.threads:
+            sess_options.intra_op_num_threads = self.threads
+        if self.inter_threads:
+            sess_options.inter_op_num_threads = self.inter_threads
+        if self.thread_affinities:
+            sess_options.add_session_config_entry('session.intra_op_thread_affinities', self.thread_affinities)
+        if self.spinning is not None:
+            sess_options.add_session_config_entry('session.intra_op.allow_spinning', '1' if self.spinning else '0')
+            sess_options.add_session_config_entry('session.inter_op.allow_spinning', '1' if self.spinning else '0')
         self.session = onnxruntime.InferenceSession(model_path, sess_options,
                                                     providers=['CPUExecutionProvider'] if self.device == 'cpu' else ['CUDAExecutionProvider'])
         # Get model info
@@ -54,35 +87,96 @@ class DetectorONNX:
         self.get_output_details()
 
     def detect_objects(self, image):
-        input_tensor = self.preprocess(image)
+        with self.metrics.timer('detect_preprocess'):
+            input_tensor = self.preprocess(image)
 
         # Perform inference on the image
         outputs = self.inference(input_tensor)
 
-        boxes, scores, class_ids = self.postprocess(outputs)
+        with self.metrics.timer('detect_postprocess'):
+            boxes, scores, class_ids = self.postprocess(outputs)
 
         return boxes, scores, class_ids
 
-    def preprocess(self, image: np.ndarray) -> np.ndarray:
-        self.img_height, self.img_width = image.shape[:2]
+    def detect_batch(self, images: list[np.ndarray]) -> list[tuple]:
+        # Run several frames through a single session.run, e.g. for recorded footage where latency doesn't matter
+        max_batch = self.input_shape[0] if isinstance(self.input_shape[0], int) else self.batch_size
+        batch_size = max(1, min(self.batch_size, max_batch))
+
+        detections = []
+        for start in range(0, len(images), batch_size):
+            batch = images[start:start + batch_size]
+            input_tensor = self.preprocess_batch(batch)
 
-        input_img = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            outputs = self.inference(input_tensor)
 
-        # Resize input image
-        input_img = cv2.resize(input_img, (self.input_width, self.input_height))
+            # Postprocess every frame on its own, scaled back to its own size
+            for i, image in enumerate(batch):
+                self.img_height, self.img_width = image.shape[:2]
+                detections.append(self.postprocess([output[i:i + 1] for output in outputs]))
 
-        # Scale input pixel values to 0 to 1
-        input_img = input_img / 255.0
-        input_img = input_img.transpose(2, 0, 1)
-        input_tensor = input_img[np.newaxis, :, :, :].astype(np.float32)
+        return detections
 
-        return input_tensor
+    def preprocess_batch(self, images: list[np.ndarray]) -> np.ndarray:
+        # Fill the preallocated NCHW tensor with one frame per slot
+        if len(images) > len(self.input_buffer):
+            self.allocate_buffers(len(images))
+        for i, image in enumerate(images):
+            self.preprocess_into(image, self.input_buffer[i])
+
+        return self.input_buffer[:len(images)]
+
+    def preprocess(self, image: np.ndarray) -> np.ndarray:
+        # The returned tensor is a view of a reused buffer, valid until the next preprocess call
+        self.img_height, self.img_width = image.shape[:2]
+        self.preprocess_into(image, self.input_buffer[0])
+
+        return self.input_buffer[:1]
+
+    def preprocess_into(self, image: np.ndarray, out: np.ndarray):
+        # Resize the BGR frame straight into the uint8 buffer, channels are swapped by the layout copy below
+        if self.letterbox:
+            self.letterbox_into(image)
+        else:
+            cv2.resize(image, (self.input_width, self.input_height), dst=self.resize_buffer)
+
+        # Scale input pixel values to 0 to 1 through a table holding exactly float32(x / 255.0)
+        cv2.LUT(self.resize_buffer, self.scale_table, dst=self.scale_buffer)
+
+        # HWC BGR to CHW RGB
+        for channel in range(3):
+            np.copyto(out[channel], self.scale_buffer[:, :, 2 - channel])
+
+    def letterbox_into(self, image: np.ndarray):
+        _, new_width, new_height, pad_x, pad_y = self.letterbox_geometry(*image.shape[:2])
+        if self.letterbox_shape != (new_height, new_width):
+            # Only a change of frame size reallocates the inner buffer and repaints the padding
+            self.letterbox_shape = (new_height, new_width)
+            self.letterbox_buffer = np.empty((new_height, new_width, 3), dtype=np.uint8)
+            self.resize_buffer.fill(114)
+
+        cv2.resize(image, (new_width, new_height), dst=self.letterbox_buffer)
+        self.resize_buffer[pad_y:pad_y + new_height, pad_x:pad_x + new_width] = self.letterbox_buffer
+
+    def letterbox_geometry(self, img_height: int, img_width: int) -> tuple[float, int, int, int, int]:
+        # Scale that fits the frame into the input, the scaled size and the padding around it
+        ratio = min(self.input_height / img_height, self.input_width / img_width)
+        new_width = min(self.input_width, int(round(img_width * ratio)))
+        new_height = min(self.input_height, int(round(img_height * ratio)))
+        return ratio, new_width, new_height, (self.input_width - new_width) // 2, (self.input_height - new_height) // 2
+
+    def allocate_buffers(self, batch_size: int):
+        # Buffers are sized once from the model input so preprocessing allocates nothing per frame
+        self.input_buffer = np.empty((batch_size, 3, self.input_height, self.input_width), dtype=np.float32)
+        self.resize_buffer = np.empty((self.input_height, self.input_width, 3), dtype=np.uint8)
+        self.scale_buffer = np.empty((self.input_height, self.input_width, 3), dtype=np.float32)
+        self.scale_table = (np.arange(256) / 255.0).astype(np.float32)
+        self.letterbox_shape = None
 
     def inference(self, input_tensor):
-        start = time.perf_counter()
-        outputs = self.session.run(self.output_names, {self.input_names[0]: input_tensor})
+        with self.metrics.timer('detect_inference'):
+            outputs = self.session.run(self.output_names, {self.input_names[0]: input_tensor})
 
-        print(f"Inference time: {(time.perf_counter() - start)*1000:.2f} ms")
         return outputs
 
     def postprocess(self, output):
@@ -104,7 +198,7 @@ class DetectorONNX:
 
         # Apply non-maxima suppression to suppress weak, overlapping bounding boxes
         # indices = nms(boxes, scores, self.iou_threshold)
-        indices = multiclass_nms(boxes, scores, class_ids, self.iou_threshold)
+        indices = fast_multiclass_nms(boxes, scores, class_ids, self.iou_threshold, top_k=self.nms_top_k)
 
         return boxes[indices], scores[indices], class_ids[indices]
 
@@ -121,6 +215,15 @@ class DetectorONNX:
         return boxes
 
     def rescale_boxes(self, boxes):
+        if self.letterbox:
+            # Remove the padding and undo the aspect-preserving scale
+            ratio, _, _, pad_x, pad_y = self.letterbox_geometry(self.img_height, self.img_width)
+            boxes = np.array(boxes, dtype=np.float32)
+            boxes[:, 0] -= pad_x
+            boxes[:, 1] -= pad_y
+            boxes /= ratio
+            return boxes
+
         # Rescale boxes to original image dimensions
         input_shape = np.array([self.input_width, self.input_height, self.input_width, self.input_height])
         boxes = np.divide(boxes, input_shape, dtype=np.float32)
@@ -136,14 +239,25 @@ class DetectorONNX:
         self.input_names = [model_inputs[i].name for i in range(len(model_inputs))]
 
         self.input_shape = model_inputs[0].shape
-        self.input_height = self.input_shape[2]
-        self.input_width = self.input_shape[3]
+        # Dynamic axes are reported as names instead of sizes
+        self.input_height = self.input_shape[2] if isinstance(self.input_shape[2], int) else self.imgsz[0]
+        self.input_width = self.input_shape[3] if isinstance(self.input_shape[3], int) else self.imgsz[1]
+
+        max_batch = self.input_shape[0] if isinstance(self.input_shape[0], int) else self.batch_size
+        self.allocate_buffers(max(1, min(self.batch_size, max_batch)))
 
     def get_output_details(self):
         model_outputs = self.session.get_outputs()
         self.output_names = [model_outputs[i].name for i in range(len(model_outputs))]
 
 
+def export_onnx(weights_path: str, imgsz: tuple[int, int] = (640, 640), dynamic: bool = True) -> str:
+    # Export ultralytics weights to ONNX, with a dynamic batch axis so detect_batch can run several frames at once
+    from ultralytics import YOLO
+
+    return YOLO(weights_path).export(format='onnx', imgsz=imgsz, dynamic=dynamic)
+
+
 class_names = ['person', 'bicycle', 'car', 'motorcycle', 'airplane', 'bus', 'train', 'truck', 'boat', 'traffic light',
                'fire hydrant', 'stop sign', 'parking meter', 'bench', 'bird', 'cat', 'dog', 'horse', 'sheep', 'cow',
                'elephant', 'bear', 'zebra', 'giraffe', 'backpack', 'umbrella', 'handbag', 'tie', 'suitcase', 'frisbee',
@@ -160,8 +274,8 @@ colors = rng.uniform(0, 255, size=(len(class_names), 3))
 
 
 def nms(boxes, scores, iou_threshold):
-    # Sort by score
-    sorted_indices = np.argsort(scores)[::-1]
+    # Sort by score, ties in index order so fast_multiclass_nms can keep the same order
+    sorted_indices = np.argsort(-scores, kind='stable')
 
     keep_boxes = []
     while sorted_indices.size > 0:
@@ -197,6 +311,81 @@ def multiclass_nms(boxes, scores, class_ids, iou_threshold):
     return keep_boxes
 
 
+def fast_multiclass_nms(boxes, scores, class_ids, iou_threshold, top_k=None, block_size=256):
+    # Greedy NMS over all classes in one pass, keeping the same boxes as multiclass_nms.
+    # Boxes are shifted by a per-class offset so boxes of different classes never overlap,
+    # and IoUs are computed as blocks of a matrix instead of one row per kept box.
+    if len(scores) == 0:
+        return np.empty(0, dtype=np.intp)
+    class_ids = np.asarray(class_ids)
+
+    # Optionally keep only the top_k highest scoring candidates
+    candidates = np.arange(len(scores))
+    if top_k is not None and top_k < len(scores):
+        candidates = np.argsort(-scores, kind='stable')[:top_k]
+
+    # Classes never suppress each other, so processing them one after the other gives the same result
+    # as a global score order. Sort by class, then by score with ties in index order like nms does within a class.
+    candidates.sort()
+    order = candidates[np.lexsort((-scores[candidates], class_ids[candidates]))]
+    sorted_boxes = boxes[order]
+    sorted_classes = class_ids[order]
+
+    # Offsets are whole numbers larger than the coordinate range, applied in float64 where adding them is exact
+    low, high = float(sorted_boxes.min()), float(sorted_boxes.max())
+    offsets = (sorted_classes * (np.floor(high - low) + 2))[:, None]
+    shifted = (sorted_boxes.astype(np.float64) - low + offsets).T.copy()
+    areas = (sorted_boxes[:, 2] - sorted_boxes[:, 0]) * (sorted_boxes[:, 3] - sorted_boxes[:, 1])
+
+    count = len(order)
+    suppressed = np.zeros(count, dtype=bool)
+    keep = []
+    for start in range(0, count, block_size):
+        end = min(start + block_size, count)
+
+        # Greedy pass over the block's survivors, earlier blocks have already suppressed what they overlap
+        block = np.flatnonzero(~suppressed[start:end]) + start
+        if len(block) == 0:
+            continue
+        block_suppressed = _iou_suppression(shifted, areas, sorted_classes, block, block, iou_threshold, boxes.dtype)
+        alive = np.ones(len(block), dtype=bool)
+        for i in range(len(block)):
+            if alive[i]:
+                alive[i + 1:] &= ~block_suppressed[i, i + 1:]
+        block_keep = block[alive]
+        keep.append(block_keep)
+
+        # The boxes kept in this block suppress the overlapping survivors of the same classes further on
+        class_end = np.searchsorted(sorted_classes, sorted_classes[end - 1], side='right')
+        rest = np.flatnonzero(~suppressed[end:class_end]) + end
+        for chunk in range(0, len(rest), 8 * block_size):
+            columns = rest[chunk:chunk + 8 * block_size]
+            rest_suppressed = _iou_suppression(shifted, areas, sorted_classes, block_keep, columns, iou_threshold, boxes.dtype)
+            suppressed[columns] |= rest_suppressed.any(axis=0)
+
+    # Already in the order of multiclass_nms: by class, then by score within the class
+    return order[np.concatenate(keep)]
+
+
+def _iou_suppression(shifted, areas, classes, rows, columns, iou_threshold, dtype):
+    # Suppression matrix of the row boxes against the column boxes, with the same arithmetic as compute_iou
+    x1, y1, x2, y2 = shifted
+    widths = (np.minimum.outer(x2[rows], x2[columns]) - np.maximum.outer(x1[rows], x1[columns])).astype(dtype)
+    heights = (np.minimum.outer(y2[rows], y2[columns]) - np.maximum.outer(y1[rows], y1[columns])).astype(dtype)
+    intersection_area = np.maximum(0, widths) * np.maximum(0, heights)
+    union_area = areas[rows][:, None] + areas[columns][None, :] - intersection_area
+    with np.errstate(divide='ignore', invalid='ignore'):
+        iou = intersection_area / union_area
+
+    # Like nms, anything that is not clearly below the threshold (including NaN) is suppressed
+    suppress = ~(iou < iou_threshold)
+    degenerate = union_area == 0
+    if degenerate.any():
+        # Zero-area boxes give NaN, which must not reach across classes
+        suppress &= ~degenerate | (classes[rows][:, None] == classes[columns][None, :])
+    return suppress
+
+
 def compute_iou(box, boxes):
     # Compute xmin, ymin, xmax, ymax for both boxes
     xmin = np.maximum(box[0], boxes[:, 0])
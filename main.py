@@ -1,26 +1,73 @@
-from inference import inference
-from visualization import save_to_csv, visualize_data
-from config import model_path, video_path, export_path, device, imgsz
-
-from ultralytics import YOLO
+from inference import inference, counting_lines, replay
+from visualization import visualize_data
+from config import (
+    model_path, backend, video_path, export_path, events_path, events_append, plot_bucket, device, imgsz, pipelined, save_video, max_stride,
+    roi_enabled, roi_margin, roi_tile_size, live_capture, live_buffer_size, timestamps_from_pts,
+    detection_cache_dir, detection_cache_max_bytes,
+    onnx_tuning_path, onnx_threads, onnx_inter_threads, onnx_thread_affinities, onnx_spinning,
+    metrics_enabled, metrics_prometheus_path, metrics_jsonl_path, metrics_port, metrics_interval)
+from detection_cache import DetectionCache
+from detectors import CONF_THRESHOLD, IOU_THRESHOLD, create_backend
+from metrics import create_metrics
+from roi import create_roi_backend
+from sinks import create_sink
 
 
 def main() -> None:
     """
     Main execution function to run the car tracking and counting project.
     """
-    # Load the YOLOv8 model
-    model = YOLO(model_path)
+    # Replay the tracks of an earlier run with the same video, model and detection settings if they are cached.
+    # A replay writes no annotated video, so a run that saves one always detects, refreshing the cached tracks
+    cache, cached, key = None, None, None
+    if detection_cache_dir and not live_capture:
+        cache = DetectionCache(detection_cache_dir, max_bytes=detection_cache_max_bytes)
+        # The lines are drawn after detection, so they change the tracks only through the ROI tiles that follow them
+        roi = (roi_margin, roi_tile_size, [(line.start, line.end) for line in counting_lines(imgsz)]) if roi_enabled else None
+        # A tuned INT8 or FP16 variant detects slightly differently, so it is cached apart from the FP32 model
+        tuned = {}
+        if backend == 'onnx':
+            from ort_tuning import load_tuning
+
+            tuned = load_tuning(onnx_tuning_path, model_path)
+        key = cache.key(video_path, tuned.get('model_path', model_path), backend=backend, imgsz=imgsz, conf=CONF_THRESHOLD, iou=IOU_THRESHOLD,
+                        max_stride=max_stride, roi=roi, timestamps_from_pts=timestamps_from_pts)
+        cached = None if save_video else cache.get(key)
+
+    metrics = create_metrics(metrics_enabled, prometheus_path=metrics_prometheus_path, jsonl_path=metrics_jsonl_path,
+                             port=metrics_port, interval=metrics_interval)
 
-    # Run inference and save the annotated video
-    inference_results = inference(model, video_path=video_path, export_path=export_path, device=device, imgsz=imgsz, save=True)
+    with create_sink(events_path, append=events_append) as sink:
+        if cached is not None:
+            # Only the counting runs, at the speed of the crossing test
+            replay(cached, metrics=metrics, sink=sink, imgsz=imgsz)
+        else:
+            # Load the YOLOv8 model with the configured runtime
+            if roi_enabled:
+                model = create_roi_backend(backend, model_path, counting_lines(imgsz), imgsz=imgsz, tile_size=roi_tile_size,
+                                           margin=roi_margin, device=device, tuning_path=onnx_tuning_path,
+                                           threads=onnx_threads if backend == 'onnx' else None, inter_threads=onnx_inter_threads,
+                                           thread_affinities=onnx_thread_affinities, spinning=onnx_spinning)
+            else:
+                model = create_backend(backend, model_path, device=device, imgsz=imgsz, tuning_path=onnx_tuning_path,
+                                       threads=onnx_threads if backend == 'onnx' else None, inter_threads=onnx_inter_threads,
+                                       thread_affinities=onnx_thread_affinities, spinning=onnx_spinning)
 
-    # Save the car tracking data
-    data_path = "car_data.csv"
-    save_to_csv(inference_results, export_path=data_path)
+            # Run inference and save the annotated video, streaming the car tracking data to disk as it is produced
+            recorder = cache.writer(key) if cache is not None else None
+            try:
+                inference(model, video_path=video_path, export_path=export_path, device=device, imgsz=imgsz,
+                          save=save_video, pipelined=pipelined, metrics=metrics, sink=sink, max_stride=max_stride,
+                          recorder=recorder, live=live_capture, live_buffer_size=live_buffer_size)
+            except BaseException:
+                if recorder is not None:
+                    recorder.discard()
+                raise
+            if recorder is not None:
+                recorder.commit()
 
     # Generate visualizations
-    visualize_data(data_path, save=True)
+    visualize_data(events_path, save=True, bucket=plot_bucket)
 
 
 if __name__ == "__main__":
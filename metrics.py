@@ -0,0 +1,340 @@
+import bisect
+import json
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Histogram bucket upper bounds in seconds, from 0.1 ms to 10 s
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Prefix of every exported metric name
+PREFIX = 'car_counter'
+
+
+class Histogram:
+    """
+    A fixed-bucket histogram of durations in seconds.
+
+    Observing a value is a binary search and two additions, so it is cheap enough for every frame.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # The last bucket is +Inf
+        self.sum = 0.0
+        self.count = 0
+        # Several threads may observe the same stage, e.g. the streams of multistream.run_streams_batched
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate a quantile by linear interpolation inside the bucket that contains it.
+
+        Parameters:
+            q (float): The quantile, between 0 and 1.
+
+        Returns:
+            float: The estimated value in seconds, or 0 if nothing was observed.
+        """
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+
+class _Timer:
+    # A new timer per timer() call, so threads timing the same stage at once each keep their own start
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics:
+    """
+    A registry of per-stage latency histograms, counters and gauges with periodic exporters.
+
+    A disabled registry hands out a shared no-op timer and ignores every update, so instrumented
+    code costs next to nothing when metrics are switched off.
+    """
+
+    def __init__(self, enabled: bool = True, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        """
+        Parameters:
+            enabled (bool, optional): Whether to record anything. Defaults to True.
+            buckets (Sequence[float], optional): The histogram bucket upper bounds in seconds. Defaults to 0.1 ms to 10 s.
+        """
+        self.enabled = enabled
+        self.buckets = buckets
+        self.stages: Dict[str, Histogram] = {}
+        self.counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self.gauges: Dict[str, float] = {}
+        self._exporters: List[list] = []
+        # Guards adding keys to the dicts, so exporters on other threads, e.g. the HTTP server, can copy them
+        self._lock = threading.Lock()
+        # Serialises the exports, so threads sharing the registry never run an exporter at the same time
+        self._export_lock = threading.Lock()
+
+    def _histogram(self, stage: str) -> Histogram:
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            with self._lock:
+                histogram = self.stages.get(stage)
+                if histogram is None:
+                    histogram = self.stages[stage] = Histogram(self.buckets)
+        return histogram
+
+    def timer(self, stage: str):
+        """
+        Return a context manager that records the time spent inside it for a stage.
+
+        Parameters:
+            stage (str): The name of the stage, e.g. 'decode' or 'encode'.
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self._histogram(stage))
+
+    def observe(self, stage: str, seconds: float) -> None:
+        """
+        Record a duration for a stage that was measured elsewhere.
+        """
+        if self.enabled:
+            self._histogram(stage).observe(seconds)
+
+    def increment(self, name: str, value: float = 1, **labels: str) -> None:
+        """
+        Add to a counter, e.g. increment('crossings', direction='UP').
+        """
+        if self.enabled:
+            key = (name, tuple(sorted(labels.items())))
+            with self._lock:
+                self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float) -> None:
+        """
+        Set a gauge to its current value, e.g. the number of active tracks.
+        """
+        if self.enabled:
+            with self._lock:
+                self.gauges[name] = value
+
+    def add_exporter(self, exporter, interval: float = 10.0) -> None:
+        """
+        Register an exporter that is called at most every interval seconds by tick() and once by flush().
+
+        Parameters:
+            exporter: An object with an export(metrics) method.
+            interval (float, optional): The minimum number of seconds between exports. Defaults to 10.
+        """
+        self._exporters.append([exporter, interval, time.monotonic()])
+
+    def tick(self) -> None:
+        """
+        Run the exporters whose interval has elapsed. Called once per frame.
+        """
+        if not self._exporters:
+            return
+        now = time.monotonic()
+        for entry in self._exporters:
+            if now - entry[2] >= entry[1]:
+                with self._export_lock:
+                    # Another thread may have exported while this one waited for the lock
+                    if now - entry[2] >= entry[1]:
+                        entry[0].export(self)
+                        entry[2] = now
+
+    def flush(self) -> None:
+        """
+        Run every exporter now, e.g. at the end of a video.
+        """
+        with self._export_lock:
+            for entry in self._exporters:
+                entry[0].export(self)
+                entry[2] = time.monotonic()
+
+    def _copy(self) -> Tuple[list, list, Dict[str, float]]:
+        # A consistent copy of the keys, taken while no other thread can add one
+        with self._lock:
+            return list(self.stages.items()), list(self.counters.items()), dict(self.gauges)
+
+    def snapshot(self) -> Dict:
+        """
+        Summarise the current state as plain data, with stage latencies in milliseconds.
+        """
+        stage_items, counter_items, gauges = self._copy()
+        stages = {}
+        for stage, histogram in stage_items:
+            stages[stage] = {
+                'count': histogram.count,
+                'total_s': round(histogram.sum, 6),
+                'mean_ms': round(1000 * histogram.sum / histogram.count, 4) if histogram.count else 0.0,
+                'p50_ms': round(1000 * histogram.quantile(0.5), 4),
+                'p90_ms': round(1000 * histogram.quantile(0.9), 4),
+                'p99_ms': round(1000 * histogram.quantile(0.99), 4),
+            }
+        counters = {}
+        for (name, labels), value in counter_items:
+            label_text = ','.join(f'{key}={value}' for key, value in labels)
+            counters[f'{name}{{{label_text}}}' if labels else name] = value
+        return {'time': time.time(), 'stages': stages, 'counters': counters, 'gauges': gauges}
+
+    def to_prometheus(self) -> str:
+        """
+        Render the metrics in the Prometheus text exposition format.
+        """
+        stage_items, counter_items, gauges = self._copy()
+        lines = [f'# HELP {PREFIX}_stage_seconds Time spent per frame in each pipeline stage.',
+                 f'# TYPE {PREFIX}_stage_seconds histogram']
+        for stage, histogram in stage_items:
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ['+Inf'], histogram.counts):
+                cumulative += count
+                lines.append(f'{PREFIX}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+            lines.append(f'{PREFIX}_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+
+        for name in sorted({name for (name, _), _ in counter_items}):
+            lines.append(f'# TYPE {PREFIX}_{name}_total counter')
+            for (counter_name, labels), value in counter_items:
+                if counter_name == name:
+                    label_text = ','.join(f'{key}="{value}"' for key, value in labels)
+                    lines.append(f'{PREFIX}_{name}_total{{{label_text}}} {value}' if labels else f'{PREFIX}_{name}_total {value}')
+
+        for name, value in gauges.items():
+            lines.append(f'# TYPE {PREFIX}_{name} gauge')
+            lines.append(f'{PREFIX}_{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+class PrometheusFileExporter:
+    """
+    Write the metrics to a text file, e.g. for node_exporter's textfile collector.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, metrics: Metrics) -> None:
+        # Write to a uniquely named temporary file and rename it, so a scraper never reads a half-written file
+        # and two registries exporting to the same path never rename each other's file
+        directory, name = os.path.split(os.path.abspath(self.path))
+        descriptor, temporary_path = tempfile.mkstemp(prefix=f'{name}.', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(descriptor, 'w') as f:
+                f.write(metrics.to_prometheus())
+            os.replace(temporary_path, self.path)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+
+
+class JSONLExporter:
+    """
+    Append one JSON snapshot of the metrics per export to a log file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, metrics: Metrics) -> None:
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(metrics.snapshot()) + '\n')
+
+
+def serve_prometheus(metrics: Metrics, port: int, address: str = '') -> ThreadingHTTPServer:
+    """
+    Serve the metrics at http://address:port/metrics from a background thread.
+
+    Parameters:
+        metrics (Metrics): The metrics to serve.
+        port (int): The port to listen on.
+        address (str, optional): The address to bind to. Defaults to all interfaces.
+
+    Returns:
+        ThreadingHTTPServer: The running server; call shutdown() to stop it.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.to_prometheus().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((address, port), Handler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
+
+
+def create_metrics(enabled: bool, prometheus_path: Optional[str] = None, jsonl_path: Optional[str] = None,
+                   port: Optional[int] = None, interval: float = 10.0) -> Metrics:
+    """
+    Build a metrics registry with the configured exporters.
+
+    Parameters:
+        enabled (bool): Whether to record metrics at all.
+        prometheus_path (str, optional): The Prometheus text file to rewrite periodically.
+        jsonl_path (str, optional): The JSONL log to append snapshots to.
+        port (int, optional): The port to serve /metrics on.
+        interval (float, optional): The number of seconds between exports. Defaults to 10.
+
+    Returns:
+        Metrics: The registry.
+    """
+    metrics = Metrics(enabled=enabled)
+    if enabled:
+        if prometheus_path:
+            metrics.add_exporter(PrometheusFileExporter(prometheus_path), interval)
+        if jsonl_path:
+            metrics.add_exporter(JSONLExporter(jsonl_path), interval)
+        if port:
+            serve_prometheus(metrics, port)
+    return metrics
@@ -0,0 +1,256 @@
+"""
+Multi-camera runner.
+
+Spreads many video files or streams over a pool of long-lived worker processes. Every worker loads
+the model once when it starts and then processes whole streams one after the other, resetting the
+tracker in between, so the tracks of one camera never leak into another. The cores are split
+evenly between the workers, which keeps the runtimes from oversubscribing the CPU and lets the
+throughput grow close to linearly with the number of cores.
+
+With --batched all streams run in one process instead, each on its own thread with its own
+tracker, and a BatchScheduler merges their frames into detection batches (see batching.py).
+
+Usage:
+    python multistream.py cam1.mp4 cam2.mp4 rtsp://camera3/stream --workers 4 --output events.csv
+    python multistream.py cam*.mp4 --batched --max-batch-size 8 --max-wait-ms 10 --backend onnx --model yolov8m.onnx
+"""
+
+import argparse
+import multiprocessing
+import os
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import cv2
+
+import config
+from batching import create_batch_scheduler, stream_backend
+from detectors import DetectorBackend, create_backend
+from inference import inference
+from metrics import Metrics
+
+# The backend of the current worker process, created once by _init_worker
+_BACKEND: Optional[DetectorBackend] = None
+_SETTINGS: Dict = {}
+
+
+class Stream(NamedTuple):
+    """
+    One camera: a video file or stream URL and where to save its annotated video, if anywhere.
+    """
+    name: str
+    video_path: str
+    export_path: Optional[str] = None
+
+
+class StreamResult(NamedTuple):
+    name: str
+    state_changes: List[Dict]
+    processing_time: float
+    worker: int  # The PID of the worker process that handled the stream
+    error: Optional[str] = None
+
+
+def _init_worker(backend: str, model_path: str, device: str, imgsz: Tuple[int, int], threads: int,
+                 inter_threads: Optional[int], thread_affinities: Optional[str], spinning: Optional[bool]) -> None:
+    global _BACKEND
+    cv2.setNumThreads(threads)
+    _BACKEND = create_backend(backend, model_path, device=device, imgsz=imgsz, threads=threads,
+                              tuning_path=config.onnx_tuning_path, inter_threads=inter_threads,
+                              thread_affinities=thread_affinities, spinning=spinning)
+    _SETTINGS.update(device=device, imgsz=imgsz)
+
+
+def _process_stream(stream: Stream) -> StreamResult:
+    start = time.perf_counter()
+    try:
+        # A fresh tracker per stream keeps the track IDs and states of the cameras apart
+        _BACKEND.reset()
+        state_changes = inference(_BACKEND, stream.video_path, stream.export_path or '', device=_SETTINGS['device'],
+                                  imgsz=_SETTINGS['imgsz'], save=stream.export_path is not None)
+        error = None
+    except Exception as e:
+        state_changes, error = [], f'{type(e).__name__}: {e}'
+    for change in state_changes:
+        change['camera'] = stream.name
+    return StreamResult(stream.name, state_changes, time.perf_counter() - start, os.getpid(), error)
+
+
+def run_streams(
+        streams: Sequence[Stream],
+        backend: str = config.backend,
+        model_path: str = config.model_path,
+        device: str = 'cpu',
+        imgsz: Tuple[int, int] = config.imgsz,
+        workers: int = None,
+        threads_per_worker: int = None,
+        inter_threads: int = config.onnx_inter_threads,
+        thread_affinities: str = config.onnx_thread_affinities,
+        spinning: bool = config.onnx_spinning) -> Tuple[List[Dict], List[StreamResult]]:
+    """
+    Count the vehicles of every stream on a pool of worker processes.
+
+    Parameters:
+        streams (Sequence[Stream]): The cameras to process.
+        backend (str, optional): The detector backend, see detectors.create_backend. Defaults to config.backend.
+        model_path (str, optional): The model every worker loads. Defaults to config.model_path.
+        device (str, optional): The device to run the inference on. Defaults to 'cpu'.
+        imgsz (tuple, optional): The size of the input image (height, width). Defaults to config.imgsz.
+        workers (int, optional): The number of worker processes. Defaults to the number of cores, at most one per stream.
+        threads_per_worker (int, optional): The CPU threads each worker's runtime may use. Defaults to an even share of the cores.
+        inter_threads (int, optional): The ONNX session's inter-op threads, see detectors.create_backend.
+            Defaults to config.onnx_inter_threads.
+        thread_affinities (str, optional): The cores of every worker's ONNX intra-op threads, see detectors.create_backend.
+            Defaults to config.onnx_thread_affinities.
+        spinning (bool, optional): Whether idle ONNX Runtime threads spin. Defaults to config.onnx_spinning.
+
+    Returns:
+        Tuple[List[Dict], List[StreamResult]]: The state changes of all streams with a 'camera' key, ordered by
+            timestamp, and the result of every stream in the order they finished.
+    """
+    cores = os.cpu_count() or 1
+    workers = max(1, min(workers or cores, len(streams)))
+    threads_per_worker = threads_per_worker or max(1, cores // workers)
+
+    # Spawned workers start clean instead of inheriting a forked copy of the parent's runtime threads
+    context = multiprocessing.get_context('spawn')
+    results = []
+    with context.Pool(workers, initializer=_init_worker,
+                      initargs=(backend, model_path, device, imgsz, threads_per_worker, inter_threads, thread_affinities,
+                                spinning)) as pool:
+        for result in pool.imap_unordered(_process_stream, streams):
+            results.append(result)
+
+    combined = [change for result in results for change in result.state_changes]
+    combined.sort(key=lambda change: (change['timestamp'], change['camera']))
+    return combined, results
+
+
+def run_streams_batched(
+        streams: Sequence[Stream],
+        backend: str = config.backend,
+        model_path: str = config.model_path,
+        device: str = 'cpu',
+        imgsz: Tuple[int, int] = config.imgsz,
+        max_batch_size: int = 8,
+        max_wait: float = 0.01,
+        threads: int = None,
+        metrics: Metrics = None,
+        inter_threads: int = config.onnx_inter_threads,
+        thread_affinities: str = config.onnx_thread_affinities,
+        spinning: bool = config.onnx_spinning) -> Tuple[List[Dict], List[StreamResult]]:
+    """
+    Count the vehicles of every stream in this process, detecting the frames of all streams in shared batches.
+
+    Every stream runs inference() on its own thread with its own ByteTracker and counter. Their
+    detect calls meet in one BatchScheduler, which sends a batch to the model when max_batch_size
+    frames are waiting or max_wait seconds have passed.
+
+    Parameters:
+        streams (Sequence[Stream]): The cameras to process.
+        backend (str, optional): The detector backend, see batching.create_batch_scheduler. Defaults to config.backend.
+        model_path (str, optional): The model to load. Defaults to config.model_path.
+        device (str, optional): The device to run the inference on. Defaults to 'cpu'.
+        imgsz (tuple, optional): The size of the input image (height, width). Defaults to config.imgsz.
+        max_batch_size (int, optional): The most frames per batch. Defaults to 8.
+        max_wait (float, optional): The most seconds a frame waits for the batch to fill. Defaults to 0.01.
+        threads (int, optional): The number of CPU threads the runtime may use. Defaults to the runtime's default.
+        metrics (Metrics, optional): Shared by all streams and the scheduler. Defaults to None, which records nothing.
+        inter_threads (int, optional): The ONNX session's inter-op threads, see detectors.create_backend.
+            Defaults to config.onnx_inter_threads.
+        thread_affinities (str, optional): The cores of ONNX intra-op threads, see detectors.create_backend.
+            Defaults to config.onnx_thread_affinities.
+        spinning (bool, optional): Whether idle ONNX Runtime threads spin. Defaults to config.onnx_spinning.
+
+    Returns:
+        Tuple[List[Dict], List[StreamResult]]: The state changes of all streams with a 'camera' key, ordered by
+            timestamp, and the result of every stream in the order they were given.
+    """
+    scheduler = create_batch_scheduler(backend, model_path, device=device, imgsz=imgsz,
+                                       max_batch_size=max_batch_size, max_wait=max_wait, threads=threads, metrics=metrics,
+                                       inter_threads=inter_threads, thread_affinities=thread_affinities, spinning=spinning)
+    results: List[Optional[StreamResult]] = [None] * len(streams)
+
+    def run(index: int, stream: Stream) -> None:
+        start = time.perf_counter()
+        try:
+            state_changes = inference(stream_backend(scheduler), stream.video_path, stream.export_path or '', device=device,
+                                      imgsz=imgsz, save=stream.export_path is not None, metrics=metrics)
+            error = None
+        except Exception as e:
+            state_changes, error = [], f'{type(e).__name__}: {e}'
+        for change in state_changes:
+            change['camera'] = stream.name
+        results[index] = StreamResult(stream.name, state_changes, time.perf_counter() - start, os.getpid(), error)
+
+    stream_threads = [threading.Thread(target=run, args=(i, stream), name=f'stream-{stream.name}') for i, stream in enumerate(streams)]
+    for thread in stream_threads:
+        thread.start()
+    for thread in stream_threads:
+        thread.join()
+    scheduler.close()
+
+    combined = [change for result in results for change in result.state_changes]
+    combined.sort(key=lambda change: (change['timestamp'], change['camera']))
+    return combined, results
+
+
+def main() -> None:
+    """
+    Process every stream given on the command line and write the combined events to a CSV file.
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('videos', nargs='+', help='Video files or stream URLs, one per camera')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: one per core)')
+    parser.add_argument('--threads-per-worker', type=int, default=None, help='CPU threads per worker (default: an even share)')
+    parser.add_argument('--backend', default=config.backend, choices=['ultralytics', 'onnx'])
+    parser.add_argument('--model', default=config.model_path, help='The .pt weights or the .onnx model')
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--inter-threads', type=int, default=config.onnx_inter_threads,
+                        help='ONNX inter-op threads; above 1 runs graph branches in parallel')
+    parser.add_argument('--thread-affinities', default=config.onnx_thread_affinities,
+                        help="Cores of the ONNX intra-op threads after the first, e.g. '1;2;3'")
+    parser.add_argument('--spinning', action=argparse.BooleanOptionalAction, default=config.onnx_spinning,
+                        help='Whether idle ONNX Runtime threads spin')
+    parser.add_argument('--batched', action='store_true', help='Run all streams in one process and batch their detections')
+    parser.add_argument('--max-batch-size', type=int, default=8, help='The most frames per batch with --batched')
+    parser.add_argument('--max-wait-ms', type=float, default=10.0, help='The most a frame waits for its batch with --batched')
+    parser.add_argument('--save-dir', default=None, help='Save the annotated video of every camera to this directory')
+    parser.add_argument('--output', default='car_data.csv', help='The combined CSV of all cameras')
+    args = parser.parse_args()
+
+    streams = []
+    for i, video in enumerate(args.videos):
+        name = f'cam{i}'
+        export_path = os.path.join(args.save_dir, f'{name}.mp4') if args.save_dir else None
+        streams.append(Stream(name, video, export_path))
+    if args.save_dir:
+        os.makedirs(args.save_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    if args.batched:
+        combined, results = run_streams_batched(streams, args.backend, args.model, device=args.device,
+                                                max_batch_size=args.max_batch_size, max_wait=args.max_wait_ms / 1000,
+                                                threads=args.threads_per_worker, inter_threads=args.inter_threads,
+                                                thread_affinities=args.thread_affinities, spinning=args.spinning)
+    else:
+        combined, results = run_streams(streams, args.backend, args.model, device=args.device,
+                                        workers=args.workers, threads_per_worker=args.threads_per_worker,
+                                        inter_threads=args.inter_threads, thread_affinities=args.thread_affinities,
+                                        spinning=args.spinning)
+    wall_time = time.perf_counter() - start
+
+    for result in sorted(results, key=lambda result: result.name):
+        status = result.error or f'{len(result.state_changes)} events'
+        print(f'{result.name}: {status} in {result.processing_time:.1f} s (worker {result.worker})')
+    print(f'{len(streams)} streams in {wall_time:.1f} s')
+
+    # Imported here so the workers never load pandas and matplotlib
+    from visualization import save_to_csv
+
+    save_to_csv(combined, export_path=args.output)
+
+
+if __name__ == '__main__':
+    main()
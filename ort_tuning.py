@@ -0,0 +1,300 @@
+"""
+Quantized model variants and session tuning for the ONNX backend.
+
+Builds FP16 and INT8 (dynamic, and static calibrated on frames of a local video) variants of an
+ONNX model, benchmarks every variant with several thread counts, with and without inter-op parallelism,
+pinned thread affinities and spinning on this CPU, and saves the fastest setting whose detections still
+agree with the FP32 model's to a JSON file.
+detectors.create_backend loads it at startup for the same model on the same kind of CPU.
+
+Usage:
+    python ort_tuning.py yolov8m.onnx input.mp4 --frames 32 --accuracy-floor 0.95 --output ort_tuning.json
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+import config
+from detectors import CONF_THRESHOLD, IOU_THRESHOLD
+from legacy_onnx_detector import DetectorONNX
+
+VARIANTS: Tuple[str, ...] = ('fp32', 'fp16', 'int8-dynamic', 'int8-static')
+
+
+def cpu_identity() -> str:
+    """
+    Describe the CPU a tuning was measured on; a tuning is only reused on the same kind of machine.
+    """
+    return ' '.join(part for part in (platform.machine(), platform.processor(), f'{os.cpu_count()} cores') if part)
+
+
+def sample_frames(video_path: str, count: int = 32, imgsz: Tuple[int, int] = (640, 640)) -> List[np.ndarray]:
+    """
+    Read count frames spread evenly over a video, resized to imgsz (height, width) as inference() does.
+    """
+    cap = cv2.VideoCapture(video_path)
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    indices = set(np.linspace(0, max(total - 1, 0), count).round().astype(int).tolist()) if total > 0 else None
+    frames = []
+    index = 0
+    while len(frames) < count:
+        success, frame = cap.read()
+        if not success:
+            break
+        if indices is None or index in indices:
+            frames.append(cv2.resize(frame, (imgsz[1], imgsz[0])))
+        index += 1
+    cap.release()
+    if not frames:
+        raise ValueError(f'No frames could be read from {video_path!r}')
+    return frames
+
+
+class _FrameReader:
+    # The calibration data of quantize_static: the frames preprocessed exactly as DetectorONNX feeds them
+    def __init__(self, detector: DetectorONNX, frames: Sequence[np.ndarray]):
+        self.input_name = detector.input_names[0]
+        self.tensors = iter([detector.preprocess(frame).copy() for frame in frames])
+
+    def get_next(self) -> Optional[Dict[str, np.ndarray]]:
+        tensor = next(self.tensors, None)
+        return None if tensor is None else {self.input_name: tensor}
+
+
+def build_variant(model_path: str, variant: str, frames: Sequence[np.ndarray] = (), imgsz: Tuple[int, int] = (640, 640),
+                  output_path: str = None) -> str:
+    """
+    Write a variant of an FP32 ONNX model.
+
+    Parameters:
+        model_path (str): The FP32 model.
+        variant (str): 'fp32' (the model itself), 'fp16', 'int8-dynamic' or 'int8-static'.
+        frames (Sequence[np.ndarray], optional): The calibration frames of 'int8-static', see sample_frames.
+        imgsz (tuple, optional): The input (height, width) if the model has dynamic spatial axes. Defaults to (640, 640).
+        output_path (str, optional): Where to write the variant. Defaults to the model path with the variant
+            before the extension, e.g. yolov8m.int8-static.onnx.
+
+    Returns:
+        str: The path of the variant.
+    """
+    if variant == 'fp32':
+        return model_path
+    output_path = output_path or f'{os.path.splitext(model_path)[0]}.{variant}.onnx'
+
+    if variant == 'fp16':
+        import onnx
+        from onnxruntime.transformers.float16 import convert_float_to_float16
+
+        # The inputs and outputs stay FP32, so DetectorONNX feeds and reads the model unchanged
+        onnx.save(convert_float_to_float16(onnx.load(model_path), keep_io_types=True), output_path)
+    elif variant == 'int8-dynamic':
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(model_path, output_path, weight_type=QuantType.QUInt8)
+    elif variant == 'int8-static':
+        from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_static
+
+        if not frames:
+            raise ValueError('int8-static needs calibration frames')
+        reader = _FrameReader(DetectorONNX(model_path, imgsz=imgsz), frames)
+        quantize_static(model_path, output_path, reader, quant_format=QuantFormat.QDQ, per_channel=True,
+                        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+                        calibrate_method=CalibrationMethod.MinMax)
+    else:
+        raise ValueError(f'Unknown model variant: {variant!r}, expected one of {VARIANTS}')
+    return output_path
+
+
+def pinned_affinities(threads: int, cores: int) -> Optional[str]:
+    """
+    Return the thread affinities that pin the intra-op threads after the first to one core each, from the second
+    logical core on, e.g. '2;3;4' for 4 threads; the first thread is the caller's and stays unpinned. None if
+    there is nothing to pin or too few cores.
+    """
+    if threads < 2 or threads > cores:
+        return None
+    return ';'.join(str(core) for core in range(2, threads + 1))
+
+
+def detection_agreement(reference: Sequence[Tuple], candidate: Sequence[Tuple], iou_threshold: float = 0.5) -> float:
+    """
+    Return the F1 score of the candidate detections against the reference detections of the same frames.
+
+    A candidate box matches an unmatched reference box of the same class with an IoU above iou_threshold,
+    highest scores first. Frames without any detections in both count as agreeing.
+    """
+    matched, total = 0, 0
+    for (ref_boxes, _, ref_classes), (boxes, scores, classes) in zip(reference, candidate):
+        total += len(ref_boxes) + len(boxes)
+        used = np.zeros(len(ref_boxes), dtype=bool)
+        for i in np.argsort(-np.asarray(scores)):
+            if not len(ref_boxes):
+                break
+            box = boxes[i]
+            width = np.minimum(ref_boxes[:, 2], box[2]) - np.maximum(ref_boxes[:, 0], box[0])
+            height = np.minimum(ref_boxes[:, 3], box[3]) - np.maximum(ref_boxes[:, 1], box[1])
+            intersection = np.maximum(width, 0) * np.maximum(height, 0)
+            union = ((ref_boxes[:, 2] - ref_boxes[:, 0]) * (ref_boxes[:, 3] - ref_boxes[:, 1])
+                     + (box[2] - box[0]) * (box[3] - box[1]) - intersection)
+            iou = np.where(used | (ref_classes != classes[i]), 0.0, intersection / np.maximum(union, 1e-9))
+            best = int(np.argmax(iou))
+            if iou[best] > iou_threshold:
+                used[best] = True
+                matched += 1
+    return 1.0 if total == 0 else 2 * matched / total
+
+
+def autotune(
+        model_path: str,
+        video_path: str,
+        imgsz: Tuple[int, int] = (640, 640),
+        variants: Sequence[str] = VARIANTS,
+        thread_counts: Sequence[int] = None,
+        frames: int = 32,
+        accuracy_floor: float = 0.95,
+        device: str = 'cpu') -> Tuple[Optional[Dict], List[Dict]]:
+    """
+    Benchmark every model variant with every thread setting and pick the fastest accurate one.
+
+    For each thread count the grid tries inter-op parallelism, pinning the intra-op threads after the first
+    to consecutive cores (see pinned_affinities), and idle threads spinning or sleeping.
+
+    Parameters:
+        model_path (str): The FP32 ONNX model.
+        video_path (str): A local video whose frames are used for calibration, timing and the accuracy check.
+        imgsz (tuple, optional): The frame (height, width), as in config.imgsz. Defaults to (640, 640).
+        variants (Sequence[str], optional): The variants to try, see build_variant. Defaults to all.
+        thread_counts (Sequence[int], optional): The intra-op thread counts to try. Defaults to 1, half and all cores.
+        frames (int, optional): The number of frames to sample. Defaults to 32.
+        accuracy_floor (float, optional): The lowest detection_agreement with the FP32 model to accept. Defaults to 0.95.
+        device (str, optional): The device to run the inference on. Defaults to 'cpu'.
+
+    Returns:
+        Tuple[Optional[Dict], List[Dict]]: The best setting, None if no variant reached the floor, and every measurement.
+    """
+    cores = os.cpu_count() or 1
+    thread_counts = sorted(set(thread_counts or (1, max(1, cores // 2), cores)))
+    samples = sample_frames(video_path, frames, imgsz)
+
+    def detector(path: str, **settings) -> DetectorONNX:
+        return DetectorONNX(path, device=device, conf_threshold=CONF_THRESHOLD, iou_threshold=IOU_THRESHOLD,
+                            imgsz=imgsz, **settings)
+
+    reference_detector = detector(model_path)
+    reference = [tuple(np.copy(a) for a in reference_detector.detect_objects(frame)) for frame in samples]
+
+    results = []
+    for variant in variants:
+        try:
+            path = build_variant(model_path, variant, samples, imgsz)
+        except Exception as e:
+            results.append({'variant': variant, 'error': f'{type(e).__name__}: {e}'})
+            continue
+        for threads, parallel, pinned, spinning in itertools.product(thread_counts, (False, True), (False, True), (True, False)):
+            affinities = pinned_affinities(threads, cores) if pinned else None
+            if pinned and affinities is None:
+                continue
+            settings = {'threads': threads, 'inter_threads': 2 if parallel else None, 'parallel': parallel,
+                        'thread_affinities': affinities, 'spinning': spinning}
+            try:
+                candidate = detector(path, **settings)
+                # The first runs allocate the session's buffers and aren't timed
+                for frame in samples[:2]:
+                    candidate.detect_objects(frame)
+                start = time.perf_counter()
+                detections = [tuple(np.copy(a) for a in candidate.detect_objects(frame)) for frame in samples]
+                fps = len(samples) / (time.perf_counter() - start)
+            except Exception as e:
+                results.append({'variant': variant, **settings, 'error': f'{type(e).__name__}: {e}'})
+                continue
+            agreement = detection_agreement(reference, detections)
+            results.append({'variant': variant, 'model_path': path, **settings, 'fps': round(fps, 2),
+                            'agreement': round(agreement, 4), 'accepted': agreement >= accuracy_floor})
+
+    accepted = [result for result in results if result.get('accepted')]
+    best = max(accepted, key=lambda result: result['fps']) if accepted else None
+    return best, results
+
+
+def save_tuning(path: str, model_path: str, best: Dict) -> None:
+    """
+    Store the best setting of a model in the tuning file, next to the settings of other models.
+    """
+    tunings = {}
+    if os.path.exists(path):
+        with open(path) as file:
+            tunings = json.load(file)
+    tunings[os.path.abspath(model_path)] = {
+        'model_path': os.path.abspath(best['model_path']),
+        'threads': best['threads'],
+        'inter_threads': best['inter_threads'],
+        'parallel': best['parallel'],
+        'thread_affinities': best['thread_affinities'],
+        'spinning': best['spinning'],
+        'variant': best['variant'],
+        'fps': best['fps'],
+        'agreement': best['agreement'],
+        'cpu': cpu_identity(),
+    }
+    with open(path, 'w') as file:
+        json.dump(tunings, file, indent=2)
+
+
+def load_tuning(path: str, model_path: str) -> Dict:
+    """
+    Return the DetectorONNX settings tuned for a model on this kind of CPU, including the variant's model_path,
+    or an empty dict if the file, the model or the CPU doesn't match.
+    """
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        tuning = json.load(file).get(os.path.abspath(model_path))
+    if not tuning or tuning.get('cpu') != cpu_identity() or not os.path.exists(tuning['model_path']):
+        return {}
+    # Tunings saved before affinities and spinning were searched keep ONNX Runtime's defaults for them
+    return {key: tuning.get(key) for key in ('model_path', 'threads', 'inter_threads', 'parallel', 'thread_affinities', 'spinning')}
+
+
+def main() -> None:
+    """
+    Tune a model on the frames of a video and save the best setting.
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('model', help='The FP32 .onnx model')
+    parser.add_argument('video', help='A local video to calibrate and measure on')
+    parser.add_argument('--imgsz', type=int, nargs=2, default=config.imgsz, metavar=('HEIGHT', 'WIDTH'))
+    parser.add_argument('--variants', nargs='+', default=list(VARIANTS), choices=VARIANTS)
+    parser.add_argument('--threads', type=int, nargs='+', default=None, help='Intra-op thread counts (default: 1, half and all cores)')
+    parser.add_argument('--frames', type=int, default=32, help='Frames sampled from the video')
+    parser.add_argument('--accuracy-floor', type=float, default=0.95, help='The lowest F1 against the FP32 detections')
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--output', default=config.onnx_tuning_path or 'ort_tuning.json', help='The tuning file to update')
+    args = parser.parse_args()
+
+    best, results = autotune(args.model, args.video, tuple(args.imgsz), args.variants, args.threads, args.frames,
+                             args.accuracy_floor, args.device)
+    for result in results:
+        settings = (f"{result['variant']:<13} threads={result.get('threads')} parallel={result.get('parallel')}"
+                    f" affinities={result.get('thread_affinities')} spinning={result.get('spinning')}")
+        if 'error' in result:
+            print(f"{settings}  failed: {result['error']}")
+        else:
+            print(f"{settings}  {result['fps']:8.2f} fps  agreement {result['agreement']:.3f}"
+                  f"{'' if result['accepted'] else '  (below the floor)'}")
+    if best is None:
+        print('No variant reached the accuracy floor, nothing saved')
+        return
+    save_tuning(args.output, args.model, best)
+    print(f"Saved {best['variant']} with {best['threads']} threads ({best['fps']} fps) to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, List, Sequence, Tuple
+
+# Marks the end of the stream as it travels down the queues
+_END = object()
+
+
+@dataclass
+class StageStats:
+    """
+    Throughput counters for a single pipeline stage.
+
+    Attributes:
+        name (str): The name of the stage.
+        items (int): The number of items the stage has processed.
+        busy_time (float): Seconds spent doing work inside the stage.
+        wait_time (float): Seconds spent blocked on the upstream queue.
+    """
+    name: str
+    items: int = 0
+    busy_time: float = 0.0
+    wait_time: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        """Items per second of busy time, i.e. the rate the stage could sustain on its own."""
+        return self.items / self.busy_time if self.busy_time > 0 else 0.0
+
+
+def _put(q: queue.Queue, item: Any, stop: threading.Event) -> bool:
+    """
+    Put an item on a bounded queue, giving up if the pipeline is being torn down.
+
+    Returns:
+        bool: True if the item was queued, False if the pipeline was stopped.
+    """
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q: queue.Queue, stop: threading.Event) -> Any:
+    """
+    Take an item from a queue, returning the end marker if the pipeline is being torn down.
+    """
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _END
+
+
+def run_pipeline(
+        source: Iterable,
+        stages: Sequence[Tuple[str, Callable[[Any], Any]]],
+        queue_size: int = 8,
+        source_name: str = 'decode') -> Tuple[List[StageStats], float]:
+    """
+    Run a source and a chain of stages in separate threads connected by bounded queues.
+
+    Every stage runs on exactly one thread, so items reach each stage in the order the
+    source produced them. The return value of a stage is handed to the next one; the
+    return value of the last stage is discarded. An exception in any stage stops the
+    whole pipeline and is re-raised in the calling thread.
+
+    Parameters:
+        source (Iterable): The iterable producing the items, e.g. decoded frames.
+        stages (Sequence[Tuple[str, Callable]]): The (name, function) pairs to run in order.
+        queue_size (int, optional): The capacity of each queue between stages. Defaults to 8.
+        source_name (str, optional): The name reported for the source stage. Defaults to 'decode'.
+
+    Returns:
+        Tuple[List[StageStats], float]: The statistics of the source and of every stage, and the wall-clock time.
+    """
+    stop = threading.Event()
+    errors = []
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+    stats = [StageStats(source_name)] + [StageStats(name) for name, _ in stages]
+
+    def produce() -> None:
+        stage_stats = stats[0]
+        iterator = iter(source)
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                stage_stats.busy_time += time.perf_counter() - start
+                stage_stats.items += 1
+                if not _put(queues[0], item, stop):
+                    return
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+            return
+        _put(queues[0], _END, stop)
+
+    def consume(index: int, function: Callable[[Any], Any]) -> None:
+        stage_stats = stats[index + 1]
+        in_queue = queues[index]
+        out_queue = queues[index + 1] if index + 1 < len(queues) else None
+        while True:
+            start = time.perf_counter()
+            item = _get(in_queue, stop)
+            stage_stats.wait_time += time.perf_counter() - start
+            if item is _END:
+                break
+            start = time.perf_counter()
+            try:
+                result = function(item)
+            except BaseException as e:
+                errors.append(e)
+                stop.set()
+                return
+            stage_stats.busy_time += time.perf_counter() - start
+            stage_stats.items += 1
+            if out_queue is not None and not _put(out_queue, result, stop):
+                return
+        if out_queue is not None:
+            _put(out_queue, _END, stop)
+
+    threads = [threading.Thread(target=produce, name=source_name, daemon=True)]
+    threads += [threading.Thread(target=consume, args=(i, function), name=name, daemon=True)
+                for i, (name, function) in enumerate(stages)]
+
+    wall_start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_time = time.perf_counter() - wall_start
+
+    if errors:
+        raise errors[0]
+    return stats, wall_time
+
+
+def format_stage_report(stats: Sequence[StageStats], wall_time: float) -> str:
+    """
+    Format per-stage throughput as a small text table and name the bottleneck stage.
+
+    Parameters:
+        stats (Sequence[StageStats]): The statistics returned by run_pipeline.
+        wall_time (float): The wall-clock time of the run in seconds.
+
+    Returns:
+        str: The formatted report.
+    """
+    lines = [f"{'stage':<18}{'items':>8}{'busy s':>10}{'wait s':>10}{'fps':>10}{'util %':>9}"]
+    for s in stats:
+        utilisation = 100 * s.busy_time / wall_time if wall_time > 0 else 0.0
+        lines.append(f"{s.name:<18}{s.items:>8}{s.busy_time:>10.2f}{s.wait_time:>10.2f}{s.throughput:>10.1f}{utilisation:>9.1f}")
+    bottleneck = max(stats, key=lambda s: s.busy_time)
+    overall = stats[-1].items / wall_time if wall_time > 0 else 0.0
+    lines.append(f"wall time: {wall_time:.2f} s, overall: {overall:.1f} fps, bottleneck: {bottleneck.name}")
+    return "\n".join(lines)
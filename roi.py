@@ -0,0 +1,223 @@
+import math
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+from batching import DetectBatch, ultralytics_detect_batch
+from detectors import CONF_THRESHOLD, IOU_THRESHOLD, ONNXBackend, onnx_session_settings
+from metrics import Metrics
+from tracker import ByteTracker
+from zones import CountingLine
+
+# A window in frame pixels: (x0, y0, x1, y1), x1 and y1 exclusive
+Window = Tuple[int, int, int, int]
+
+
+def line_windows(lines: Sequence[CountingLine], frame_size: Tuple[int, int], margin: int = 64) -> List[Window]:
+    """
+    Return the region of interest of every counting segment: its bounding box grown by margin on all sides.
+
+    Parameters:
+        lines (Sequence[CountingLine]): The counting segments, including the edges of polygon zones.
+        frame_size (Tuple[int, int]): The (height, width) of the frames.
+        margin (int, optional): The pixels to keep on each side of a segment. Should exceed half the size of a
+            vehicle, so every vehicle is whole in at least one tile while it crosses. Defaults to 64.
+
+    Returns:
+        List[Window]: One window per segment, clipped to the frame.
+    """
+    height, width = frame_size
+    windows = []
+    for line in lines:
+        (x0, y0), (x1, y1) = line.start, line.end
+        windows.append((max(0, int(min(x0, x1)) - margin), max(0, int(min(y0, y1)) - margin),
+                        min(width, int(max(x0, x1)) + margin), min(height, int(max(y0, y1)) + margin)))
+    return windows
+
+
+def tile_windows(windows: Sequence[Window], tile_size: Tuple[int, int], frame_size: Tuple[int, int],
+                 overlap: int = 64) -> List[Window]:
+    """
+    Cover every window with tiles of one fixed size, spread evenly so neighbouring tiles overlap.
+
+    Parameters:
+        windows (Sequence[Window]): The regions of interest.
+        tile_size (Tuple[int, int]): The (height, width) of a tile, the detector's input size. Capped at the frame size.
+        frame_size (Tuple[int, int]): The (height, width) of the frames.
+        overlap (int, optional): The fewest pixels neighbouring tiles of a window share. A vehicle smaller than
+            the overlap is whole in at least one of them wherever it is. Defaults to 64.
+
+    Returns:
+        List[Window]: The distinct tiles, all inside the frame.
+    """
+    frame_height, frame_width = frame_size
+    tile_height, tile_width = min(tile_size[0], frame_height), min(tile_size[1], frame_width)
+
+    def starts(low: int, high: int, tile: int, limit: int) -> List[int]:
+        # The fewest tiles that cover [low, high) with the overlap, centred on it when one tile is larger than the window
+        count = 1 if high - low <= tile else math.ceil((high - low - overlap) / max(tile - overlap, 1))
+        if count == 1:
+            return [min(max((low + high - tile) // 2, 0), limit - tile)]
+        step = (high - low - tile) / (count - 1)
+        return [min(max(round(low + i * step), 0), limit - tile) for i in range(count)]
+
+    tiles = []
+    for x0, y0, x1, y1 in windows:
+        for top in starts(y0, y1, tile_height, frame_height):
+            for left in starts(x0, x1, tile_width, frame_width):
+                tile = (left, top, left + tile_width, top + tile_height)
+                if tile not in tiles:
+                    tiles.append(tile)
+    return tiles
+
+
+def merge_tile_detections(boxes: np.ndarray, scores: np.ndarray, class_ids: np.ndarray, tile_indices: np.ndarray,
+                          cut: np.ndarray, threshold: float = 0.6) -> np.ndarray:
+    """
+    Remove the duplicates of vehicles that were detected in more than one overlapping tile.
+
+    Detections are visited whole ones first, then by score. A detection of another tile is dropped
+    when most of the smaller of the two boxes lies inside the other one, which also catches the part
+    of a vehicle that was cut off at a tile edge.
+
+    Parameters:
+        boxes (np.ndarray): The boxes in frame coordinates, (x1, y1, x2, y2), shape (N, 4).
+        scores (np.ndarray): The detection scores, shape (N,).
+        class_ids (np.ndarray): The class IDs, shape (N,).
+        tile_indices (np.ndarray): The tile every box was detected in, shape (N,).
+        cut (np.ndarray): Whether a box touches a tile edge inside the frame, shape (N,).
+        threshold (float, optional): The intersection over the smaller area above which two boxes are the same vehicle.
+            Defaults to 0.6.
+
+    Returns:
+        np.ndarray: The indices of the boxes to keep.
+    """
+    order = np.lexsort((-scores, cut))
+    areas = np.maximum(boxes[:, 2] - boxes[:, 0], 0) * np.maximum(boxes[:, 3] - boxes[:, 1], 0)
+    suppressed = np.zeros(len(boxes), dtype=bool)
+    keep = []
+    for i in order:
+        if suppressed[i]:
+            continue
+        keep.append(i)
+        width = np.minimum(boxes[i, 2], boxes[:, 2]) - np.maximum(boxes[i, 0], boxes[:, 0])
+        height = np.minimum(boxes[i, 3], boxes[:, 3]) - np.maximum(boxes[i, 1], boxes[:, 1])
+        intersection = np.maximum(width, 0) * np.maximum(height, 0)
+        overlap = intersection / np.maximum(np.minimum(areas[i], areas), 1e-9)
+        suppressed |= (overlap > threshold) & (class_ids == class_ids[i]) & (tile_indices != tile_indices[i])
+    return np.array(keep, dtype=np.intp)
+
+
+class ROIDetector:
+    """
+    Detect only in tiles around the counting lines instead of in the whole frame.
+
+    The tiles are cut from the frame at full resolution and detected in one batch, so the detector
+    sees fewer pixels per frame without shrinking the vehicles. The boxes are moved back to frame
+    coordinates and the duplicates from overlapping tiles are merged. It has the detect_objects
+    method of DetectorONNX, so it takes the detector's place in an ONNXBackend.
+    """
+
+    def __init__(self, detect_batch: DetectBatch, tiles: Sequence[Window], frame_size: Tuple[int, int],
+                 edge_tolerance: int = 2, merge_threshold: float = 0.6, metrics: Metrics = None):
+        """
+        Parameters:
+            detect_batch (DetectBatch): Detects the objects in a list of tiles, e.g. DetectorONNX.detect_batch.
+            tiles (Sequence[Window]): The tiles to detect in, see tile_windows.
+            frame_size (Tuple[int, int]): The (height, width) of the frames.
+            edge_tolerance (int, optional): How close in pixels a box must come to a tile edge to count as cut. Defaults to 2.
+            merge_threshold (float, optional): See merge_tile_detections. Defaults to 0.6.
+            metrics (Metrics, optional): Where to count the detector pixels. Defaults to None.
+        """
+        self.detect_batch = detect_batch
+        self.tiles = list(tiles)
+        self.frame_size = frame_size
+        self.edge_tolerance = edge_tolerance
+        self.merge_threshold = merge_threshold
+        self.metrics = metrics if metrics is not None else Metrics(enabled=False)
+        self.pixels_per_frame = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in self.tiles)
+
+        height, width = frame_size
+        tiles = np.array(self.tiles, dtype=np.float64).reshape(-1, 4)
+        self._offsets = np.concatenate([tiles[:, :2], tiles[:, :2]], axis=1)
+        # Only the tile edges inside the frame cut vehicles off; the frame border cuts them off anyway
+        self._inner_edges = np.stack([tiles[:, 0] > 0, tiles[:, 1] > 0, tiles[:, 2] < width, tiles[:, 3] < height], axis=1)
+
+    def detect_objects(self, frame: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        crops = [frame[y0:y1, x0:x1] for x0, y0, x1, y1 in self.tiles]
+        detections = self.detect_batch(crops)
+        self.metrics.increment('detector_pixels', self.pixels_per_frame)
+
+        boxes, scores, class_ids, tile_indices = [], [], [], []
+        for i, (tile_boxes, tile_scores, tile_class_ids) in enumerate(detections):
+            tile_boxes = np.asarray(tile_boxes, dtype=np.float64).reshape(-1, 4)
+            boxes.append(tile_boxes + self._offsets[i])
+            scores.append(np.asarray(tile_scores, dtype=np.float64).reshape(-1))
+            class_ids.append(np.asarray(tile_class_ids, dtype=np.int64).reshape(-1))
+            tile_indices.append(np.full(len(tile_boxes), i))
+        boxes, scores = np.concatenate(boxes), np.concatenate(scores)
+        class_ids, tile_indices = np.concatenate(class_ids), np.concatenate(tile_indices)
+        if len(boxes) == 0:
+            return boxes, scores, class_ids
+
+        tiles = np.asarray(self.tiles, dtype=np.float64)[tile_indices]
+        near_edge = np.abs(boxes - tiles) <= self.edge_tolerance
+        cut = np.any(near_edge & self._inner_edges[tile_indices], axis=1)
+        keep = merge_tile_detections(boxes, scores, class_ids, tile_indices, cut, self.merge_threshold)
+        return boxes[keep], scores[keep], class_ids[keep]
+
+
+def create_roi_backend(
+        backend: str,
+        model_path: str,
+        lines: Sequence[CountingLine],
+        imgsz: Tuple[int, int] = (640, 640),
+        tile_size: Tuple[int, int] = (128, 128),
+        margin: int = 64,
+        device: str = 'cpu',
+        threads: int = None,
+        tuning_path: str = None,
+        inter_threads: int = None,
+        thread_affinities: str = None,
+        spinning: bool = None) -> ONNXBackend:
+    """
+    Build a backend that detects in tiles around the counting lines and tracks with ByteTracker.
+
+    Parameters:
+        backend (str): 'ultralytics' or 'onnx'. An ONNX model must be exported with dynamic spatial axes
+            (export_onnx does) to run at the tile size; a fixed-size model would upscale every tile.
+        model_path (str): The path to the .pt weights or the .onnx model.
+        lines (Sequence[CountingLine]): The counting segments the tiles are placed around.
+        imgsz (tuple, optional): The (height, width) the frames are resized to before detection. Defaults to (640, 640).
+        tile_size (tuple, optional): The (height, width) of a tile, a multiple of 32. Defaults to (128, 128).
+        margin (int, optional): The pixels to keep on each side of a segment. Defaults to 64.
+        device (str, optional): The device to run the inference on. Defaults to 'cpu'.
+        threads (int, optional): The number of CPU threads the runtime may use. Defaults to the runtime's default.
+        tuning_path (str, optional): The file written by ort_tuning.py, applied to an .onnx model as in
+            detectors.create_backend; the thread settings given here override the tuned ones. Defaults to None.
+        inter_threads (int, optional): The ONNX session's inter-op threads, see detectors.create_backend. Defaults to None.
+        thread_affinities (str, optional): The ONNX session's thread affinities, see detectors.create_backend. Defaults to None.
+        spinning (bool, optional): Whether idle ONNX Runtime threads spin. Defaults to the runtime's default.
+
+    Returns:
+        ONNXBackend: The backend.
+    """
+    tiles = tile_windows(line_windows(lines, imgsz, margin), tile_size, imgsz, overlap=margin)
+    if backend == 'ultralytics':
+        from ultralytics import YOLO
+
+        if threads:
+            import torch
+
+            torch.set_num_threads(threads)
+        detect_batch = ultralytics_detect_batch(YOLO(model_path), device=device, imgsz=tile_size)
+    elif backend == 'onnx':
+        from legacy_onnx_detector import DetectorONNX
+
+        model_path, settings = onnx_session_settings(model_path, tuning_path, threads, inter_threads, thread_affinities, spinning)
+        detector = DetectorONNX(model_path, device=device, conf_threshold=CONF_THRESHOLD, iou_threshold=IOU_THRESHOLD,
+                                imgsz=tile_size, batch_size=len(tiles), **settings)
+        detect_batch = detector.detect_batch
+    else:
+        raise ValueError(f"Unknown detector backend: {backend!r}, expected 'ultralytics' or 'onnx'")
+    return ONNXBackend(ROIDetector(detect_batch, tiles, imgsz), tracker=ByteTracker())
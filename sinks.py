@@ -0,0 +1,190 @@
+import csv
+import json
+import os
+import sqlite3
+import time
+from typing import Dict, List, Sequence
+
+
+class EventSink:
+    """
+    Receives the crossing events of inference() as they happen.
+
+    Sinks are context managers; leaving the block flushes and closes them.
+    """
+
+    def write(self, event: Dict) -> None:
+        """
+        Take one event, a dict with 'car_id', 'timestamp' and 'state' keys.
+        """
+        raise NotImplementedError
+
+    def tick(self) -> None:
+        """
+        Called once per frame, so a sink can flush on a timer even when no events arrive.
+        """
+
+    def flush(self) -> None:
+        """
+        Persist every event written so far.
+        """
+
+    def close(self) -> None:
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class ListSink(EventSink):
+    """
+    Keep every event in memory, the way inference() always returned them. Grows without bound.
+    """
+
+    def __init__(self):
+        self.events: List[Dict] = []
+
+    def write(self, event: Dict) -> None:
+        self.events.append(event)
+
+
+class BufferedSink(EventSink):
+    """
+    Collect events in a small buffer and write them in batches, after batch_size events or
+    flush_interval seconds, whichever comes first. Memory stays constant however long the feed runs,
+    and at most flush_interval seconds of events are lost if the process dies.
+    """
+
+    def __init__(self, batch_size: int = 256, flush_interval: float = 5.0):
+        """
+        Parameters:
+            batch_size (int, optional): The most events held in memory. Defaults to 256.
+            flush_interval (float, optional): The most seconds an event stays in memory. Defaults to 5.
+        """
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer: List[Dict] = []
+        self._last_flush = time.monotonic()
+
+    def write(self, event: Dict) -> None:
+        self._buffer.append(event)
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def tick(self) -> None:
+        if self._buffer and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._buffer:
+            self._write_batch(self._buffer)
+            self._buffer = []
+        self._last_flush = time.monotonic()
+
+    def _write_batch(self, events: List[Dict]) -> None:
+        raise NotImplementedError
+
+
+class CSVSink(BufferedSink):
+    """
+    Append the events to a CSV file with the columns visualization.read_events reads.
+    """
+
+    def __init__(self, path: str, fieldnames: Sequence[str] = ('car_id', 'timestamp', 'state'), append: bool = True, **kwargs):
+        """
+        Parameters:
+            path (str): The CSV file. A new or overwritten file starts with a header.
+            fieldnames (Sequence[str], optional): The columns. Defaults to car_id, timestamp and state.
+            append (bool, optional): Whether to append to an existing file instead of overwriting it. Defaults to True.
+        """
+        super().__init__(**kwargs)
+        write_header = not append or not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, 'a' if append else 'w', newline='')
+        self._writer = csv.DictWriter(self._file, fieldnames=list(fieldnames), extrasaction='ignore')
+        if write_header:
+            self._writer.writeheader()
+            self._file.flush()
+
+    def _write_batch(self, events: List[Dict]) -> None:
+        self._writer.writerows(events)
+        self._file.flush()
+
+    def close(self) -> None:
+        super().close()
+        self._file.close()
+
+
+class JSONLSink(BufferedSink):
+    """
+    Append the events to a file with one JSON object per line.
+    """
+
+    def __init__(self, path: str, append: bool = True, **kwargs):
+        super().__init__(**kwargs)
+        self._file = open(path, 'a' if append else 'w')
+
+    def _write_batch(self, events: List[Dict]) -> None:
+        self._file.write(''.join(json.dumps(event) + '\n' for event in events))
+        self._file.flush()
+
+    def close(self) -> None:
+        super().close()
+        self._file.close()
+
+
+class SQLiteSink(BufferedSink):
+    """
+    Append the events to a table of a SQLite database, one transaction per batch.
+    """
+
+    def __init__(self, path: str, table: str = 'crossings', append: bool = True, **kwargs):
+        """
+        Parameters:
+            path (str): The database file, created if it doesn't exist.
+            table (str, optional): The table, created if it doesn't exist. Defaults to 'crossings'.
+            append (bool, optional): Whether to keep the rows already in the table. Defaults to True.
+        """
+        super().__init__(**kwargs)
+        # The connection may be used from the pipeline thread that counts, not only the one that created it
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute(
+            f'CREATE TABLE IF NOT EXISTS {table} (car_id INTEGER, timestamp TEXT, state TEXT, camera TEXT)')
+        if not append:
+            self._connection.execute(f'DELETE FROM {table}')
+        self._connection.commit()
+        self._insert = f'INSERT INTO {table} (car_id, timestamp, state, camera) VALUES (?, ?, ?, ?)'
+
+    def _write_batch(self, events: List[Dict]) -> None:
+        with self._connection:
+            self._connection.executemany(
+                self._insert, [(event['car_id'], event['timestamp'], event['state'], event.get('camera')) for event in events])
+
+    def close(self) -> None:
+        super().close()
+        self._connection.close()
+
+
+def create_sink(path: str, **kwargs) -> EventSink:
+    """
+    Create the sink for a file by its extension: .csv, .jsonl or .db / .sqlite.
+
+    Parameters:
+        path (str): The file to stream the events to.
+        **kwargs: Passed on to the sink, e.g. append, batch_size and flush_interval.
+
+    Returns:
+        EventSink: The sink.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        return CSVSink(path, **kwargs)
+    if extension in ('.jsonl', '.ndjson'):
+        return JSONLSink(path, **kwargs)
+    if extension in ('.db', '.sqlite', '.sqlite3'):
+        return SQLiteSink(path, **kwargs)
+    raise ValueError(f"Unknown event file type: {path!r}, expected .csv, .jsonl or .db")
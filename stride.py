@@ -0,0 +1,123 @@
+import math
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from zones import CountingLine
+
+
+class AdaptiveStride:
+    """
+    Decide on which frames to run detection, so quiet scenes cost a fraction of the compute.
+
+    After every detection the stride, the number of frames until the next one, is chosen from
+    the tracks just seen and the tracks lost recently. It drops back to 1 as soon as any part of
+    a vehicle's box could reach a counting line before the next detection, and grows by one frame
+    per detection otherwise, up to max_stride. A track moves at the fastest speed it was measured
+    at, tracks seen for the first time are assumed to move at max_speed, and a lost track keeps
+    moving from where it was last seen for memory frames, since it may reappear on the other side
+    of a line. No frame is skipped while the tracker still has to confirm a new track. A crossing
+    that happens between two detections is still found by the crossing test over the whole motion
+    and dated by LineCrossingCounter's fraction, see crossing_offset.
+    """
+
+    def __init__(self, lines: Sequence[CountingLine], max_stride: int = 4, margin: float = 16.0, max_speed: float = 12.0,
+                 memory: int = 30):
+        """
+        Parameters:
+            lines (Sequence[CountingLine]): The segments the counts depend on.
+            max_stride (int, optional): The most frames between two detections. Defaults to 4.
+            margin (float, optional): The distance in pixels a box must stay away from every line, on top of the
+                distance it can travel before the next detection. Defaults to 16.
+            max_speed (float, optional): The speed in pixels per frame assumed for new tracks. Defaults to 12.
+            memory (int, optional): The number of frames a lost track is still expected to reappear, like
+                ByteTracker's track_buffer. Defaults to 30.
+        """
+        self.max_stride = max_stride
+        self.margin = margin
+        self.max_speed = max_speed
+        self.memory = memory
+        self._starts = np.array([line.start for line in lines], dtype=np.float64).reshape(-1, 2)
+        self._ends = np.array([line.end for line in lines], dtype=np.float64).reshape(-1, 2)
+        self.stride = 1
+        self.gap = 0  # Frames since the last detection
+        self.detections = 0
+        self.frames = 0
+        self._frame = 0  # The frame of the last detection
+        # The center, radius, fastest measured speed (None before the second sighting) and frame of every track last seen
+        self._tracks: Dict[int, Tuple[Tuple[float, float], float, Optional[float], int]] = {}
+
+    def should_detect(self) -> bool:
+        """
+        Advance one frame and return whether to run detection on it.
+        """
+        self.frames += 1
+        self.gap += 1
+        return self.gap >= self.stride
+
+    def observe(self, track_ids: Optional[List[int]], boxes, tentative: bool = False) -> int:
+        """
+        Take the tracks of a detected frame and choose the stride until the next detection.
+
+        Parameters:
+            track_ids (List[int]): The track IDs, or None if there are no tracks.
+            boxes: The boxes in xywh format.
+            tentative (bool, optional): Whether the tracker waits to confirm new tracks on the next frame,
+                which then must not be skipped. Defaults to False.
+
+        Returns:
+            int: The number of frames since the previous detection, 1 if none was skipped.
+        """
+        gap, self.gap = max(self.gap, 1), 0
+        self.detections += 1
+        self._frame += gap
+
+        for track_id, (x, y, width, height) in zip(track_ids or [], np.asarray(boxes, dtype=np.float64).reshape(-1, 4).tolist()):
+            last = self._tracks.get(track_id)
+            speed = None
+            if last is not None:
+                speed = math.dist(last[0], (x, y)) / (self._frame - last[3])
+                speed = speed if last[2] is None else max(speed, last[2])
+            self._tracks[track_id] = ((x, y), math.hypot(width, height) / 2, speed, self._frame)
+        self._tracks = {track_id: track for track_id, track in self._tracks.items() if self._frame - track[3] <= self.memory}
+
+        # Grow the stride only if no box, seen now or lost recently, can come within the margin of a line before the
+        # detection after it
+        stride = min(self.stride + 1, self.max_stride)
+        self.stride = 1 if tentative or self._can_reach_line(stride) else stride
+        return gap
+
+    def _can_reach_line(self, stride: int) -> bool:
+        if not self._tracks or not len(self._starts):
+            return False
+        centers, radius, speeds, frames = zip(*self._tracks.values())
+        speeds = np.array([self.max_speed if speed is None else speed for speed in speeds])
+        elapsed = self._frame - np.array(frames) + stride
+        reach = self.margin + np.array(radius) + speeds * elapsed
+        return bool(np.any(self.distances(np.array(centers)).min(axis=1) <= reach))
+
+    def distances(self, points: np.ndarray) -> np.ndarray:
+        """
+        Return the distance of every point to every line, shape (N, lines).
+        """
+        direction = self._ends - self._starts
+        length = np.maximum(np.einsum('ij,ij->i', direction, direction), 1e-12)
+        offset = points[:, None, :] - self._starts[None, :, :]
+        t = np.clip(np.einsum('nij,ij->ni', offset, direction) / length, 0.0, 1.0)
+        closest = self._starts[None, :, :] + t[..., None] * direction[None, :, :]
+        return np.linalg.norm(points[:, None, :] - closest, axis=2)
+
+
+def crossing_offset(fraction: float, gap: int) -> int:
+    """
+    Return how many frames before the detected frame a crossing happened.
+
+    The crossing is dated to the first frame whose center would have been on or past the line if
+    the track moved linearly between the two detections, which is the detected frame itself
+    when no frame was skipped.
+
+    Parameters:
+        fraction (float): CrossingEvent.fraction, where along the motion the line was reached.
+        gap (int): The number of frames between the two detections.
+    """
+    return gap - max(1, math.ceil(fraction * gap - 1e-9))
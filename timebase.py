@@ -0,0 +1,66 @@
+import math
+from datetime import datetime, timedelta
+from typing import Optional
+
+import cv2
+
+DEFAULT_FPS = 30.0
+
+
+def source_fps(cap: cv2.VideoCapture, default: float = DEFAULT_FPS) -> float:
+    """
+    Return the frame rate the source reports, or default if it reports none or nonsense, as some streams do.
+    """
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    if not math.isfinite(fps) or fps <= 0 or fps > 1000:
+        return default
+    return fps
+
+
+def parse_start_time(value: Optional[str]) -> datetime:
+    """
+    Parse config.video_start_time, e.g. '2024-02-19 13:50:00'. None means now, for live feeds.
+    """
+    if value is None:
+        return datetime.now()
+    return datetime.fromisoformat(value)
+
+
+class FrameClock:
+    """
+    Date every decoded frame by its presentation timestamp in the container.
+
+    The timestamp CAP_PROP_POS_MSEC reports after a read is added to a wall-clock origin, so
+    frames the source dropped leave a gap in time instead of shifting everything after them, and
+    a video that was opened at a later position keeps its absolute times. Sources without usable
+    timestamps, e.g. some live streams that report 0 or jump backwards, fall back to one frame
+    period after the previous frame.
+    """
+
+    def __init__(self, origin: datetime, fps: float = DEFAULT_FPS, use_pts: bool = True, first_frame: int = 0):
+        """
+        Parameters:
+            origin (datetime): The wall-clock time of the start of the video.
+            fps (float, optional): The source frame rate, see source_fps. Defaults to 30.
+            use_pts (bool, optional): Whether to read the container timestamps. False dates frames by
+                their index and the frame rate only. Defaults to True.
+            first_frame (int, optional): The index of the first frame that will be read, when the video was
+                opened at a later position. Defaults to 0.
+        """
+        self.origin = origin
+        self.fps = fps
+        self.use_pts = use_pts
+        self.time_per_frame = timedelta(seconds=1 / fps)
+        self.first_frame = first_frame
+        self._last: Optional[float] = None  # Milliseconds since the origin of the previous frame
+
+    def timestamp(self, cap: cv2.VideoCapture) -> datetime:
+        """
+        Return the time of the frame just read from cap.
+        """
+        msec = cap.get(cv2.CAP_PROP_POS_MSEC) if self.use_pts else None
+        step = 1000 / self.fps
+        if msec is None or not math.isfinite(msec) or (self._last is not None and msec <= self._last):
+            msec = self.first_frame * step if self._last is None else self._last + step
+        self._last = msec
+        return self.origin + timedelta(milliseconds=msec)
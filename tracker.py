@@ -0,0 +1,381 @@
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+
+class KalmanFilterXYAH:
+    """
+    A constant-velocity Kalman filter on (center x, center y, aspect ratio, height) boxes, as used by ByteTrack.
+
+    The state is the box and its velocity, eight values per track. Uncertainties scale with the box height.
+    """
+
+    std_weight_position = 1.0 / 20
+    std_weight_velocity = 1.0 / 160
+
+    def __init__(self):
+        self.motion_mat = np.eye(8)
+        self.motion_mat[:4, 4:] = np.eye(4)
+        self.update_mat = np.eye(4, 8)
+
+    def initiate(self, measurement: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Create a track state from an unassociated measurement.
+
+        Parameters:
+            measurement (np.ndarray): The (x, y, a, h) box.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The mean (8,) and covariance (8, 8) of the new state.
+        """
+        mean = np.concatenate([measurement, np.zeros(4)])
+        h = measurement[3]
+        std = np.array([
+            2 * self.std_weight_position * h, 2 * self.std_weight_position * h, 1e-2, 2 * self.std_weight_position * h,
+            10 * self.std_weight_velocity * h, 10 * self.std_weight_velocity * h, 1e-5, 10 * self.std_weight_velocity * h])
+        return mean, np.diag(np.square(std))
+
+    def multi_predict(self, means: np.ndarray, covariances: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Run the prediction step for several tracks at once.
+
+        Parameters:
+            means (np.ndarray): The state means, shape (N, 8).
+            covariances (np.ndarray): The state covariances, shape (N, 8, 8).
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The predicted means and covariances.
+        """
+        h = means[:, 3]
+        std = np.stack([
+            self.std_weight_position * h, self.std_weight_position * h, np.full_like(h, 1e-2), self.std_weight_position * h,
+            self.std_weight_velocity * h, self.std_weight_velocity * h, np.full_like(h, 1e-5), self.std_weight_velocity * h], axis=1)
+        motion_cov = np.zeros_like(covariances)
+        motion_cov[:, np.arange(8), np.arange(8)] = np.square(std)
+
+        means = means @ self.motion_mat.T
+        covariances = self.motion_mat @ covariances @ self.motion_mat.T + motion_cov
+        return means, covariances
+
+    def update(self, mean: np.ndarray, covariance: np.ndarray, measurement: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Run the correction step with an associated measurement.
+
+        Parameters:
+            mean (np.ndarray): The predicted state mean (8,).
+            covariance (np.ndarray): The predicted state covariance (8, 8).
+            measurement (np.ndarray): The associated (x, y, a, h) box.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The corrected mean and covariance.
+        """
+        h = mean[3]
+        std = np.array([self.std_weight_position * h, self.std_weight_position * h, 1e-1, self.std_weight_position * h])
+        projected_mean = self.update_mat @ mean
+        projected_cov = self.update_mat @ covariance @ self.update_mat.T + np.diag(np.square(std))
+
+        kalman_gain = np.linalg.solve(projected_cov, (covariance @ self.update_mat.T).T).T
+        mean = mean + (measurement - projected_mean) @ kalman_gain.T
+        covariance = covariance - kalman_gain @ projected_cov @ kalman_gain.T
+        return mean, covariance
+
+
+# Track states
+TRACKED, LOST, REMOVED = 1, 2, 3
+
+
+class Track:
+    """
+    A single track of the ByteTracker.
+
+    Attributes:
+        track_id (int): The ID of the track, 0 until the track is activated.
+        mean (np.ndarray): The Kalman state mean.
+        covariance (np.ndarray): The Kalman state covariance.
+        score (float): The score of the last associated detection.
+        class_id (int): The class of the last associated detection.
+        state (int): TRACKED, LOST or REMOVED.
+        is_activated (bool): Whether the track has been confirmed and is reported.
+        frame_id (int): The last frame the track was associated with a detection.
+    """
+    __slots__ = ('track_id', 'mean', 'covariance', 'score', 'class_id', 'state', 'is_activated', 'frame_id', 'measurement')
+
+    def __init__(self, xyxy: np.ndarray, score: float, class_id: int):
+        self.track_id = 0
+        self.mean = None
+        self.covariance = None
+        self.score = score
+        self.class_id = class_id
+        self.state = TRACKED
+        self.is_activated = False
+        self.frame_id = 0
+        self.measurement = xyxy_to_xyah(xyxy)
+
+    @property
+    def xyxy(self) -> np.ndarray:
+        """The current box in (x1, y1, x2, y2) format, from the filter state once the track is running."""
+        x, y, a, h = self.mean[:4] if self.mean is not None else self.measurement
+        w = a * h
+        return np.array([x - w / 2, y - h / 2, x + w / 2, y + h / 2])
+
+
+class ByteTracker:
+    """
+    A standalone ByteTrack-style multi-object tracker consuming raw boxes, scores and class IDs.
+
+    High-score detections are associated with all tracks first, then low-score detections with the
+    tracks that are still unmatched, which keeps occluded vehicles alive instead of starting new IDs.
+    The defaults follow ultralytics' bytetrack.yaml. Association is a greedy lowest-cost matching,
+    so no assignment solver is needed on CPU-only nodes.
+    """
+
+    def __init__(
+            self,
+            track_high_thresh: float = 0.5,
+            track_low_thresh: float = 0.1,
+            new_track_thresh: float = 0.6,
+            track_buffer: int = 30,
+            match_thresh: float = 0.8,
+            frame_rate: float = 30):
+        """
+        Parameters:
+            track_high_thresh (float, optional): The score from which detections enter the first association. Defaults to 0.5.
+            track_low_thresh (float, optional): The score above which detections enter the second association. Defaults to 0.1.
+            new_track_thresh (float, optional): The score a detection needs to start a new track. Defaults to 0.6.
+            track_buffer (int, optional): The number of frames a lost track is kept at 30 FPS. Defaults to 30.
+            match_thresh (float, optional): The maximum cost of a first-association match. Defaults to 0.8.
+            frame_rate (float, optional): The frame rate of the source, scales the buffer. Defaults to 30.
+        """
+        self.track_high_thresh = track_high_thresh
+        self.track_low_thresh = track_low_thresh
+        self.new_track_thresh = new_track_thresh
+        self.match_thresh = match_thresh
+        self.track_buffer = track_buffer
+        self.set_frame_rate(frame_rate)
+        self.kalman_filter = KalmanFilterXYAH()
+        self.reset()
+
+    def set_frame_rate(self, frame_rate: float) -> None:
+        """
+        Scale the number of frames a lost track is kept to the frame rate of the source.
+        """
+        self.max_time_lost = int(frame_rate / 30.0 * self.track_buffer)
+
+    def reset(self) -> None:
+        """
+        Forget all tracks and restart the IDs at 1.
+        """
+        self.tracked: List[Track] = []
+        self.lost: List[Track] = []
+        self.frame_id = 0
+        self.next_id = 1
+
+    @property
+    def has_tentative_tracks(self) -> bool:
+        """Whether a new track waits for its second detection before it is reported."""
+        return any(not track.is_activated for track in self.tracked)
+
+    def update(self, boxes: np.ndarray, scores: np.ndarray, class_ids: np.ndarray,
+               frames: int = 1) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Associate the detections of a new frame with the existing tracks.
+
+        Parameters:
+            boxes (np.ndarray): The detected boxes in (x1, y1, x2, y2) format, shape (N, 4).
+            scores (np.ndarray): The detection scores, shape (N,).
+            class_ids (np.ndarray): The detected class IDs, shape (N,).
+            frames (int, optional): The number of frames since the previous update, above 1 when frames were
+                skipped without detection. The tracks are predicted that many steps ahead. Defaults to 1.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]: The boxes in (x1, y1, x2, y2) format, track IDs,
+                scores and class IDs of the active tracks.
+        """
+        self.frame_id += frames
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        scores = np.asarray(scores, dtype=np.float64).reshape(-1)
+        class_ids = np.asarray(class_ids).reshape(-1)
+
+        high = scores >= self.track_high_thresh
+        low = (scores > self.track_low_thresh) & (scores < self.track_high_thresh)
+        detections = [Track(box, score, class_id) for box, score, class_id in zip(boxes[high], scores[high], class_ids[high])]
+        detections_low = [Track(box, score, class_id) for box, score, class_id in zip(boxes[low], scores[low], class_ids[low])]
+
+        unconfirmed = [track for track in self.tracked if not track.is_activated]
+        confirmed = [track for track in self.tracked if track.is_activated]
+        pool = confirmed + self.lost
+        for _ in range(frames):
+            self._predict(pool)
+        activated, lost, removed = [], [], []
+
+        # First association: high-score detections with every confirmed or lost track
+        matches, unmatched_tracks, unmatched_detections = greedy_assignment(
+            fuse_score(iou_distance(pool, detections), detections), self.match_thresh)
+        for track_index, detection_index in matches:
+            self._update_track(pool[track_index], detections[detection_index])
+            activated.append(pool[track_index])
+
+        # Second association: low-score detections with the tracks that were tracked in the previous frame
+        remaining = [pool[i] for i in unmatched_tracks if pool[i].state == TRACKED]
+        matches, unmatched_remaining, _ = greedy_assignment(iou_distance(remaining, detections_low), 0.5)
+        for track_index, detection_index in matches:
+            self._update_track(remaining[track_index], detections_low[detection_index])
+            activated.append(remaining[track_index])
+        for track_index in unmatched_remaining:
+            remaining[track_index].state = LOST
+            lost.append(remaining[track_index])
+
+        # Tracks started in the previous frame are confirmed by a second high-score detection
+        detections = [detections[i] for i in unmatched_detections]
+        matches, unmatched_unconfirmed, unmatched_detections = greedy_assignment(
+            fuse_score(iou_distance(unconfirmed, detections), detections), 0.7)
+        for track_index, detection_index in matches:
+            self._update_track(unconfirmed[track_index], detections[detection_index])
+            activated.append(unconfirmed[track_index])
+        for track_index in unmatched_unconfirmed:
+            unconfirmed[track_index].state = REMOVED
+            removed.append(unconfirmed[track_index])
+
+        # Start new tracks from confident detections nobody claimed
+        for detection_index in unmatched_detections:
+            track = detections[detection_index]
+            if track.score < self.new_track_thresh:
+                continue
+            track.track_id = self.next_id
+            self.next_id += 1
+            track.mean, track.covariance = self.kalman_filter.initiate(track.measurement)
+            track.frame_id = self.frame_id
+            # Only tracks of the very first frame are reported before being confirmed
+            track.is_activated = self.frame_id == 1
+            activated.append(track)
+
+        # Drop lost tracks that have not been seen for too long
+        for track in self.lost:
+            if track.state == LOST and self.frame_id - track.frame_id > self.max_time_lost:
+                track.state = REMOVED
+
+        self.tracked = [track for track in self.tracked if track.state == TRACKED]
+        self.tracked += [track for track in activated if track not in self.tracked]
+        self.lost = [track for track in self.lost + lost if track.state == LOST]
+        self.tracked, self.lost = remove_duplicates(self.tracked, self.lost)
+
+        output = [track for track in self.tracked if track.is_activated]
+        return (
+            np.array([track.xyxy for track in output]).reshape(-1, 4),
+            np.array([track.track_id for track in output], dtype=np.int64),
+            np.array([track.score for track in output]),
+            np.array([track.class_id for track in output]))
+
+    def _predict(self, tracks: List[Track]) -> None:
+        if not tracks:
+            return
+        means = np.stack([track.mean for track in tracks])
+        covariances = np.stack([track.covariance for track in tracks])
+        # A lost track's height is kept but its height velocity is stopped
+        for i, track in enumerate(tracks):
+            if track.state != TRACKED:
+                means[i, 7] = 0
+        means, covariances = self.kalman_filter.multi_predict(means, covariances)
+        for track, mean, covariance in zip(tracks, means, covariances):
+            track.mean, track.covariance = mean, covariance
+
+    def _update_track(self, track: Track, detection: Track) -> None:
+        track.mean, track.covariance = self.kalman_filter.update(track.mean, track.covariance, detection.measurement)
+        track.score = detection.score
+        track.class_id = detection.class_id
+        track.frame_id = self.frame_id
+        track.state = TRACKED
+        track.is_activated = True
+
+
+def xyxy_to_xyah(box: np.ndarray) -> np.ndarray:
+    """
+    Convert an (x1, y1, x2, y2) box to (center x, center y, aspect ratio, height).
+    """
+    w, h = box[2] - box[0], box[3] - box[1]
+    return np.array([box[0] + w / 2, box[1] + h / 2, w / h if h > 0 else 0.0, h])
+
+
+def box_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    Compute the IoU matrix between two sets of (x1, y1, x2, y2) boxes.
+
+    Parameters:
+        a (np.ndarray): The first boxes, shape (N, 4).
+        b (np.ndarray): The second boxes, shape (M, 4).
+
+    Returns:
+        np.ndarray: The IoUs, shape (N, M).
+    """
+    width = np.clip(np.minimum(a[:, None, 2], b[None, :, 2]) - np.maximum(a[:, None, 0], b[None, :, 0]), 0, None)
+    height = np.clip(np.minimum(a[:, None, 3], b[None, :, 3]) - np.maximum(a[:, None, 1], b[None, :, 1]), 0, None)
+    intersection = width * height
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return intersection / np.maximum(area_a[:, None] + area_b[None, :] - intersection, 1e-9)
+
+
+def iou_distance(tracks: Sequence[Track], detections: Sequence[Track]) -> np.ndarray:
+    """
+    Return 1 - IoU between the current boxes of tracks and detections.
+    """
+    if not tracks or not detections:
+        return np.zeros((len(tracks), len(detections)))
+    return 1 - box_iou(np.stack([track.xyxy for track in tracks]), np.stack([detection.xyxy for detection in detections]))
+
+
+def fuse_score(cost: np.ndarray, detections: Sequence[Track]) -> np.ndarray:
+    """
+    Weight the IoU similarity by the detection scores, so confident detections are matched first.
+    """
+    if cost.size == 0:
+        return cost
+    scores = np.array([detection.score for detection in detections])
+    return 1 - (1 - cost) * scores[None, :]
+
+
+def greedy_assignment(cost: np.ndarray, thresh: float) -> Tuple[List[Tuple[int, int]], List[int], List[int]]:
+    """
+    Match rows to columns by taking the cheapest remaining pair until the cost exceeds the threshold.
+
+    Parameters:
+        cost (np.ndarray): The cost matrix, shape (N, M).
+        thresh (float): The maximum cost of a match.
+
+    Returns:
+        Tuple[List[Tuple[int, int]], List[int], List[int]]: The matched (row, column) pairs, and the unmatched rows and columns.
+    """
+    rows, columns = cost.shape
+    matches = []
+    if cost.size:
+        row_used = np.zeros(rows, dtype=bool)
+        column_used = np.zeros(columns, dtype=bool)
+        candidates = np.argsort(cost, axis=None, kind='stable')
+        for flat in candidates[cost.ravel()[candidates] <= thresh].tolist():
+            row, column = divmod(flat, columns)
+            if not row_used[row] and not column_used[column]:
+                row_used[row] = column_used[column] = True
+                matches.append((row, column))
+    matched_rows = {row for row, _ in matches}
+    matched_columns = {column for _, column in matches}
+    return (matches,
+            [row for row in range(rows) if row not in matched_rows],
+            [column for column in range(columns) if column not in matched_columns])
+
+
+def remove_duplicates(tracked: List[Track], lost: List[Track]) -> Tuple[List[Track], List[Track]]:
+    """
+    Drop the shorter-lived of every tracked/lost pair that overlap almost completely.
+    """
+    if not tracked or not lost:
+        return tracked, lost
+    pairs = np.argwhere(iou_distance(tracked, lost) < 0.15)
+    drop_tracked, drop_lost = set(), set()
+    for i, j in pairs.tolist():
+        # The track that was started earlier keeps its ID
+        if tracked[i].track_id <= lost[j].track_id:
+            drop_lost.add(j)
+        else:
+            drop_tracked.add(i)
+    return ([track for i, track in enumerate(tracked) if i not in drop_tracked],
+            [track for j, track in enumerate(lost) if j not in drop_lost])
@@ -1,7 +1,7 @@
 import cv2
 
 
-def initialize_video_writer(export_path: str, frame_width: int, frame_height: int) -> cv2.VideoWriter:
+def initialize_video_writer(export_path: str, frame_width: int, frame_height: int, frame_rate: float = 30.0) -> cv2.VideoWriter:
     """
     Initialize and return a video writer object.
 
@@ -9,10 +9,10 @@ def initialize_video_writer(export_path: str, frame_width: int, frame_height: in
         export_path (str): The path where the video will be saved.
         frame_width (int): The width of the video frames.
         frame_height (int): The height of the video frames.
+        frame_rate (float, optional): The frame rate of the source, so the video plays at its real speed. Defaults to 30.
 
     Returns:
         cv2.VideoWriter: The initialized video writer.
     """
     fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    frame_rate = 30
     return cv2.VideoWriter(export_path, fourcc, frame_rate, (frame_width, frame_height))
@@ -1,8 +1,14 @@
-from typing import List, Dict
+import json
+import os
+import sqlite3
+from typing import Dict, Iterator, List, Optional, Tuple
 
 import pandas as pd
-import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
+from matplotlib.figure import Figure
+
+# The format inference.count_crossings writes the timestamps in
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
 
 
 def save_to_csv(state_changes: List[Dict], export_path: str) -> None:
@@ -17,56 +23,151 @@ def save_to_csv(state_changes: List[Dict], export_path: str) -> None:
     df.to_csv(export_path, index=False)
 
 
-def visualize_data(csv_path: str, save: bool = False) -> None:
+def read_events(path: str, chunksize: int = 1_000_000) -> Iterator[pd.DataFrame]:
     """
-    Generate visualizations for the car tracking and counting data.
+    Read the timestamp and state columns of an event file in chunks, so memory stays flat for any number of events.
 
     Parameters:
-        csv_path (str): The path to the CSV file containing the car tracking and counting data.
-        save (bool): Whether to save the plots. Default is False.
-        save_path (str): The path to save the plots. Required if save is True.
+        path (str): A .csv, .jsonl or SQLite .db file as written by sinks.create_sink.
+        chunksize (int, optional): The most events per chunk. Defaults to 1,000,000.
+
+    Returns:
+        Iterator[pd.DataFrame]: The chunks, with the timestamps still as strings.
     """
-    # Load the data
-    df = pd.read_csv(csv_path)
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        yield from pd.read_csv(path, usecols=['timestamp', 'state'], dtype=str, chunksize=chunksize)
+    elif extension in ('.jsonl', '.ndjson'):
+        with open(path) as file:
+            rows = []
+            for line in file:
+                if line.strip():
+                    event = json.loads(line)
+                    rows.append((event['timestamp'], event['state']))
+                if len(rows) >= chunksize:
+                    yield pd.DataFrame(rows, columns=['timestamp', 'state'])
+                    rows = []
+            if rows:
+                yield pd.DataFrame(rows, columns=['timestamp', 'state'])
+    elif extension in ('.db', '.sqlite', '.sqlite3'):
+        with sqlite3.connect(path) as connection:
+            yield from pd.read_sql_query('SELECT timestamp, state FROM crossings', connection, chunksize=chunksize)
+    else:
+        raise ValueError(f"Unknown event file type: {path!r}, expected .csv, .jsonl or .db")
 
-    # Convert 'timestamp' to datetime format for easier manipulation
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
 
-    # Visualizing the number of cars passing in each direction over time
-    plt.figure(figsize=(10, 6))
+class CountAggregator:
+    """
+    Count the events per direction in fixed time buckets, one chunk of events at a time.
+
+    Only the counts are kept, one row per bucket that saw an event, so a day of traffic
+    aggregates into a table of a few thousand rows whatever the number of events.
+    """
 
-    # Ensure the plot displays time in seconds
-    locator = mdates.SecondLocator()
-    formatter = mdates.DateFormatter('%H:%M:%S')
+    def __init__(self, bucket: str = '1min'):
+        """
+        Parameters:
+            bucket (str, optional): The bucket length as a pandas frequency, e.g. '1s', '1min' or '15min'. Defaults to '1min'.
+        """
+        self.bucket = bucket
+        self._counts: Optional[pd.Series] = None  # Indexed by (bucket, state)
 
-    for direction in df['state'].unique():
-        # Filter data for each direction
-        direction_data = df[df['state'] == direction]
+    def add(self, events: pd.DataFrame) -> None:
+        """
+        Add a chunk of events with 'timestamp' (strings or datetimes) and 'state' columns.
+        """
+        timestamps = pd.to_datetime(events['timestamp'], format=TIMESTAMP_FORMAT)
+        counts = events.groupby([timestamps.dt.floor(self.bucket), events['state']]).size()
+        self._counts = counts if self._counts is None else self._counts.add(counts, fill_value=0).astype('int64')
 
-        # Plot each timestamp directly without resampling
-        plt.scatter(direction_data['timestamp'], direction_data['state'].apply(lambda x: direction), label=direction, alpha=0.6)
+    @property
+    def counts(self) -> pd.DataFrame:
+        """
+        The counts with one row per bucket, empty buckets included, and one column per direction.
+        """
+        if self._counts is None:
+            return pd.DataFrame(dtype='int64')
+        counts = self._counts.unstack(fill_value=0)
+        counts.index.name, counts.columns.name = 'timestamp', 'state'
+        return counts.asfreq(self.bucket, fill_value=0)
 
-    plt.gca().xaxis.set_major_locator(locator)
-    plt.gca().xaxis.set_major_formatter(formatter)
 
-    plt.title('Number of Cars Passing in Each Direction Over Time')
-    plt.xlabel('Time')
-    plt.ylabel('Direction')
-    plt.legend()
-    plt.xticks(rotation=45)
-    plt.tight_layout()
-    if save:
-        plt.savefig('./number_of_cars.png')
-    plt.show()
+def aggregate_events(path: str, bucket: str = '1min', chunksize: int = 1_000_000) -> pd.DataFrame:
+    """
+    Count the events of a file per direction and time bucket, see CountAggregator.
+
+    Parameters:
+        path (str): A .csv, .jsonl or SQLite .db event file.
+        bucket (str, optional): The bucket length as a pandas frequency. Defaults to '1min'.
+        chunksize (int, optional): The most events read at once. Defaults to 1,000,000.
+
+    Returns:
+        pd.DataFrame: The counts, indexed by the start of each bucket, with one column per direction.
+    """
+    aggregator = CountAggregator(bucket)
+    for chunk in read_events(path, chunksize=chunksize):
+        aggregator.add(chunk)
+    return aggregator.counts
+
+
+def plot_counts(counts: pd.DataFrame, bucket: str = '1min') -> Tuple[Figure, Figure]:
+    """
+    Plot the counts per bucket over time and the total count per direction.
+
+    The figures are built without pyplot, so no GUI backend or display is needed and nothing
+    blocks. Notebooks show the returned figures.
+
+    Parameters:
+        counts (pd.DataFrame): The counts, see aggregate_events.
+        bucket (str, optional): The bucket length the counts were aggregated with, for the axis label. Defaults to '1min'.
+
+    Returns:
+        Tuple[Figure, Figure]: The counts over time and the totals.
+    """
+    # Visualizing the number of cars passing in each direction over time
+    over_time = Figure(figsize=(10, 6))
+    ax = over_time.subplots()
+    for direction in counts.columns:
+        ax.step(counts.index, counts[direction], where='post', label=direction)
+    locator = mdates.AutoDateLocator()
+    ax.xaxis.set_major_locator(locator)
+    ax.xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
+    ax.set_title('Number of Cars Passing in Each Direction Over Time')
+    ax.set_xlabel('Time')
+    ax.set_ylabel(f'Cars per {bucket}')
+    if len(counts.columns):
+        ax.legend()
+    over_time.tight_layout()
 
     # Visualizing the total count of cars in each direction
-    plt.figure(figsize=(8, 5))
-    df['state'].value_counts().plot(kind='bar')
-    plt.title('Total Count of Cars in Each Direction')
-    plt.xlabel('Direction')
-    plt.ylabel('Count')
-    plt.xticks(rotation=0)
-    plt.tight_layout()
+    totals = Figure(figsize=(8, 5))
+    ax = totals.subplots()
+    total = counts.sum()
+    ax.bar(total.index.astype(str), total.values)
+    ax.set_title('Total Count of Cars in Each Direction')
+    ax.set_xlabel('Direction')
+    ax.set_ylabel('Count')
+    totals.tight_layout()
+    return over_time, totals
+
+
+def visualize_data(csv_path: str, save: bool = False, bucket: str = '1min', chunksize: int = 1_000_000) -> Tuple[Figure, Figure]:
+    """
+    Generate visualizations for the car tracking and counting data.
+
+    Parameters:
+        csv_path (str): The path to the event file (.csv, .jsonl or SQLite .db) containing the car tracking and counting data.
+        save (bool): Whether to save the plots to number_of_cars.png and total_count_of_cars.png. Default is False.
+        bucket (str): The time bucket the cars are counted in, a pandas frequency such as '1s', '1min' or '15min'.
+            Default is '1min'.
+        chunksize (int): The most events read at once. Default is 1,000,000.
+
+    Returns:
+        Tuple[Figure, Figure]: The counts over time and the totals.
+    """
+    counts = aggregate_events(csv_path, bucket=bucket, chunksize=chunksize)
+    over_time, totals = plot_counts(counts, bucket=bucket)
     if save:
-        plt.savefig('./total_count_of_cars.png')
-    plt.show()
+        over_time.savefig('./number_of_cars.png')
+        totals.savefig('./total_count_of_cars.png')
+    return over_time, totals
@@ -0,0 +1,209 @@
+import json
+from typing import Dict, List, NamedTuple, Sequence, Tuple
+
+import numpy as np
+
+
+class CountingLine(NamedTuple):
+    """
+    A counting segment between two points.
+
+    The side of a point is the sign of the cross product (end - start) x (point - start). In image
+    coordinates (y pointing down) the positive side is on the right-hand side when walking from
+    start to end, so a line drawn left to right has its positive side below it.
+
+    Attributes:
+        start (Tuple[float, float]): The (x, y) start point of the segment.
+        end (Tuple[float, float]): The (x, y) end point of the segment.
+        directions (Tuple[str, str]): The direction names for crossing to the left-hand and to the right-hand side.
+        color (Tuple[int, int, int]): The BGR color used when drawing the line and boxes that crossed it.
+        name (str): The name of the line.
+    """
+    start: Tuple[float, float]
+    end: Tuple[float, float]
+    directions: Tuple[str, str]
+    color: Tuple[int, int, int] = (255, 0, 0)
+    name: str = ''
+
+
+class PolygonZone(NamedTuple):
+    """
+    A closed polygon zone, counted when a track crosses its boundary.
+
+    Attributes:
+        points (Sequence[Tuple[float, float]]): The (x, y) vertices of the polygon, in either winding order.
+        directions (Tuple[str, str]): The direction names for leaving and for entering the zone.
+        color (Tuple[int, int, int]): The BGR color used when drawing the zone and boxes that crossed it.
+        name (str): The name of the zone.
+    """
+    points: Sequence[Tuple[float, float]]
+    directions: Tuple[str, str]
+    color: Tuple[int, int, int] = (0, 0, 255)
+    name: str = ''
+
+
+def load_zones(path: str) -> List:
+    """
+    Load counting lines and polygon zones from a JSON file.
+
+    The file holds a "lines" and a "polygons" list, for example::
+
+        {
+            "lines": [
+                {"name": "north", "start": [0, 240], "end": [640, 240], "directions": ["UP", "DOWN"], "color": [0, 255, 0]}
+            ],
+            "polygons": [
+                {"name": "lot", "points": [[420, 20], [620, 20], [620, 200], [420, 200]]}
+            ]
+        }
+
+    Colors are optional. Polygon directions default to "<NAME>_EXIT" and "<NAME>_ENTER".
+
+    Parameters:
+        path (str): The path to the JSON file.
+
+    Returns:
+        List: The CountingLine and PolygonZone definitions, lines first, in file order.
+    """
+    with open(path) as f:
+        definition = json.load(f)
+
+    zones = []
+    for i, line in enumerate(definition.get('lines', [])):
+        name = line.get('name', f'line_{i}')
+        zones.append(CountingLine(
+            start=tuple(line['start']),
+            end=tuple(line['end']),
+            directions=tuple(line['directions']),
+            color=tuple(line.get('color', (255, 0, 0))),
+            name=name))
+    for i, polygon in enumerate(definition.get('polygons', [])):
+        name = polygon.get('name', f'zone_{i}')
+        zones.append(PolygonZone(
+            points=[tuple(point) for point in polygon['points']],
+            directions=tuple(polygon.get('directions', (f'{name.upper()}_EXIT', f'{name.upper()}_ENTER'))),
+            color=tuple(polygon.get('color', (0, 0, 255))),
+            name=name))
+    return zones
+
+
+def zone_segments(zones: Sequence) -> List[CountingLine]:
+    """
+    Expand polygon zones into their boundary segments.
+
+    Every edge of a polygon is oriented so that the inside of the polygon is on its right-hand side,
+    which makes entering the zone a crossing to the right-hand side of one of its edges.
+
+    Parameters:
+        zones (Sequence): The CountingLine and PolygonZone definitions.
+
+    Returns:
+        List[CountingLine]: The segments to count, in definition order.
+    """
+    segments = []
+    for zone in zones:
+        if isinstance(zone, CountingLine):
+            segments.append(zone)
+            continue
+        points = [tuple(point) for point in zone.points]
+        # With y pointing down a positive shoelace area means clockwise on screen, i.e. the inside is on the right
+        area = sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(points, points[1:] + points[:1]))
+        if area < 0:
+            points = points[::-1]
+        for start, end in zip(points, points[1:] + points[:1]):
+            segments.append(CountingLine(start, end, zone.directions, zone.color, zone.name))
+    return segments
+
+
+class SpatialGrid:
+    """
+    A uniform grid mapping each cell to the segments passing through it.
+
+    The grid is stored in compressed form: the segments of cell c are
+    segment_indices[offsets[c]:offsets[c + 1]], in ascending order.
+    """
+
+    def __init__(self, starts: np.ndarray, ends: np.ndarray, cell_size: float = 64):
+        """
+        Parameters:
+            starts (np.ndarray): The (x, y) start points of the segments, shape (S, 2).
+            ends (np.ndarray): The (x, y) end points of the segments, shape (S, 2).
+            cell_size (float, optional): The width and height of a grid cell in pixels. Defaults to 64.
+        """
+        self.cell_size = float(cell_size)
+        self.segment_count = len(starts)
+        lower = np.minimum(starts, ends)
+        upper = np.maximum(starts, ends)
+        self.origin = np.floor(lower.min(axis=0)) if len(starts) else np.zeros(2)
+        top = np.ceil(upper.max(axis=0)) if len(starts) else np.zeros(2)
+        self.shape = np.maximum(np.ceil((top - self.origin) / self.cell_size).astype(np.int64), 1)  # (columns, rows)
+
+        cells: Dict[int, List[int]] = {}
+        for index, (start, end, low, high) in enumerate(zip(starts, ends, lower, upper)):
+            x0, y0 = self.cell_of(low)
+            x1, y1 = self.cell_of(high)
+            for gy in range(y0, y1 + 1):
+                for gx in range(x0, x1 + 1):
+                    if self._touches_cell(start, end, gx, gy):
+                        cells.setdefault(gy * int(self.shape[0]) + gx, []).append(index)
+
+        counts = np.zeros(int(self.shape[0] * self.shape[1]), dtype=np.int64)
+        for cell, indices in cells.items():
+            counts[cell] = len(indices)
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+        self.segment_indices = np.zeros(int(self.offsets[-1]), dtype=np.int64)
+        for cell, indices in cells.items():
+            self.segment_indices[self.offsets[cell]:self.offsets[cell + 1]] = indices
+
+    def cell_of(self, point: np.ndarray) -> Tuple[int, int]:
+        """
+        Return the (column, row) of the cell containing a point, clamped to the grid.
+        """
+        cell = np.clip(np.floor((np.asarray(point) - self.origin) / self.cell_size), 0, self.shape - 1).astype(np.int64)
+        return int(cell[0]), int(cell[1])
+
+    def _touches_cell(self, start: np.ndarray, end: np.ndarray, gx: int, gy: int) -> bool:
+        # The segment's bounding box already overlaps the cell, so it touches the cell
+        # unless all four corners lie strictly on the same side of its supporting line
+        x0, y0 = self.origin + np.array([gx, gy]) * self.cell_size
+        corners = np.array([[x0, y0], [x0 + self.cell_size, y0], [x0, y0 + self.cell_size], [x0 + self.cell_size, y0 + self.cell_size]])
+        direction = end - start
+        sides = direction[0] * (corners[:, 1] - start[1]) - direction[1] * (corners[:, 0] - start[0])
+        return not (np.all(sides > 0) or np.all(sides < 0))
+
+    def candidates(self, lower: np.ndarray, upper: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the segments near each of a set of boxes, e.g. the bounding boxes of track motions.
+
+        Parameters:
+            lower (np.ndarray): The (x, y) lower corners of the boxes, shape (N, 2).
+            upper (np.ndarray): The (x, y) upper corners of the boxes, shape (N, 2).
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The box and segment index of every unique candidate pair,
+                sorted by box and then by segment.
+        """
+        empty = np.empty(0, dtype=np.int64)
+        if len(lower) == 0 or self.segment_count == 0:
+            return empty, empty
+        low = np.clip(np.floor((lower - self.origin) / self.cell_size), 0, self.shape - 1).astype(np.int64)
+        high = np.clip(np.floor((upper - self.origin) / self.cell_size), 0, self.shape - 1).astype(np.int64)
+        spans = high - low + 1
+
+        # Expand every box into the cells it covers; most motions stay within a single cell
+        cells_per_box = spans[:, 0] * spans[:, 1]
+        box_of_cell = np.repeat(np.arange(len(lower)), cells_per_box)
+        local = np.arange(len(box_of_cell)) - np.repeat(np.cumsum(cells_per_box) - cells_per_box, cells_per_box)
+        gx = low[box_of_cell, 0] + local % spans[box_of_cell, 0]
+        gy = low[box_of_cell, 1] + local // spans[box_of_cell, 0]
+        cells = gy * self.shape[0] + gx
+
+        # Expand every covered cell into the segments it holds
+        starts = self.offsets[cells]
+        segments_per_cell = self.offsets[cells + 1] - starts
+        box_of_pair = np.repeat(box_of_cell, segments_per_cell)
+        local = np.arange(len(box_of_pair)) - np.repeat(np.cumsum(segments_per_cell) - segments_per_cell, segments_per_cell)
+        segment_of_pair = self.segment_indices[np.repeat(starts, segments_per_cell) + local]
+
+        keys = np.unique(box_of_pair * self.segment_count + segment_of_pair)
+        return keys // self.segment_count, keys % self.segment_count